@@ -20,21 +20,53 @@ Use wiki_gendersort() class to assign a gender based on the built dataset.
 """
 
 from os.path import isfile
-from os import remove
-from shutil import copyfile
+from os import remove, replace, fsync, cpu_count
+from shutil import copyfile, copyfileobj
 from wikipedia import search, summary
 from datetime import datetime
 # from math import floor
 import wikipedia
 import json
+import re
 # import sys
 import string
+import struct
+import zlib
+import sys
+import mmap
+import gzip
+import bz2
+import heapq
+import io
+import ssl
+import sqlite3
+import time
+import random
+from collections import deque
+import requests
+import asyncio
+from urllib.parse import urlsplit, urlencode
+from html import unescape
+from bs4 import BeautifulSoup
+from tempfile import TemporaryFile, TemporaryDirectory
 from bisect import bisect_left
+from math import comb
+from array import array
 from unidecode import unidecode
 from pathlib import Path
-from multiprocessing import Pool
+from collections import OrderedDict, namedtuple
+from functools import partial
+from threading import Lock, Condition
+from multiprocessing import Pool, Manager
+from multiprocessing.managers import BaseManager
 from tqdm import tqdm
 
+try:
+    import numpy as np
+except ImportError:
+    # reclassify() then uses a loop over the names
+    np = None
+
 
 def index(a, x):
     """Locate the leftmost value exactly equal to x in an ordered list
@@ -68,12 +100,57 @@ def file_len(fname, encod):
     return(i+1)
 
 
+# Character classification tables, equivalent to testing unidecode(c) on
+# each character. Filled once for the most common code points, and lazily
+# for any other character the first time it is seen.
+ALPHA_CHARS = string.ascii_lowercase + string.ascii_uppercase
+VOWEL_CHARS = 'aeiouyAEIOUY'
+char_fold = {}
+char_alpha = {}
+char_vowel = {}
+
+
+def classify_char(c):
+    """Fills the classification tables for a single character
+
+    Parameters
+    ----------
+    c: str
+    A single character
+
+    Returns
+    -------
+    bool
+    True if the character counts as alphabetical in countalpha()
+    """
+    fold = unidecode(c)
+    char_fold[c] = fold
+    char_vowel[c] = fold in VOWEL_CHARS
+    is_alpha = fold in ALPHA_CHARS
+    char_alpha[c] = is_alpha
+    return is_alpha
+
+
+for code_point in range(0x250):
+    classify_char(chr(code_point))
+
+
+def isalpha_char(c):
+    "True if a single character counts as alphabetical in countalpha()"
+    is_alpha = char_alpha.get(c)
+    if is_alpha is None:
+        is_alpha = classify_char(c)
+    return is_alpha
+
+
 def countalpha(name):
     "Counts the number of alphabetical characters in a string"
     i = 0
-    chars = string.ascii_lowercase + string.ascii_uppercase
     for c in name:
-        if unidecode(c) in chars:
+        is_alpha = char_alpha.get(c)
+        if is_alpha is None:
+            is_alpha = classify_char(c)
+        if is_alpha:
             i += 1
     return(i)
 
@@ -82,11 +159,59 @@ def countvowel(name):
     "Counts the number of vowels in a string"
     i = 0
     for c in name:
-        if unidecode(c) in 'aeiouyAEIOUY':
+        is_vowel = char_vowel.get(c)
+        if is_vowel is None:
+            classify_char(c)
+            is_vowel = char_vowel[c]
+        if is_vowel:
             i += 1
     return(i)
 
 
+def fold_ascii(name):
+    "Transliterates a string to ASCII, the same way as unidecode()"
+    if name.isascii():
+        return name
+    folds = []
+    for c in name:
+        fold = char_fold.get(c)
+        if fold is None:
+            classify_char(c)
+            fold = char_fold[c]
+        folds.append(fold)
+    return ''.join(folds)
+
+
+def parse_log_record(d):
+    """Parses the log_data of a name, as written in NamesLog.txt
+
+    Returns
+    -------
+    tuple
+        (name, gender, datetime of the record), or None if d is not a
+        record.
+    """
+    if len(d) == 0:
+        return None
+    ds = d.split('\n')
+    if len(ds) < 2:
+        return None
+    name = ds[0]
+    gend = ds[-1].replace(' ', '').split('=')[-1]
+    return name, gend, parse_log_time(ds[-2])
+
+
+def parse_log_time(line):
+    "Parses the time line of a log record"
+    try:
+        return datetime.strptime(line, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        return datetime.strptime(line, '%Y-%m-%d %H:%M:%S')
+
+
+LOG_TIME = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(\.\d+)?')
+
+
 def lectdatalog(cwd, backup=True):
     "Cleans and imports data from log file"
     # Cleans log
@@ -96,47 +221,768 @@ def lectdatalog(cwd, backup=True):
     log_path = cwd / 'NamesLog.txt'
     if isfile(log_path):
         # Back-up of current log file
-        nbulog = 1
-        bu_name = log_path.stem + '_bu%i' % nbulog + log_path.suffix
-        while isfile(cwd / bu_name):
-            nbulog += 1
-            bu_name = log_path.stem + '_bu%i' % nbulog + log_path.suffix
-        copyfile(log_path, cwd / bu_name)
+        bu_path = backup_path(log_path)
+        copyfile(log_path, bu_path)
         if backup:
-            print('Copying ' + log_path.name + ' into ' + bu_name)
+            print('Copying ' + log_path.name + ' into ' + bu_path.name)
 
         print('Importing ' + log_path.stem)
         with open(log_path) as f:
             datalogtemp = f.read()
         datalogtemp = datalogtemp.split('\n\n')
         for d in datalogtemp:
-            if len(d) != 0:
-                ds = d.split('\n')
-                if len(ds) >= 2:
-                    name = ds[0]
-                    gend = ds[-1].replace(' ', '').split('=')[-1]
-                    try:
-                        time = datetime.strptime(ds[-2],
-                                                 '%Y-%m-%d %H:%M:%S.%f')
-                    except ValueError:
-                        time = datetime.strptime(ds[-2],
-                                                 '%Y-%m-%d %H:%M:%S')
-                    name_idx = bisect_left(datanames, name)
-                    if (name_idx != len(datanames) and
-                            datanames[name_idx] == name):
-                        if datalog[name_idx][2] < time:
-                            datalog[name_idx] = [name, gend, time, d]
-                    else:
-                        datanames.insert(name_idx, name)
-                        datalog.insert(name_idx, [name, gend, time, d])
+            record = parse_log_record(d)
+            if record is not None:
+                name, gend, time = record
+                name_idx = bisect_left(datanames, name)
+                if (name_idx != len(datanames) and
+                        datanames[name_idx] == name):
+                    if datalog[name_idx][2] < time:
+                        datalog[name_idx] = [name, gend, time, d]
+                else:
+                    datanames.insert(name_idx, name)
+                    datalog.insert(name_idx, [name, gend, time, d])
         if not backup:
-            remove(bu_name)
+            remove(bu_path)
 
     return datalog, datanames
 
 
-def name_to_gender(name):
-    "Assigns gender to a first name based on a wikipedia search"
+def backup_path(path):
+    "Returns the first path_bu1, path_bu2, ... that doesn't exist"
+    path = Path(path)
+    nbulog = 1
+    while isfile(path.parent / (path.stem + '_bu%i' % nbulog + path.suffix)):
+        nbulog += 1
+    return path.parent / (path.stem + '_bu%i' % nbulog + path.suffix)
+
+
+def scan_log(log_path, chunk_size=2**24):
+    """Reads the names and genders of a log file by chunks, without keeping
+    the log texts, for an incremental build.
+
+    The latest record of each name is kept, as in lectdatalog(). If the
+    log ends with an incomplete record (interrupted while writing), the
+    file is truncated after the last complete record.
+
+    Returns
+    -------
+    dict
+        Keys are the names and values their gender.
+    """
+    genders = {}
+    times = {}
+    if not isfile(log_path):
+        return genders
+    # end: end of the last complete record, offset: start of the next one
+    end = 0
+    offset = 0
+    complete = True
+    rest = b''
+    with open(log_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            records = (rest + chunk).split(b'\n\n')
+            rest = records.pop() if chunk else b''
+            for d in records:
+                d_start = offset
+                offset += len(d) + 2
+                if not d:
+                    continue
+                ds = d.decode('utf-8', 'replace').split('\n')
+                complete = (len(ds) >= 2 and
+                            LOG_TIME.fullmatch(ds[-2]) is not None and
+                            ds[-1].replace(' ', '').split('=')[-1]
+                            in GENDER_CODES)
+                if not complete:
+                    continue
+                end = d_start + len(d)
+                name = ds[0]
+                if name in times:
+                    # Only repeated names need the dates parsed
+                    time = parse_log_time(ds[-2])
+                    if time <= parse_log_time(times[name]):
+                        continue
+                times[name] = ds[-2]
+                genders[name] = ds[-1].replace(' ', '').split('=')[-1]
+            if not chunk:
+                break
+    if not complete:
+        print('Removing an incomplete record at the end of ' +
+              Path(log_path).name)
+        with open(log_path, 'r+b') as f:
+            f.truncate(end)
+    return genders
+
+
+def merge_names_out(out_path, names_raw, new_genders, log_genders=None):
+    """Updates NamesOut.txt with the genders of new names.
+
+    The gender of each name of names_raw is taken from new_genders, else
+    from log_genders, else from the existing out_path, else 'UNK'. The
+    file is replaced atomically.
+    """
+    gender_data = {}
+    if isfile(out_path):
+        with open(out_path, encoding='utf-8') as fileout:
+            for line in fileout:
+                line = line.rstrip('\n').split('\t')
+                if len(line) == 2:
+                    gender_data[line[0]] = line[1]
+    temp_path = Path(str(out_path) + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as fileout:
+        gender_data.update(log_genders or {})
+        gender_data.update(new_genders)
+        fileout.write('\n'.join([name + '\t' + gender_data.get(name, 'UNK')
+                                 for name in names_raw]))
+    replace(temp_path, out_path)
+
+
+def import_weights(weight_path):
+    """Imports the weights of first names, to process the most frequent
+    names first in build_dataset().
+
+    Each line of the file is a raw first name and its weight separated by
+    tabs, the weight being in the last column. This is the format of the
+    Web of Science authorship file of tables_for_article.import_wos(),
+    whose weights are ppm of authorship. The weight of a raw name goes to
+    the first string nameclean() gives for it, which is the one assign()
+    looks up first.
+
+    Returns
+    -------
+    dict
+        Keys are the cleaned first names and values their total weight.
+    """
+    weights = {}
+    with open(weight_path, encoding='utf-8') as file:
+        for lin in file:
+            ls = lin.rstrip('\n').replace('\ufeff', '').split('\t')
+            if len(ls) < 2:
+                continue
+            try:
+                weight = float(ls[-1])
+            except ValueError:
+                # Header
+                continue
+            names = nameclean(ls[0])
+            if names:
+                weights[names[0]] = weights.get(names[0], 0.) + weight
+    return weights
+
+
+class build_journal():
+    """Append-only journal of the name_to_gender() results of a build, in a
+    SQLite database, as an alternative to NamesLog.txt.
+
+    Each record keeps the name, gender, time and log_data. An index keeps
+    the latest record of each name (the first one if several have the same
+    time, as lectdatalog()), so the names and genders of a build are
+    loaded without reading the log texts.
+
+    Parameters
+    ----------
+    path: str or Path
+        Path to the journal. It is created if it doesn't exist.
+
+    Use import_log() to convert an existing NamesLog.txt.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.db = sqlite3.connect(str(self.path), isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS records ('
+                        'id INTEGER PRIMARY KEY, name TEXT, gender TEXT, '
+                        'time TEXT, log TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS latest ('
+                        'name TEXT PRIMARY KEY, gender TEXT, time TEXT, '
+                        'record_id INTEGER)')
+        self.in_transaction = False
+
+    def append(self, name, gender, log_data, time=None):
+        """Adds a record. If time (datetime) is None, it is read from
+        log_data. Records are committed with commit()."""
+        if time is None:
+            time = parse_log_record(log_data)[2]
+        time = time.strftime('%Y-%m-%d %H:%M:%S.%f')
+        if not self.in_transaction:
+            self.db.execute('BEGIN')
+            self.in_transaction = True
+        record_id = self.db.execute(
+            'INSERT INTO records (name, gender, time, log) '
+            'VALUES (?, ?, ?, ?)', (name, gender, time, log_data)).lastrowid
+        self.db.execute('INSERT INTO latest VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (name) DO UPDATE SET '
+                        'gender=excluded.gender, time=excluded.time, '
+                        'record_id=excluded.record_id '
+                        'WHERE excluded.time > latest.time',
+                        (name, gender, time, record_id))
+
+    def commit(self):
+        "Writes the appended records to disk"
+        if self.in_transaction:
+            self.db.execute('COMMIT')
+            self.in_transaction = False
+
+    def __contains__(self, name):
+        return self.db.execute('SELECT 1 FROM latest WHERE name=?',
+                               (name,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM latest').fetchone()[0]
+
+    def names(self):
+        "Returns the set of names in the journal"
+        return {row[0] for row in self.db.execute('SELECT name FROM latest')}
+
+    def genders(self):
+        "Returns a dict of the latest gender of each name"
+        return dict(self.db.execute('SELECT name, gender FROM latest'))
+
+    def log(self, name):
+        "Returns the latest log_data of a name, or None"
+        row = self.db.execute('SELECT log FROM records WHERE id = ('
+                              'SELECT record_id FROM latest WHERE name=?)',
+                              (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def records(self):
+        """Yields the (name, gender, log_data) of the latest record of each
+        name, sorted by name"""
+        yield from self.db.execute(
+            'SELECT latest.name, latest.gender, records.log FROM latest '
+            'JOIN records ON records.id = latest.record_id '
+            'ORDER BY latest.name')
+
+    def export_log(self, log_path):
+        """Writes the latest record of each name in the NamesLog.txt format,
+        sorted by name"""
+        with open(log_path, 'w', encoding='utf-8') as filelog:
+            first = True
+            for _, _, log_data in self.records():
+                if not first:
+                    filelog.write('\n\n')
+                filelog.write(log_data)
+                first = False
+
+    def close(self):
+        "Commits and closes the journal"
+        self.commit()
+        self.db.close()
+
+
+def iter_log(log_path, chunk_size=2**24):
+    "Yields the records of a log file, reading it by chunks"
+    rest = ''
+    with open(log_path, encoding='utf-8') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            records = (rest + chunk).split('\n\n')
+            if chunk:
+                # The last record may continue in the next chunk
+                rest = records.pop()
+            yield from records
+            if not chunk:
+                break
+
+
+def import_log(log_path, journal_path, chunk_size=2**24):
+    """Imports a NamesLog.txt log file into a build_journal, reading it by
+    chunks.
+
+    Parameters
+    ----------
+    log_path: str or Path
+        Path to the log file.
+
+    journal_path: str or Path
+        Path to the journal. Records are added if it already exists.
+
+    Returns
+    -------
+    build_journal
+    """
+    journal = build_journal(journal_path)
+    print('Importing ' + Path(log_path).name + ' into ' +
+          Path(journal_path).name)
+    for i, d in enumerate(iter_log(log_path, chunk_size)):
+        record = parse_log_record(d)
+        if record is not None:
+            journal.append(record[0], record[1], d, record[2])
+        if i % 10000 == 9999:
+            journal.commit()
+    journal.commit()
+    return journal
+
+
+def log_counts(log_data, cues=None):
+    """Returns the cue word counts of each page scored in the log_data of a
+    name, in order, as lists [method, he, his, she, her] (method 1) or
+    [method, men, male, women, female] (method 2), or with the words of
+    the methods of cues (a cue_counter, default is cue_counter())"""
+    if cues is None:
+        cues = cue_counter()
+    return cues.log_counts(log_data)
+
+
+def counts_record(name, gender, log_data, cues=None):
+    """Returns the line of a name in NamesCounts.jsonl: a JSON object with
+    its name, gender and the counts of its pages (see log_counts())"""
+    return json.dumps({'name': name,
+                       'gender': gender,
+                       'pages': log_counts(log_data, cues)},
+                      ensure_ascii=False) + '\n'
+
+
+def write_counts(records, counts_path, cues=None):
+    """Writes NamesCounts.jsonl for reclassify() from the
+    (name, gender, log_data) of records (for example
+    build_journal.records() or log_records())"""
+    print('Writing the page counts into ' + Path(counts_path).name)
+    if cues is None:
+        cues = cue_counter()
+    with open(counts_path, 'w', encoding='utf-8') as filecounts:
+        for name, gender, log_data in records:
+            filecounts.write(counts_record(name, gender, log_data, cues))
+
+
+def log_records(log_path, chunk_size=2**24):
+    """Yields the (name, gender, log_data) of the records of a log file, in
+    the order of the file"""
+    for d in iter_log(log_path, chunk_size):
+        record = parse_log_record(d)
+        if record is not None:
+            yield record[0], record[1], d
+
+
+PRONOUNS = ['he', 'his', 'she', 'her']
+KEYWORDS = ['men', 'male', 'women', 'female']
+# Male and female cue words of the two methods of name_to_gender_steps()
+METHOD_CUES = [(PRONOUNS[:2], PRONOUNS[2:]), (KEYWORDS[:2], KEYWORDS[2:])]
+
+
+class cue_counter():
+    """Counts the cue words of a gender in page summaries.
+
+    A cue word is counted where it is a separate word, between spaces,
+    line breaks, parenthesis, commas, periods or apostrophes, and not at the
+    very start or end of the summary. The counts are the ones of the
+    original scoring of name_to_gender() (str.count(' he ') after replacing
+    these characters by spaces, so two consecutive occurrences of the same
+    word share a delimiter and count once).
+
+    Each summary is lowercased and its delimiters replaced in a single
+    translation pass on its UTF-8 bytes, and all the cue words are then
+    found in a single pass of one regular expression. count_many() does
+    the translation and the pass once for a whole batch of summaries.
+
+    The counter also holds the cue words of the two methods of
+    name_to_gender_steps(), which scores a page with method_counts() and
+    logs its counts with log_line(), so a build can use other cue words
+    by passing another counter.
+
+    Parameters
+    ----------
+    words: list of str, optional
+        Cue words, in lowercase and without delimiters. The words of
+        methods that are not in words are counted after them.
+        Default is the words of methods.
+
+    methods: list of tuple, optional
+        (male words, female words) of method 1, which scores the summaries
+        of the pages found for a name, and of method 2, which scores the
+        search results of the name. Default is METHOD_CUES (he, his / she,
+        her and men, male / women, female).
+    """
+
+    table = bytes.maketrans(b"\n(),.'", b'      ')
+
+    def __init__(self, words=None, methods=None):
+        if methods is None:
+            methods = METHOD_CUES
+        self.methods = [(list(male), list(female))
+                        for male, female in methods]
+        self.words = [] if words is None else list(words)
+        for male, female in self.methods:
+            self.words += [w for w in male + female if w not in self.words]
+        self.cues = [(' ' + w + ' ').encode('utf-8') for w in self.words]
+        self.index = {w: i for i, w in enumerate(self.words)}
+        # The trailing delimiter is only looked at, so a word right after
+        # another one is found too
+        self.pattern = re.compile(
+            b' (' + b'|'.join(re.escape(w.encode('utf-8'))
+                              for w in self.words) + b')(?= )')
+        self.log_patterns = [
+            re.compile('^' + ' '.join(re.escape(w) + r'=(\d+)'
+                                      for w in male + female) + '$',
+                       re.MULTILINE)
+            for male, female in self.methods]
+
+    def count(self, text):
+        """Returns the list of the number of occurrences of each word in
+        text"""
+        return self.count_many([text])[0]
+
+    def count_many(self, texts):
+        """Returns the list of counts of count() for each text of a batch"""
+        texts = [t.lower().encode('utf-8', 'surrogatepass') for t in texts]
+        # A null byte between texts is not a delimiter, so no match spans
+        # two texts
+        data = b'\0'.join(texts).translate(self.table)
+        ends = [0]
+        for text in texts:
+            ends.append(ends[-1] + len(text) + 1)
+        counts = [{} for _ in texts]
+        # End of the last occurrence counted of each word
+        counted = {}
+        i = 0
+        for m in self.pattern.finditer(data):
+            start = m.start()
+            while start >= ends[i + 1]:
+                i += 1
+            word = m.group(1)
+            # As str.count(), an occurrence sharing its leading delimiter
+            # with the last one of the same word isn't counted
+            if start > counted.get(word, -1):
+                counted[word] = m.end()
+                counts[i][word] = counts[i].get(word, 0) + 1
+        words = [cue[1:-1] for cue in self.cues]
+        return [[c.get(word, 0) for word in words] for c in counts]
+
+    def method_counts(self, counts, method):
+        """Returns the total counts of the male words and of the female
+        words of a method (1 or 2) in the counts of count()"""
+        male, female = self.methods[method - 1]
+        return (sum(counts[self.index[w]] for w in male),
+                sum(counts[self.index[w]] for w in female))
+
+    def log_line(self, counts, method):
+        """Returns the counts of the words of a method (1 or 2) in the
+        counts of count(), as written in the log (he=1 his=0 she=2 her=0)"""
+        male, female = self.methods[method - 1]
+        return ' '.join('%s=%i' % (w, counts[self.index[w]])
+                        for w in male + female)
+
+    def log_counts(self, log_data):
+        """Returns the counts of the pages written by log_line() in the
+        log_data of a name, in order, as lists [method, counts of the male
+        words..., counts of the female words...]"""
+        pages = {}
+        for method, pattern in enumerate(self.log_patterns, 1):
+            for m in pattern.finditer(log_data):
+                pages.setdefault(m.start(),
+                                 [method] + [int(c) for c in m.groups()])
+        return [pages[start] for start in sorted(pages)]
+
+
+class evidence_store():
+    """Evidence of the Wikipedia pages reached by the names of a build, so
+    each page is fetched and scored once even when several names reach it
+    (through their search results or disambiguation options).
+
+    name_to_gender_steps() takes the evidence of a page from the store
+    instead of requesting its summary again.
+
+    Parameters
+    ----------
+    pages: dict, optional
+        Keys are page titles and values are tuples (kind, value), where kind
+        is 'page' (value is the list of counts of the cue_counter in the
+        summary,
+        or None if it is empty), 'disambiguation' (value is the list of
+        options) or 'missing' (value is None). It can be a dict shared
+        between processes (multiprocessing.Manager().dict()).
+        Default is None (a new dict).
+    """
+
+    def __init__(self, pages=None):
+        self.pages = {} if pages is None else pages
+        self.hits = 0
+        self.misses = 0
+        # Pages stored by the processes of names_to_gender(engine='pool'),
+        # which are not copied into pages
+        self.n_shared = 0
+
+    def get(self, title):
+        "Returns the (kind, value) of a page, or None if it is not stored"
+        evidence = self.pages.get(title)
+        if evidence is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return evidence
+
+    def put(self, title, kind, value=None):
+        "Stores the evidence of a page"
+        self.pages[title] = (kind, value)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def async_fetch(self, fetch):
+        """Wraps the coroutine fetch(endpoint, query) of async engine so
+        that simultaneous summary requests of the same page, made by names
+        processed at the same time, share a single request"""
+        pending = {}
+
+        async def shared_fetch(endpoint, query):
+            if endpoint != 'summary':
+                return await fetch(endpoint, query)
+            future = pending.get(query)
+            if future is None:
+                future = asyncio.ensure_future(fetch(endpoint, query))
+                pending[query] = future
+                future.add_done_callback(lambda f: pending.pop(query, None))
+            return await asyncio.shield(future)
+
+        return shared_fetch
+
+    def stats(self):
+        "Returns a dict of the number of pages stored, hits and misses"
+        return {'pages': len(self.pages) + self.n_shared,
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+def page_evidence(title, cues, evidence=None, frontier=None):
+    """Sub-generator of name_to_gender_steps() returning the counts of
+    the cue_counter cues in the summary of a page (None if it is empty), or
+    raising the error of its summary request.
+
+    The evidence is taken from the evidence store if it has the page, and
+    is stored otherwise. The summary request is counted in frontier.
+    """
+    if evidence is not None:
+        stored = evidence.get(title)
+        if stored is not None:
+            kind, value = stored
+            if kind == 'disambiguation':
+                raise wikipedia.exceptions.DisambiguationError(title, value)
+            if kind == 'missing':
+                raise wikipedia.exceptions.PageError(title)
+            return value
+    if frontier is not None:
+        frontier.request()
+    try:
+        tpag = (yield ('summary', title)).lower()
+    except wikipedia.exceptions.DisambiguationError as e:
+        if evidence is not None:
+            evidence.put(title, 'disambiguation', e.options)
+        raise
+    except wikipedia.exceptions.PageError:
+        if evidence is not None:
+            evidence.put(title, 'missing')
+        raise
+    counts = None
+    if len(tpag) != 0:
+        counts = cues.count(tpag)
+    if evidence is not None:
+        evidence.put(title, 'page', counts)
+    return counts
+
+
+def name_gender(genh, genf, ratio=3):
+    """Gender of a name from its number of pages refering to a man (genh)
+    and to a woman (genf): M or F if at least ratio times more pages refer
+    to that gender, UNI if not, and UNK if there are no pages."""
+    gender = 'UNK'
+    if genh >= ratio*genf and genh > 0:
+        gender = 'M'
+    if genf >= ratio*genh and genf > 0:
+        gender = 'F'
+    if gender == 'UNK' and (genh != 0 or genf != 0):
+        gender = 'UNI'
+    return gender
+
+
+class stopping_rule():
+    """Early stopping of the page loop of name_to_gender_steps().
+
+    The loop stops as soon as the pages left to reach the limit of
+    max_votes pages refering to a man or a woman can no longer change the
+    gender of the name, which gives the same gender with fewer summary
+    requests. For example, with the default limit of 20, a name stops
+    after 15 pages refering to a woman and none to a man.
+
+    If confidence is not None, the loop also stops when the probability
+    that at least 3/4 of the pages refer to the gender of the name (M or
+    F) reaches confidence, with a uniform prior on the proportion of pages
+    refering to a man. For example, with confidence=0.9, a name stops after
+    8 pages refering to a woman and none to a man. This can change the
+    gender of some names compared to a full search.
+
+    The log of a name that stopped early has a line 'stopped early, N pages
+    left in frontier', N being the number of pages waiting in its
+    page_frontier. This is only an estimate of the requests saved: the
+    limit could have been reached before visiting them all, and the
+    disambiguation pages among them would have added other pages.
+
+    Parameters
+    ----------
+    confidence: float, optional
+        Probability at which to stop. Default is None (exact rule only).
+
+    max_votes: int, optional
+        Maximum number of pages refering to a man or a woman per name, as
+        in name_to_gender(). Default is 20.
+    """
+
+    def __init__(self, confidence=None, max_votes=20):
+        self.confidence = confidence
+        self.max_votes = max_votes
+
+    def stop(self, genh, genf):
+        "Returns True if the page loop can stop"
+        gender = name_gender(genh, genf)
+        left = self.max_votes - genh - genf
+        if (name_gender(genh + left, genf) == gender and
+                name_gender(genh, genf + left) == gender):
+            return True
+        if self.confidence is None or gender not in ('M', 'F'):
+            return False
+        if gender == 'M':
+            return male_probability(genh, genf, 0.75) >= self.confidence
+        return 1 - male_probability(genh, genf, 0.25) >= self.confidence
+
+
+def male_probability(genh, genf, x):
+    """Probability that the proportion of pages refering to a man is above
+    x, with a uniform prior, after genh pages refering to a man and genf to
+    a woman"""
+    # The Beta(genh+1, genf+1) tail is a binomial sum
+    n = genh + genf + 1
+    return sum(comb(n, k) * x**k * (1-x)**(n-k) for k in range(genh + 1))
+
+
+# Logs written before the frontier said 'pages not fetched'
+STOP_LOG = re.compile(r'^stopped early, (\d+) pages '
+                      r'(?:left in frontier|not fetched)$', re.MULTILINE)
+REQUESTS_LOG = re.compile(r'^(\d+) requests(?:, (\d+) pages)?$',
+                          re.MULTILINE)
+
+
+class page_frontier():
+    """Pages left to visit for a name in name_to_gender_steps().
+
+    Pages are visited in the order they are added, and a page is only added
+    once. The pages of the search, which are the exact 'FIRST_NAME Last'
+    titles, come first. When a page is a disambiguation, its first option
+    is visited right after it and its other options are deferred. Once
+    the queue is empty, the disambiguation pages with deferred options take
+    turns to add their next option. As in the original page loop, the walk
+    ends when the next deferred option was already visited, or when the
+    disambiguation page whose turn it is has no options left.
+
+    Parameters
+    ----------
+    pages: list of str, optional
+        First pages to visit. Default is ().
+
+    max_requests: int, optional
+        Maximum number of requests (searches and summaries) for the name.
+        Pages taken from an evidence_store don't count. If None, there is
+        no limit. Default is None.
+
+    max_pages: int, optional
+        Maximum number of pages visited for the name. If None, there is no
+        limit. Default is None.
+
+    max_options: int, optional
+        Maximum number of options kept per disambiguation page.
+        Default is 20.
+
+    len() gives the number of pages left (at most), n_requests and n_pages
+    the requests made and pages visited, and over_budget is True once a
+    budget ended the walk.
+    """
+
+    def __init__(self,
+                 pages=(),
+                 max_requests=None,
+                 max_pages=None,
+                 max_options=20):
+        self.max_requests = max_requests
+        self.max_pages = max_pages
+        self.max_options = max_options
+        self.queue = deque()
+        self.deferred = deque()
+        self.seen = set()
+        self.n_requests = 0
+        self.n_pages = 0
+        self.over_budget = False
+        for page in pages:
+            self.add(page)
+
+    def add(self, page):
+        "Adds a page at the end of the queue, if it was never added"
+        if page not in self.seen:
+            self.seen.add(page)
+            self.queue.append(page)
+
+    def add_options(self, options):
+        """Adds the options of the disambiguation page just visited: the
+        first one is visited next and the others are deferred"""
+        kept = deque()
+        for page in options:
+            if page not in self.seen and len(kept) < self.max_options:
+                kept.append(page)
+        if kept:
+            page = kept.popleft()
+            self.seen.add(page)
+            self.queue.appendleft(page)
+            self.deferred.append(kept)
+
+    def request(self):
+        "Counts a request made for the name"
+        self.n_requests += 1
+
+    def pop(self):
+        "Returns the next page to visit, or None if the walk is over"
+        if ((self.max_pages is not None and
+             self.n_pages >= self.max_pages) or
+                (self.max_requests is not None and
+                 self.n_requests >= self.max_requests)):
+            self.over_budget = True
+            return None
+        if not self.queue and self.deferred:
+            options = self.deferred.popleft()
+            if options and options[0] not in self.seen:
+                self.add(options.popleft())
+            if options:
+                self.deferred.append(options)
+        if not self.queue:
+            return None
+        self.n_pages += 1
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue) + sum(len(o) for o in self.deferred)
+
+
+def name_to_gender_steps(name,
+                         evidence=None,
+                         stopping=None,
+                         max_requests=None,
+                         max_pages=None,
+                         cues=None):
+    """Decision logic of name_to_gender(), independent of how Wikipedia is
+    queried.
+
+    This generator yields the Wikipedia requests it needs as tuples
+    ('search', query) or ('summary', page_title). The result of each request
+    (the list of page titles for a search, the page summary for a summary)
+    must be sent back with send(), or the exception raised by the request
+    must be thrown back with throw(). The generator returns the same
+    (gender, log_data) as name_to_gender(). See run_steps().
+
+    If evidence is an evidence_store, the pages it has are not requested.
+    If stopping is a stopping_rule, the pages are no longer requested once
+    it says so. max_requests and max_pages are the budgets of the name (see
+    page_frontier()). The number of requests made and of pages visited
+    are logged. cues is the cue_counter scoring the pages (default is
+    cue_counter(), with the pronouns and keywords of METHOD_CUES).
+    """
 
     log_data = name
     gender = 'UNK'
@@ -154,6 +1000,8 @@ def name_to_gender(name):
         log_data += name + ' = ' + gender
         return gender, log_data
 
+    if cues is None:
+        cues = cue_counter()
     # genh: # of pages refering to a man. genf: woman.
     genh = 0
     genf = 0
@@ -166,115 +1014,82 @@ def name_to_gender(name):
     ntry = 0
     while ntry <= 1 and gender == 'UNK':
         ntry += 1
-    # filtered pages, which are the ones kept from the wikipedia search.
-    # The second list contains added disambiguations, if needed
-        fpag = []
-        fpag2 = []
+    # filtered pages, which are the ones kept from the wikipedia search,
+    # and the disambiguation options added to them
+        frontier = page_frontier(max_requests=max_requests,
+                                 max_pages=max_pages)
         log_data += '\n'+str(ntry)+'\n'
         try:
+            frontier.request()
             if ntry == 1:
-                for pag in search(nam, results=1000):
+                for pag in (yield ('search', nam)):
                     if (pag[:len(nam)+1] == nam+' ' and
                             pag[len(nam)+1].isupper()):
-                        fpag.append(pag)
+                        frontier.add(pag)
             if ntry == 2:
-                fpag.append(''.join(search(nam, results=1000)))
+                frontier.add(''.join((yield ('search', nam))))
         except wikipedia.exceptions.WikipediaException:
             pass
         except json.decoder.JSONDecodeError:
             pass
     # Pages analysis
-        for pag in fpag:
-            tpag = ''
-            heocc = 0
-            hisocc = 0
-            sheocc = 0
-            herocc = 0
+        while True:
+            pag = frontier.pop()
+            if pag is None:
+                break
+            counts = None
             if ntry == 1:
                 log_data += pag
                 # If page does not exist of is a disambiguation
                 try:
                     # The following line if the true code bottleneck
-                    tpag = summary(pag).lower()
+                    counts = yield from page_evidence(pag, cues, evidence,
+                                                      frontier)
                     log_data += '\n'
                 except wikipedia.exceptions.DisambiguationError as e:
                     log_data += ' - DISAMBIGUATION\n'
-                    fpag2.append([])
-                    for dpag in e.options:
-                        if (((dpag[:len(nam)+1] == nam+' ' and
+                    frontier.add_options(
+                        [dpag for dpag in e.options
+                         if ((dpag[:len(nam)+1] == nam+' ' and
                               dpag[len(nam)+1].isupper() and
                               ntry == 1) or
                              (dpag[-len(nam)-1:] == ' '+nam or
-                              ' '+nam+' (' in dpag)) and
-                                dpag not in fpag and
-                                len(fpag2[-1]) < 20):
-                            fpag2[-1].append(dpag)
-                    if len(fpag2[-1]) == 0:
-                        fpag2.pop()
-                    elif fpag2[-1][0] not in fpag:
-                        fpag.insert(fpag.index(pag)+1, fpag2[-1].pop(0))
+                              ' '+nam+' (' in dpag))])
                 except wikipedia.exceptions.PageError:
                     pass
                 except wikipedia.exceptions.WikipediaException:
                     pass
                 except json.decoder.JSONDecodeError:
                     pass
-            elif ntry == 2:
-                tpag = pag.lower()
-            # Counts the number of 'he', 'his', 'she' and 'her'
-            # (and variants) to identify the gender
-            if len(tpag) != 0:
-                tpag = tpag.replace('\n', ' ')
-                tpag = tpag.replace('(', ' ')
-                tpag = tpag.replace(')', ' ')
-                tpag = tpag.replace(",", ' ')
-                tpag = tpag.replace(".", ' ')
-                tpag = tpag.replace("'", ' ')
-                if ntry == 1:
-                    heocc = tpag.count(' he ')
-                    sheocc = tpag.count(' she ')
-                    hisocc = tpag.count(' his ')
-                    herocc = tpag.count(' her ')
-                    log_data += ('he='+str(heocc) +
-                                 ' his='+str(hisocc) +
-                                 ' she='+str(sheocc) +
-                                 ' her='+str(herocc) +
-                                 '\n')
-                elif ntry == 2:
-                    heocc = tpag.count(' men ')
-                    hisocc = tpag.count(' male ')
-                    sheocc = tpag.count(' women ')
-                    herocc = tpag.count(' female ')
-                    log_data += ('men='+str(heocc) +
-                                 ' male='+str(hisocc) +
-                                 ' women='+str(sheocc) +
-                                 ' female='+str(herocc) +
-                                 '\n')
-                if heocc+hisocc >= 3*(sheocc+herocc) and heocc+hisocc > 0:
+            elif ntry == 2 and len(pag) != 0:
+                counts = cues.count(pag.lower())
+            # Counts the number of male cues ('he', 'his' or 'men', 'male')
+            # and female cues to identify the gender
+            if counts is not None:
+                maleocc, femaleocc = cues.method_counts(counts, ntry)
+                log_data += cues.log_line(counts, ntry) + '\n'
+                if maleocc >= 3*femaleocc and maleocc > 0:
                     genh += 1
-                elif (sheocc+herocc >= 3*(heocc+hisocc) and
-                      sheocc+herocc > 0):
+                elif femaleocc >= 3*maleocc and femaleocc > 0:
                     genf += 1
-            # Adding an element of fpag2 if we don't have enough data
-            if (fpag.index(pag) == len(fpag)-1) and (len(fpag2) > 0):
-                if len(fpag2[0]) > 0:
-                    if fpag2[0][0] not in fpag:
-                        fpag.append(fpag2[0].pop(0))
-                if len(fpag2[0]) > 0:
-                    fpag2.append(fpag2[0])
-                if len(fpag2) == 1 and len(fpag2[0]) == 0:
-                    fpag2 = []
-                else:
-                    fpag2 = fpag2[1:]
             if genh + genf >= 20:
                 break
-            # Unisex if less than 3/4 of occurences are of the same gender
-        if genh >= 3*genf and genh > 0:
-            gender = 'M'
-        if genf >= 3*genh and genf > 0:
-            gender = 'F'
-        if (gender == 'UNK' and (genh != 0 or genf != 0)):
-            gender = 'UNI'
+            if stopping is not None and stopping.stop(genh, genf):
+                left = len(frontier)
+                if left > 0:
+                    log_data += ('stopped early, %i pages left in frontier\n'
+                                 % left)
+                    break
+        # The title of a missing page isn't followed by a line break
+        if log_data[-1] != '\n':
+            log_data += '\n'
+        if frontier.over_budget and len(frontier) > 0:
+            log_data += ('budget reached, %i pages left in frontier\n' %
+                         len(frontier))
+        log_data += '%i requests, %i pages\n' % (frontier.n_requests,
+                                                 frontier.n_pages)
+        # Unisex if less than 3/4 of occurences are of the same gender
+        gender = name_gender(genh, genf)
         if ntry <= 2:
             log_data += name + ' = %iH %iF\n' % (genh, genf)
         log_data += str(datetime.now()) + '\n'
@@ -283,177 +1098,3007 @@ def name_to_gender(name):
     return gender, log_data
 
 
-def build_dataset(reboot=False):
-    """Builds the database of gender based on Wikipedia search.
+class ThrottledError(Exception):
+    """Raised when Wikipedia requests keep failing because of throttling
+    or server errors after all retries. Contrary to the other errors, it is
+    not caught by name_to_gender(), so the name is not assigned UNK and
+    can be retried in a later build."""
 
-    This code takes a list of first names separated by a line break \n
-    in file Names.txt and constructs a database in NamesOut.txt by assigning
-    them a gender.
 
-    NamesOut.txt will contain the same names, but followed by the
-    assigned gender (both of them being seprated by a tab \t).
+def retry_delay(attempt, base_delay=1., max_delay=60.):
+    "Random exponential backoff delay in seconds before a retry"
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
 
-    The gender attribution (M, F, UNI, INI or UNK) is done according to the
-    occurrence of first names on Wikipedia pages concerning them.
-    M: male
-    F: female
-    UNI: unisex
-    INI: initials
-    UNK: unknown
 
-    If NamesOut.txt already exists, it will be ignored and overwritten.
-    Information on gender assignment is present in the log file (NamesLog.txt).
-    The log file is automatically detected to launch the code back where it was
-    in the case it got interrupted.
+def is_rate_limited(error):
+    """True if a WikipediaException raised by the wikipedia package is an
+    API rate limit (ratelimited) or replication lag (maxlag) error.
 
-    Set reboot=True if you want to disregard log files and start from scratch
-    """
+    The wikipedia package raises the API errors as a plain
+    WikipediaException with the error info as message. Its subclasses
+    (DisambiguationError, PageError...) are never throttling, even if
+    their titles or options contain these words."""
+    if type(error) is not wikipedia.exceptions.WikipediaException:
+        return False
+    message = str(error).lower()
+    return any(word in message for word in ('ratelimited', 'rate limit',
+                                            'maxlag', 'lagged'))
 
-    cwd = Path(__file__).parent.absolute()
-    inputnames = cwd / 'Names.txt'
 
-    # namestot: List of str names to attribute a gender to
-    namestot_raw = ['']
-    with open(inputnames, 'r') as namefile:
-        namestot_raw = namefile.read().split('\n')
+def wiki_fetch(endpoint, query, max_retries=5, controller=None, metrics=None):
+    """Answers a name_to_gender_steps() request with the wikipedia package.
 
-    print('Names sorting')
-    namestot = sorted(list(set(namestot_raw)))
-    print('Log reading')
-    datalog, datanames = lectdatalog(cwd)
-    if index(datanames, '') == -1 or not datanames or reboot:
-        datanames += ['']
-        datalog += [['',
-                     'UNK',
-                     datetime.now(),
-                     '\nname is empty\n' + str(datetime.now()) + '\n = UNK']]
+    Requests that fail with an invalid JSON answer (which Wikipedia sends
+    when throttling), an API rate limit or maxlag error, a timeout or a
+    connection error are retried max_retries times with random exponential
+    backoff, before raising a ThrottledError.
 
-    print('Names treatment')
-    # Keeping only names that are not in log file in namesfil
-    namesfil = []
-    for name in namestot:
-        if index(datanames, name) == -1:
-            namesfil.append(name)
+    If controller is a concurrency_controller (or a proxy of one shared by
+    several processes, see controller_manager), each attempt waits for its
+    limit and records its latency and whether it was throttled. If metrics
+    is a build_metrics, the latency and exception of each attempt are
+    recorded there, without the backoff delays.
+    """
+    for attempt in range(max_retries + 1):
+        if controller is not None:
+            controller.acquire()
+        start = time.perf_counter()
+        error = None
+        throttled = False
+        try:
+            if endpoint == 'search':
+                return search(query, results=1000)
+            return summary(query, auto_suggest=False)
+        except (json.decoder.JSONDecodeError,
+                wikipedia.exceptions.HTTPTimeoutError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            error = e
+            throttled = True
+        except wikipedia.exceptions.WikipediaException as e:
+            error = e
+            if not is_rate_limited(e):
+                raise
+            throttled = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            if controller is not None:
+                controller.record(latency, throttled)
+                controller.release()
+            if metrics is not None:
+                metrics.request_done(endpoint, latency, error)
+        if attempt < max_retries:
+            time.sleep(retry_delay(attempt))
+    throttled_error = ThrottledError('%s %r failed %i times: %r' %
+                                     (endpoint, query, max_retries + 1,
+                                      error))
+    if metrics is not None:
+        metrics.exception(throttled_error)
+    raise throttled_error
 
-    print('Fetching names data from Wikipedia')
-    # tn = cpu_count()
-    # Since the bottleneck is waiting for the wikipedia server to ping back,
-    # n_pool should be as high as possible
-    n_pool = 25
-    with open(cwd / 'NamesLog.txt', 'w', encoding='utf-8') as filelog:
-        filelog.write('\n\n'.join([d[3] for d in datalog]))
-        with Pool(n_pool) as pool:
-            with tqdm(total=len(namesfil)) as pbar:
-                for gender, log_data in pool.imap_unordered(name_to_gender,
-                                                            namesfil):
-                    pbar.update()
-                    filelog.write('\n\n'+log_data)
 
-    print('Saving out file in NamesOut.txt')
-    datalog, datanames = lectdatalog(cwd, backup=False)
-    gender_data = {k[0]: k[1] for k in datalog}
-    with open(cwd / 'NamesOut.txt', 'w', encoding='utf-8') as fileout:
-        fileout.write('\n'.join([name + '\t' + gender_data[name]
-                                 for name in namestot_raw]))
-    print('Done')
+def run_steps(steps, fetch=wiki_fetch):
+    """Runs a name_to_gender_steps() generator, answering its requests with
+    fetch(endpoint, query), and returns its (gender, log_data)"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                result = fetch(*request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
 
 
-def nameclean(first_name):
-    """Cleans a first name string and separates it into a list of strings,
-    ordered by priority, to analyze for Wiki-Gendersort.
-    """
+def name_to_gender(name, stopping=None, max_requests=None, max_pages=None,
+                   cues=None):
+    "Assigns gender to a first name based on a wikipedia search"
+    return run_steps(name_to_gender_steps(name, stopping=stopping,
+                                          max_requests=max_requests,
+                                          max_pages=max_pages, cues=cues))
 
-    name = first_name
-    # Puts words in quotations and parenthesis at the end of the string
-    while True:
-        left_i = -1
-        right_i = -1
-        if ('"' in name and name.find('"') != name.rfind('"')):
-            left_i = name.find('"')
-            right_i = left_i + 1 + name[left_i+1:].find('"')
-        if ('(' in name and ')' in name and
-                name.find('(') < name.rfind(')')):
-            left_i = name.find('(')
-            right_i = name.rfind(')')
-        if left_i != -1 and right_i != -1:
-            name = (name[:left_i] + ' ' +
-                    name[right_i+1:] + ' ' +
-                    name[left_i+1:right_i])
-        else:
-            break
 
-    # Separates the string in sequences with anything not a letter or a
-    # period acting as delimiter
-    namf = ''
-    for i in name:
-        if countalpha(i) >= 1 or i in {'.', '-'}:
-            namf += i
-        else:
-            namf += ' '
-    namf = [n for n in namf.split() if countalpha(n) != 0]
+class response_cache():
+    """Persistent cache of the answers to name_to_gender_steps() requests,
+    in a SQLite database.
 
-    # Separates fused strings and gets rid of periods at the end of strings,
-    # separating them if capitalization suggests it (AliM. -> Ali M),
-    # and puts the strings that ended with a period as the end of the sequence
-    j = 0
-    while j < len(namf):
-        if (len(namf[j]) >= 4 and
-                namf[j][-1] == '.' and
-                namf[j][-2].isupper() and
-                namf[j][-3].islower()):
-            namf.insert(j+1, namf[j][-2:])
-            namf[j] = namf[j][:-2]
-        if namf[j][-1] == '.' and 4 > len(namf[j]) > 1:
-            namf.append(namf[j][:-1])
-            del namf[j]
-            j -= 1
-        j += 1
+    Search results and summaries are stored, as well as disambiguation
+    options and missing pages (which are replayed as the same
+    DisambiguationError and PageError). Other errors are not cached since
+    they are usually temporary.
 
-    # Resplit any period that remains (A.Carl -> A Carl)
-    j = 0
-    while j < len(namf):
-        if '.' in namf[j]:
-            namsplit = namf[j].split('.')[::-1]
-            for n in namsplit:
-                namf.insert(j + 1, n)
-            del namf[j]
-            j += len(namsplit)-1
-        j += 1
+    Parameters
+    ----------
+    path: str or Path
+        Path to the SQLite database. It is created if it doesn't exist, and
+        can be shared by several processes.
 
-    # Hyphens will duplicate the sequence and its components:
-    # "John-Paul" -> ["John-Paul", "John", "Paul"]
-    j = 0
-    while j < len(namf):
-        # namf[j] = '-'.join([n for n in namf[j].split('-') if n])
-        while namf[j] and namf[j][0] == '-':
-            namf[j] = namf[j][1:]
-        while namf[j] and namf[j][-1] == '-':
-            namf[j] = namf[j][:-1]
-        if '-' in namf[j]:
-            for n in namf[j].split('-')[::-1]:
-                namf.insert(j + 1, n)
-        j += 1
+    ttl: float, optional
+        Time to live of the entries, in seconds. Older entries are fetched
+        again, and deleted as new entries are stored. If None, entries never
+        expire. Default is None.
 
-    # Takes the strings that are not initials (if 1 letter or no vowels)
-    # and duplicates any string not corresponding to unidecode characters
-    namf2 = []
-    for nam in namf:
-        if countalpha(nam) > 1 and countvowel(nam) > 0:
-            if len(nam) <= 1:
-                n = nam.upper()
-            else:
-                n = nam[0].upper()+nam[1:].lower()
-            namf2.append(n)
-            un = unidecode(n)
-            if n != un:
-                namf2.append(un)
-    return namf2
+    max_entries: int, optional
+        Maximum number of entries. When exceeded, the oldest entries are
+        deleted. If None, there is no limit. Default is None.
+
+    Use fetch() or async_fetch() to add the cache in front of a request
+    function, and stats() for the hit rate.
+    """
+
+    def __init__(self,
+                 path,
+                 ttl=None,
+                 max_entries=None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(str(self.path), timeout=60,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'endpoint TEXT, query TEXT, kind TEXT, value TEXT, '
+                        'time REAL, PRIMARY KEY (endpoint, query))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_time '
+                        'ON responses (time)')
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.n_puts = 0
+
+    def get(self, endpoint, query):
+        """Returns the cached (kind, value) of a request, or None if it is
+        not cached or expired"""
+        with self.lock:
+            row = self.db.execute('SELECT kind, value, time FROM responses '
+                                  'WHERE endpoint=? AND query=?',
+                                  (endpoint, query)).fetchone()
+            if row is not None and (self.ttl is None or
+                                    row[2] >= time.time() - self.ttl):
+                self.hits += 1
+                return row[0], json.loads(row[1])
+            if row is not None:
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, endpoint, query, kind, value):
+        "Stores the answer to a request"
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (endpoint, query, kind, json.dumps(value),
+                             time.time()))
+            self.n_puts += 1
+            if ((self.ttl is not None or self.max_entries is not None)
+                    and self.n_puts % 1000 == 1):
+                self.evict()
+
+    def evict(self):
+        "Deletes expired entries, and the oldest ones above max_entries"
+        if self.ttl is not None:
+            self.db.execute('DELETE FROM responses WHERE time < ?',
+                            (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            self.db.execute('DELETE FROM responses WHERE rowid IN ('
+                            'SELECT rowid FROM responses ORDER BY time DESC '
+                            'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def replay(self, entry):
+        "Returns the cached result, or raises the cached exception"
+        kind, value = entry
+        if kind == 'disambiguation':
+            raise wikipedia.exceptions.DisambiguationError(*value)
+        if kind == 'page_error':
+            raise wikipedia.exceptions.PageError(value)
+        return value
+
+    def store(self, endpoint, query, fetch_error, result=None):
+        "Caches a result, or the exception raised by the request"
+        if fetch_error is None:
+            self.put(endpoint, query, 'result', result)
+        elif isinstance(fetch_error,
+                        wikipedia.exceptions.DisambiguationError):
+            self.put(endpoint, query, 'disambiguation',
+                     [fetch_error.title, fetch_error.options])
+        elif isinstance(fetch_error, wikipedia.exceptions.PageError):
+            self.put(endpoint, query, 'page_error', query)
+
+    def fetch(self, fetch):
+        "Adds the cache in front of a request function fetch(endpoint, query)"
+        def cached_fetch(endpoint, query):
+            entry = self.get(endpoint, query)
+            if entry is not None:
+                return self.replay(entry)
+            try:
+                result = fetch(endpoint, query)
+            except Exception as e:
+                self.store(endpoint, query, e)
+                raise
+            self.store(endpoint, query, None, result)
+            return result
+        return cached_fetch
+
+    def async_fetch(self, fetch):
+        """Adds the cache in front of a request coroutine
+        fetch(endpoint, query)"""
+        async def cached_fetch(endpoint, query):
+            entry = self.get(endpoint, query)
+            if entry is not None:
+                return self.replay(entry)
+            try:
+                result = await fetch(endpoint, query)
+            except Exception as e:
+                self.store(endpoint, query, e)
+                raise
+            self.store(endpoint, query, None, result)
+            return result
+        return cached_fetch
+
+    def stats(self):
+        """Returns a dict of the hits, misses (including expired entries),
+        expired entries, hit rate and number of entries"""
+        with self.lock:
+            n_entries = self.db.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+            n_requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'expired': self.expired,
+                    'hit_rate': self.hits/n_requests if n_requests else 0.,
+                    'entries': n_entries}
+
+    def close(self):
+        "Closes the database"
+        self.db.close()
+
+
+class histogram():
+    """Counts of observations by bucket, as in a Prometheus histogram.
+
+    Parameters
+    ----------
+    bounds: list of float
+        Upper bounds of the buckets, in increasing order. The values above
+        the last bound are counted in a last bucket.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        "Counts a value"
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def add(self, other):
+        "Adds the counts of another histogram with the same bounds"
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def count(self):
+        "Returns the number of values counted"
+        return sum(self.counts)
+
+
+# Buckets of the histograms of build_metrics
+METRIC_BUCKETS = {'request_seconds': [0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                      1., 2.5, 5., 10., 30.],
+                  'pages_per_name': [0, 1, 2, 5, 10, 20, 30, 50, 100],
+                  'requests_per_name': [1, 2, 5, 10, 20, 30, 50, 100],
+                  'log_write_seconds': [1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.]}
+
+
+class build_metrics():
+    """Metrics of a dataset build, to export as a JSON snapshot or a
+    Prometheus textfile while it runs.
+
+    The metrics are:
+    - request_seconds: histogram of the latency of each attempt of the
+      Wikipedia requests, without the backoff delays between retries, by
+      call: 'search', 'summary', or 'disambiguation' for the summaries of
+      disambiguation pages (with the async engine, the second request
+      giving their options). Cached responses are not counted.
+    - exceptions: number of exceptions raised by the requests, by type,
+      and of the throttled attempts that were retried (by exception type,
+      or HTTP status or API error code with the async engine).
+      name_to_gender_steps() handles most of them as a page without
+      evidence, without logging them.
+    - pages_per_name and requests_per_name: histograms of the pages
+      visited and requests made for each name, from their log.
+    - log_write_seconds: histogram of the time to write the record of each
+      name.
+    - stage_seconds: time spent in each stage of build_dataset().
+    - gauges: names done and pending, names per second, requests in
+      flight and concurrency limit.
+
+    The request functions record their attempts with request_done() (see
+    wiki_fetch() and async_wiki_api()). Use async_fetch() to count the
+    exceptions of a coroutine request function, and pop() and add() to
+    gather the metrics of other processes.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.histograms = {}
+        self.exceptions = {}
+        self.stages = {}
+        self.gauges = {'names_done': 0}
+
+    def observe(self, metric, value, call=None):
+        "Adds a value to the histogram of a metric"
+        key = (metric, call)
+        if key not in self.histograms:
+            self.histograms[key] = histogram(METRIC_BUCKETS[metric])
+        self.histograms[key].observe(value)
+
+    def request_done(self, call, seconds, error=None):
+        """Records a request attempt that took seconds, and the exception it
+        raised or the name of its error"""
+        if isinstance(error, wikipedia.exceptions.DisambiguationError):
+            call = 'disambiguation'
+        self.observe('request_seconds', seconds, call)
+        if error is not None:
+            self.exception(error)
+
+    def exception(self, error):
+        "Counts an exception, or an error given by its name"
+        kind = error if isinstance(error, str) else type(error).__name__
+        self.exceptions[kind] = self.exceptions.get(kind, 0) + 1
+
+    def async_fetch(self, fetch):
+        """Returns a coroutine function answering with the coroutine
+        fetch(endpoint, query) and counting the exceptions it raises"""
+        async def counted_fetch(endpoint, query):
+            try:
+                return await fetch(endpoint, query)
+            except Exception as e:
+                self.exception(e)
+                raise
+        return counted_fetch
+
+    def name_done(self, log_data):
+        """Counts a name done, with the pages and requests given in its
+        log_data"""
+        for n_requests, n_pages in REQUESTS_LOG.findall(log_data):
+            self.observe('requests_per_name', int(n_requests))
+            if n_pages:
+                self.observe('pages_per_name', int(n_pages))
+        self.gauges['names_done'] += 1
+
+    def stage_time(self, stage, seconds):
+        "Adds time spent in a stage of the build"
+        self.stages[stage] = self.stages.get(stage, 0.) + seconds
+
+    def pop(self):
+        """Returns the histograms and exception counts recorded since the
+        last call, to add() them to the metrics of another process"""
+        state = (self.histograms, self.exceptions)
+        self.histograms = {}
+        self.exceptions = {}
+        return state
+
+    def add(self, state):
+        "Adds the histograms and exception counts returned by pop()"
+        histograms, exceptions = state
+        for key, hist in histograms.items():
+            if key in self.histograms:
+                self.histograms[key].add(hist)
+            else:
+                self.histograms[key] = hist
+        for kind, n in exceptions.items():
+            self.exceptions[kind] = self.exceptions.get(kind, 0) + n
+
+    def snapshot(self):
+        "Returns the metrics as a dict that can be saved as JSON"
+        elapsed = time.time() - self.start
+        gauges = dict(self.gauges)
+        gauges['names_per_second'] = (gauges['names_done']/elapsed
+                                      if elapsed > 0 else 0.)
+        histograms = {}
+        for (metric, call), hist in sorted(self.histograms.items(),
+                                           key=lambda k: (k[0][0],
+                                                          k[0][1] or '')):
+            data = {'bounds': hist.bounds,
+                    'counts': hist.counts,
+                    'sum': hist.sum,
+                    'count': hist.count()}
+            if call is None:
+                histograms[metric] = data
+            else:
+                histograms.setdefault(metric, {})[call] = data
+        return {'time': str(datetime.now()),
+                'elapsed_seconds': elapsed,
+                'gauges': gauges,
+                'stage_seconds': dict(self.stages),
+                'exceptions': dict(self.exceptions),
+                'histograms': histograms}
+
+    def prometheus(self, prefix='wiki_gendersort_'):
+        "Returns the metrics in the Prometheus text format"
+        snapshot = self.snapshot()
+        lines = []
+        for gauge, value in sorted(snapshot['gauges'].items()):
+            lines += ['# TYPE %s%s gauge' % (prefix, gauge),
+                      '%s%s %s' % (prefix, gauge, value)]
+        lines.append('# TYPE %sstage_seconds_total counter' % prefix)
+        for stage, value in sorted(snapshot['stage_seconds'].items()):
+            lines.append('%sstage_seconds_total{stage="%s"} %s' %
+                         (prefix, stage, value))
+        lines.append('# TYPE %sexceptions_total counter' % prefix)
+        for kind, n in sorted(snapshot['exceptions'].items()):
+            lines.append('%sexceptions_total{type="%s"} %i' %
+                         (prefix, kind, n))
+        types = set()
+        for (metric, call), hist in sorted(self.histograms.items(),
+                                           key=lambda k: (k[0][0],
+                                                          k[0][1] or '')):
+            if metric not in types:
+                lines.append('# TYPE %s%s histogram' % (prefix, metric))
+                types.add(metric)
+            labels = '' if call is None else 'call="%s",' % call
+            total = 0
+            for bound, n in zip(hist.bounds + ['+Inf'], hist.counts):
+                total += n
+                lines.append('%s%s_bucket{%sle="%s"} %i' %
+                             (prefix, metric, labels, bound, total))
+            labels = '{%s}' % labels[:-1] if labels else ''
+            lines += ['%s%s_sum%s %s' % (prefix, metric, labels, hist.sum),
+                      '%s%s_count%s %i' % (prefix, metric, labels, total)]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes the metrics in a file, in the Prometheus text format if its
+        name ends with .prom (for the textfile collector of the node
+        exporter) and as JSON otherwise. The file is replaced atomically."""
+        path = Path(path)
+        temp_path = Path(str(path) + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            if path.suffix == '.prom':
+                file.write(self.prometheus())
+            else:
+                json.dump(self.snapshot(), file, indent=1)
+        replace(temp_path, path)
+
+
+# Request function of the processes of names_to_gender(engine='pool')
+pool_fetch = wiki_fetch
+pool_cache = None
+pool_evidence = None
+pool_stopping = None
+pool_budget = (None, None)
+pool_cues = None
+pool_metrics = None
+
+
+def init_pool_worker(cache_path, cache_ttl, cache_size, shared_pages=None,
+                     stopping=None, max_requests=None, max_pages=None,
+                     metrics=False, controller=None, cues=None):
+    """Opens the response cache and the evidence store shared between the
+    processes in a names_to_gender() worker process"""
+    global pool_fetch, pool_cache, pool_evidence, pool_stopping, pool_budget
+    global pool_cues, pool_metrics
+    pool_stopping = stopping
+    pool_budget = (max_requests, max_pages)
+    pool_cues = cues
+    if metrics:
+        pool_metrics = build_metrics()
+    pool_fetch = partial(wiki_fetch, controller=controller,
+                         metrics=pool_metrics)
+    if cache_path is not None:
+        pool_cache = response_cache(cache_path, cache_ttl, cache_size)
+        pool_fetch = pool_cache.fetch(pool_fetch)
+    if shared_pages is not None:
+        pool_evidence = evidence_store(shared_pages)
+
+
+def pool_name_to_gender(name):
+    """name_to_gender() in a worker process. Returns the name, its
+    (gender, log_data) or None if Wikipedia throttled the requests, the
+    number of cache hits and misses and of evidence store hits and misses
+    for this name, and the request metrics of the name (see
+    build_metrics.pop()) or None"""
+    counters = [0, 0, 0, 0]
+    if pool_cache is not None:
+        counters[0:2] = [-pool_cache.hits, -pool_cache.misses]
+    if pool_evidence is not None:
+        counters[2:4] = [-pool_evidence.hits, -pool_evidence.misses]
+    try:
+        result = run_steps(name_to_gender_steps(name, pool_evidence,
+                                                pool_stopping,
+                                                *pool_budget, pool_cues),
+                           pool_fetch)
+    except ThrottledError:
+        result = None
+    if pool_cache is not None:
+        counters[0] += pool_cache.hits
+        counters[1] += pool_cache.misses
+    if pool_evidence is not None:
+        counters[2] += pool_evidence.hits
+        counters[3] += pool_evidence.misses
+    metrics = None
+    if pool_metrics is not None:
+        metrics = pool_metrics.pop()
+    return (name, result) + tuple(counters) + (metrics,)
+
+
+class http_pool():
+    """Pool of keep-alive HTTP/1.1 connections to a server, for asyncio.
+
+    Parameters
+    ----------
+    url: str
+        URL of the endpoint (http or https).
+
+    max_connections: int, optional
+        Maximum number of simultaneous connections. Requests wait for a
+        free connection above that. Default is 100.
+
+    timeout: float, optional
+        Timeout in seconds of a request. Default is 60.
+
+    headers: dict, optional
+        Headers sent with every request. Default is None.
+    """
+
+    def __init__(self,
+                 url,
+                 max_connections=100,
+                 timeout=60,
+                 headers=None):
+        url_split = urlsplit(url)
+        self.host = url_split.hostname
+        self.path = url_split.path or '/'
+        if url_split.scheme == 'https':
+            self.ssl = ssl.create_default_context()
+            self.port = url_split.port or 443
+        else:
+            self.ssl = None
+            self.port = url_split.port or 80
+        self.timeout = timeout
+        self.headers = {'Host': url_split.netloc,
+                        'Accept': 'application/json',
+                        'Connection': 'keep-alive'}
+        if headers:
+            self.headers.update(headers)
+        self.max_connections = max_connections
+        self.semaphore = None
+        self.idle = []
+
+    async def get(self, params):
+        """Sends a GET request with query parameters params, and returns
+        the status code, the headers (with lowercase keys) and the body of
+        the response"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+        target = self.path + '?' + urlencode(params)
+        async with self.semaphore:
+            while True:
+                reused = bool(self.idle)
+                if reused:
+                    reader, writer = self.idle.pop()
+                else:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port,
+                                                ssl=self.ssl),
+                        self.timeout)
+                try:
+                    status, headers, body = await asyncio.wait_for(
+                        self.exchange(reader, writer, target), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # The server may have closed an idle connection
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if headers.get('connection', '').lower() != 'close':
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, headers, body
+
+    async def exchange(self, reader, writer, target):
+        """Sends a request on a connection and reads the response.
+        Returns the status code, the headers and the body. The connection
+        header is set to close if the connection can't be reused."""
+        request = 'GET ' + target + ' HTTP/1.1\r\n'
+        request += ''.join(k + ': ' + v + '\r\n'
+                           for k, v in self.headers.items())
+        writer.write((request + '\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in {b'\r\n', b'\n', b''}:
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in {b'\r\n', b''}:
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    def close(self):
+        "Closes the idle connections"
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class concurrency_controller():
+    """Adaptive limit on the number of simultaneous requests (AIMD).
+
+    The limit grows by about 1 for every limit successful requests while
+    the latency stays within latency_factor of the lowest latency seen,
+    and is halved when a request is throttled or fails (at most once per
+    latency period, so a burst of errors counts once).
+
+    Parameters
+    ----------
+    initial: int, optional
+        Initial limit. Default is 10.
+
+    min_limit: int, optional
+        Minimum limit. Default is 1.
+
+    max_limit: int, optional
+        Maximum limit. Default is 200.
+
+    latency_factor: float, optional
+        The limit stops growing when the average latency is above
+        latency_factor times the lowest average latency. Default is 2.
+
+    window: float, optional
+        Duration in seconds over which the error rate and the requests per
+        second are computed. Default is 10.
+
+    Use it as an async context manager around each request, then call
+    record() with the outcome. stats() gives the current limit, error rate
+    and requests per second. From threads or processes, call acquire() and
+    release() around each request instead (see controller_manager).
+    """
+
+    def __init__(self,
+                 initial=10,
+                 min_limit=1,
+                 max_limit=200,
+                 latency_factor=2.,
+                 window=10.):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.window = window
+        self.in_flight = 0
+        self.condition = None
+        self.lock = Condition()
+        self.latency = None
+        self.min_latency = None
+        self.last_decrease = 0.
+        self.history = deque()
+        self.n_requests = 0
+        self.n_errors = 0
+
+    async def __aenter__(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            while self.in_flight >= int(self.limit):
+                await self.condition.wait()
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def acquire(self):
+        "Waits until the limit allows another request from a thread"
+        with self.lock:
+            while self.in_flight >= int(self.limit):
+                self.lock.wait()
+            self.in_flight += 1
+
+    def release(self):
+        "Ends a request started with acquire()"
+        with self.lock:
+            self.in_flight -= 1
+            self.lock.notify_all()
+
+    def record(self, latency, error=False):
+        """Records the outcome of a request: its latency in seconds, and
+        whether it was throttled or failed"""
+        now = time.monotonic()
+        with self.lock:
+            self.n_requests += 1
+            self.history.append((now, error))
+            while self.history[0][0] < now - self.window:
+                self.history.popleft()
+            if error:
+                self.n_errors += 1
+                if now - self.last_decrease > (self.latency or 0.):
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = now
+                return
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.9 * self.latency + 0.1 * latency
+            if self.min_latency is None or self.latency < self.min_latency:
+                self.min_latency = self.latency
+            if self.latency <= self.latency_factor * self.min_latency:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self):
+        """Returns a dict of the current concurrency limit, requests in
+        flight, error rate and requests per second over the last window,
+        and total requests and errors"""
+        now = time.monotonic()
+        with self.lock:
+            recent = [e for t, e in self.history if t >= now - self.window]
+            return {'concurrency': int(self.limit),
+                    'in_flight': self.in_flight,
+                    'error_rate': ((sum(recent) / len(recent)) if recent
+                                   else 0.),
+                    'requests_per_sec': len(recent) / self.window,
+                    'requests': self.n_requests,
+                    'errors': self.n_errors}
+
+
+class controller_manager(BaseManager):
+    """Manager process holding concurrency_controller objects, so the
+    processes of names_to_gender(engine='pool') share the same adaptive
+    limit through proxies:
+        manager = controller_manager()
+        manager.start()
+        controller = manager.concurrency_controller(max_limit=25)
+    """
+
+
+controller_manager.register('concurrency_controller', concurrency_controller)
+
+
+def is_throttled(status, data):
+    """True if an HTTP status or decoded API answer means the request was
+    throttled or failed on the server side and should be retried"""
+    if status == 429 or status >= 500:
+        return True
+    if isinstance(data, dict) and 'error' in data:
+        return (data['error'].get('code') in {'ratelimited', 'maxlag'} or
+                data['error'].get('info') in {'HTTP request timed out.',
+                                              'Pool queue is full'})
+    return False
+
+
+class async_wiki_api():
+    """Asynchronous client of the MediaWiki API, answering the requests of
+    name_to_gender_steps() like the wikipedia package.
+
+    Parameters
+    ----------
+    api_url: str, optional
+        URL of the api.php endpoint. If None, the API_URL of the wikipedia
+        package, which is the English Wikipedia (or the language set with
+        wikipedia.set_lang()) in https. Default is None.
+
+    max_connections: int, optional
+        Maximum number of simultaneous HTTP connections. Default is 100.
+
+    timeout: float, optional
+        Timeout in seconds of a request. Default is 60.
+
+    batch_size: int, optional
+        If more than 1, summaries requested at the same time (by different
+        names) are grouped in batches of up to batch_size titles fetched
+        in a single request. Missing and disambiguation pages are detected
+        for each title. The maximum allowed by the API for introductions
+        is 20. Default is 1.
+
+    batch_delay: float, optional
+        Maximum time in seconds a summary request waits for its batch to
+        be full before it is sent. Default is 0.05.
+
+    controller: concurrency_controller, optional
+        Adaptive limit of simultaneous requests. If None, a controller with
+        a maximum of max_connections is used. Default is None.
+
+    max_retries: int, optional
+        Number of retries, with random exponential backoff, of requests
+        that are throttled (HTTP 429), fail on the server (HTTP 5xx, API
+        rate limit errors), time out or return invalid JSON. A
+        ThrottledError is raised after that. Default is 5.
+
+    metrics: build_metrics, optional
+        Where the latency of each request attempt, without the backoff
+        delays, and the errors of the throttled attempts are recorded.
+        Default is None.
+
+    Contrary to wikipedia.summary(), summaries are requested for the exact
+    page title (the titles come from search results) without a
+    preliminary auto-suggest search, and page information and extract
+    come from a single request. Disambiguation options are parsed from the
+    page content like the wikipedia package does.
+    """
+
+    def __init__(self,
+                 api_url=None,
+                 max_connections=100,
+                 timeout=60,
+                 batch_size=1,
+                 batch_delay=0.05,
+                 controller=None,
+                 max_retries=5,
+                 metrics=None):
+        if api_url is None:
+            api_url = wikipedia.wikipedia.API_URL
+            if 'wikipedia.org' in api_url:
+                api_url = api_url.replace('http://', 'https://')
+        self.pool = http_pool(
+            api_url, max_connections=max_connections, timeout=timeout,
+            headers={'User-Agent': wikipedia.wikipedia.USER_AGENT})
+        if controller is None:
+            controller = concurrency_controller(max_limit=max_connections)
+        self.controller = controller
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Futures of the summaries waiting for their batch, by title
+        self.pending = {}
+        self.flush_handle = None
+        self.batch_tasks = set()
+
+    async def request(self, params, call='summary'):
+        """Returns the decoded JSON answer to an API query. call is the
+        label of its latency in the metrics."""
+        params = dict(params)
+        params['format'] = 'json'
+        if 'action' not in params:
+            params['action'] = 'query'
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            headers = {}
+            data = None
+            async with self.controller:
+                start = loop.time()
+                try:
+                    status, headers, body = await self.pool.get(params)
+                    if status < 500 and status != 429:
+                        data = json.loads(body)
+                    error = is_throttled(status, data)
+                except (OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError,
+                        json.decoder.JSONDecodeError) as e:
+                    status = e
+                    error = True
+                latency = loop.time() - start
+                self.controller.record(latency, error)
+            if self.metrics is not None:
+                kind = None
+                if error and isinstance(status, Exception):
+                    kind = status
+                elif error and isinstance(data, dict) and 'error' in data:
+                    kind = data['error'].get('code', 'api_error')
+                elif error:
+                    kind = 'HTTP %i' % status
+                self.metrics.request_done(call, latency, kind)
+            if not error:
+                if status != 200:
+                    raise wikipedia.exceptions.WikipediaException(
+                        'HTTP status %i' % status)
+                return data
+            if attempt < self.max_retries:
+                delay = retry_delay(attempt)
+                if headers.get('retry-after', '').isdigit():
+                    delay = max(delay, int(headers['retry-after']))
+                await asyncio.sleep(delay)
+        raise ThrottledError('Request %r failed %i times: %r' %
+                             (params, self.max_retries + 1, status))
+
+    async def search(self, query, results=1000):
+        "Returns the list of page titles of a Wikipedia search"
+        raw_results = await self.request({'list': 'search',
+                                          'srprop': '',
+                                          'srlimit': results,
+                                          'limit': results,
+                                          'srsearch': query}, 'search')
+        if 'error' in raw_results:
+            if raw_results['error']['info'] in {'HTTP request timed out.',
+                                                'Pool queue is full'}:
+                raise wikipedia.exceptions.HTTPTimeoutError(query)
+            raise wikipedia.exceptions.WikipediaException(
+                raw_results['error']['info'])
+        return [d['title'] for d in raw_results['query']['search']]
+
+    async def summary(self, title):
+        """Returns the plain text introduction of a page.
+        Raises the same exceptions as wikipedia.summary()."""
+        if self.batch_size > 1 and '|' not in title:
+            return await self.batched_summary(title)
+        return await self.single_summary(title)
+
+    async def single_summary(self, title):
+        "summary() with a request for this title only"
+        raw_results = await self.request({'prop': 'extracts|pageprops',
+                                          'ppprop': 'disambiguation',
+                                          'explaintext': '',
+                                          'exintro': '',
+                                          'redirects': '',
+                                          'titles': title})
+        if 'error' in raw_results:
+            raise wikipedia.exceptions.WikipediaException(
+                raw_results['error']['info'])
+        page = list(raw_results['query']['pages'].values())[0]
+        if 'missing' in page or 'invalid' in page:
+            raise wikipedia.exceptions.PageError(title)
+        if 'pageprops' in page:
+            raise wikipedia.exceptions.DisambiguationError(
+                page['title'], await self.disambiguation_options(page))
+        return page['extract']
+
+    async def batched_summary(self, title):
+        "summary() in the next batch of titles"
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(title, []).append(future)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_delay, self.flush)
+        return await future
+
+    def flush(self):
+        "Sends the request of the waiting batch of titles"
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending:
+            task = asyncio.ensure_future(self.fetch_batch(self.pending))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+            self.pending = {}
+
+    async def fetch_batch(self, batch):
+        """Fetches the summaries of a dict of titles, and sets the result or
+        exception of their futures"""
+        try:
+            raw_results = await self.request({'prop': 'extracts|pageprops',
+                                              'ppprop': 'disambiguation',
+                                              'explaintext': '',
+                                              'exintro': '',
+                                              'exlimit': 'max',
+                                              'redirects': '',
+                                              'titles': '|'.join(batch)})
+            if 'error' in raw_results:
+                raise wikipedia.exceptions.WikipediaException(
+                    raw_results['error']['info'])
+            query = raw_results['query']
+            # Titles can be normalized, then redirected
+            renames = {}
+            for rename in (query.get('normalized', []) +
+                           query.get('redirects', [])):
+                renames[rename['from']] = rename['to']
+            pages = {page['title']: page
+                     for page in query.get('pages', {}).values()}
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        async def resolve(title, futures):
+            final_title = renames.get(title, title)
+            final_title = renames.get(final_title, final_title)
+            page = pages.get(final_title)
+            try:
+                if page is None or 'missing' in page or 'invalid' in page:
+                    raise wikipedia.exceptions.PageError(title)
+                if 'pageprops' in page:
+                    raise wikipedia.exceptions.DisambiguationError(
+                        page['title'],
+                        await self.disambiguation_options(page))
+                if 'extract' in page:
+                    result = page['extract']
+                else:
+                    # Extracts beyond the API limit of a request
+                    result = await self.single_summary(title)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
+
+        await asyncio.gather(*[resolve(title, futures)
+                               for title, futures in batch.items()])
+
+    async def disambiguation_options(self, page):
+        "Returns the titles listed in a disambiguation page"
+        raw_results = await self.request({'prop': 'revisions',
+                                          'rvprop': 'content',
+                                          'rvparse': '',
+                                          'rvlimit': 1,
+                                          'titles': page['title']},
+                                         'disambiguation')
+        html = list(raw_results['query']['pages'].values()
+                    )[0]['revisions'][0]['*']
+        return parse_options(html)
+
+    async def fetch(self, endpoint, query):
+        "Answers a name_to_gender_steps() request"
+        if endpoint == 'search':
+            return await self.search(query, results=1000)
+        return await self.summary(query)
+
+    def close(self):
+        "Closes the connections"
+        self.pool.close()
+
+
+def parse_options(html):
+    """Returns the titles listed in the html content of a disambiguation
+    page, the same way as the wikipedia package"""
+    lis = BeautifulSoup(html, 'html.parser').find_all('li')
+    filtered_lis = [li for li in lis
+                    if 'tocsection' not in ''.join(li.get('class', []))]
+    return [li.a.get_text() for li in filtered_lis if li.a]
+
+
+async def async_run_steps(steps, fetch):
+    """Runs a name_to_gender_steps() generator, answering its requests with
+    the coroutine fetch(endpoint, query), and returns its
+    (gender, log_data)"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                result = await fetch(*request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def async_names_to_gender(names,
+                                api=None,
+                                concurrency=200,
+                                failed=None,
+                                evidence=None,
+                                stopping=None,
+                                max_requests=None,
+                                max_pages=None,
+                                cues=None):
+    """Assigns genders to first names with many concurrent Wikipedia
+    requests from a single process.
+
+    Parameters
+    ----------
+    names: iterable of str
+        First names.
+
+    api: async_wiki_api, optional
+        Client used for the requests. If None, a client of Wikipedia with
+        as many connections as concurrency is used. Default is None.
+
+    concurrency: int, optional
+        Number of names processed at the same time. The number of
+        simultaneous requests is adapted below that by the controller of
+        api. Default is 200.
+
+    failed: list, optional
+        Names whose requests were still throttled after all retries are
+        skipped, and appended to this list. Default is None.
+
+    evidence: evidence_store, optional
+        Evidence of the pages already fetched for other names, and where
+        the evidence of new pages is stored. Default is None.
+
+    stopping: stopping_rule, optional
+        Early stopping of the page loop of each name. Default is None.
+
+    max_requests: int, optional
+        Maximum number of requests per name (see page_frontier()).
+        Default is None.
+
+    max_pages: int, optional
+        Maximum number of pages visited per name. Default is None.
+
+    cues: cue_counter, optional
+        Cue words scoring the pages. Default is None (cue_counter()).
+
+    Yields
+    ------
+    tuple
+        (gender, log_data) of each name as name_to_gender(), in the order
+        they are completed.
+    """
+    if api is None:
+        api = async_wiki_api(max_connections=concurrency)
+    names = iter(names)
+    results = asyncio.Queue()
+    fetch = api.fetch
+    if evidence is not None:
+        fetch = evidence.async_fetch(fetch)
+
+    async def worker():
+        for name in names:
+            try:
+                result = await async_run_steps(
+                    name_to_gender_steps(name, evidence, stopping,
+                                         max_requests, max_pages, cues),
+                    fetch)
+            except ThrottledError:
+                if failed is not None:
+                    failed.append(name)
+                continue
+            except Exception as e:
+                await results.put(e)
+                return
+            await results.put(result)
+        await results.put(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        n_running = len(workers)
+        while n_running:
+            result = await results.get()
+            if result is None:
+                n_running -= 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Connections belong to this event loop
+        api.close()
+
+
+def iter_async(agen):
+    "Iterates an async generator from synchronous code"
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        # Tasks left when the iteration is stopped early, such as the page
+        # requests shared by names in an evidence_store
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks,
+                                                   return_exceptions=True))
+        loop.close()
+
+
+def names_to_gender(names,
+                    engine='pool',
+                    n_pool=25,
+                    concurrency=200,
+                    cache=None,
+                    batch_size=1,
+                    controller=None,
+                    failed=None,
+                    evidence=None,
+                    stopping=None,
+                    max_requests=None,
+                    max_pages=None,
+                    metrics=None,
+                    cues=None):
+    """Assigns genders to first names based on wikipedia searches.
+
+    Parameters
+    ----------
+    names: list of str
+        First names.
+
+    engine: str, optional
+        'pool': name_to_gender() in a pool of n_pool processes.
+        'async': async_names_to_gender() in this process, with concurrency
+        names processed at the same time.
+        Default is 'pool'.
+
+    cache: response_cache, optional
+        Persistent cache of the Wikipedia responses. With the 'pool' engine,
+        each process opens the same database, and the hits and misses are
+        added to the counters of cache. Default is None.
+
+    batch_size: int, optional
+        With the 'async' engine, number of page summaries fetched in a
+        single request, gathered across the names being processed
+        (see async_wiki_api()). Default is 1.
+
+    controller: concurrency_controller, optional
+        Adaptive limit of simultaneous requests. With the 'pool' engine, it
+        must be a proxy from a controller_manager, shared by the processes.
+        If None, a controller with a maximum of concurrency (async) or
+        n_pool (pool) simultaneous requests is used. Default is None.
+
+    failed: list, optional
+        Names that could not be fetched because Wikipedia kept throttling
+        the requests are skipped, and appended to this list.
+        Default is None.
+
+    evidence: evidence_store, optional
+        Evidence of the pages reached by the names, shared by all the names
+        so each page is fetched and scored once. With the 'pool' engine,
+        the processes share a copy of its pages through a
+        multiprocessing.Manager. The pages they store are not copied back
+        into evidence: they are only counted in its n_shared, and the hits
+        and misses of the processes are added to its counters.
+        Default is None.
+
+    stopping: stopping_rule, optional
+        Early stopping of the page loop of each name. Default is None.
+
+    max_requests: int, optional
+        Maximum number of requests per name (see page_frontier()).
+        Default is None.
+
+    max_pages: int, optional
+        Maximum number of pages visited per name. Default is None.
+
+    metrics: build_metrics, optional
+        Where the latency and exceptions of the Wikipedia requests are
+        recorded. With the 'pool' engine, the metrics of the processes are
+        added to it. If None, the requests are not measured.
+        Default is None.
+
+    cues: cue_counter, optional
+        Cue words scoring the pages (see cue_counter()).
+        Default is None (cue_counter()).
+
+    Yields
+    ------
+    tuple
+        (gender, log_data) of each name as name_to_gender(), in the order
+        they are completed.
+    """
+    if engine == 'pool':
+        if cache is None:
+            initargs = (None, None, None)
+        else:
+            initargs = (cache.path, cache.ttl, cache.max_entries)
+        manager = None
+        shared_pages = None
+        if evidence is not None:
+            manager = Manager()
+            shared_pages = manager.dict(evidence.pages)
+        controllers = None
+        if controller is None:
+            controllers = controller_manager()
+            controllers.start()
+            controller = controllers.concurrency_controller(max_limit=n_pool)
+        initargs += (shared_pages, stopping, max_requests, max_pages,
+                     metrics is not None, controller, cues)
+        try:
+            with Pool(n_pool,
+                      initializer=init_pool_worker,
+                      initargs=initargs) as pool:
+                for (name, result, hits, misses, evidence_hits,
+                     evidence_misses, name_metrics) in pool.imap_unordered(
+                        pool_name_to_gender, names):
+                    if name_metrics is not None:
+                        metrics.add(name_metrics)
+                    if cache is not None:
+                        cache.hits += hits
+                        cache.misses += misses
+                    if evidence is not None:
+                        evidence.hits += evidence_hits
+                        evidence.misses += evidence_misses
+                    if result is None:
+                        if failed is not None:
+                            failed.append(name)
+                        continue
+                    yield result
+        finally:
+            if manager is not None:
+                evidence.n_shared += len(shared_pages) - len(evidence.pages)
+                manager.shutdown()
+            if controllers is not None:
+                controllers.shutdown()
+    elif engine == 'async':
+        api = async_wiki_api(max_connections=concurrency,
+                             batch_size=batch_size,
+                             controller=controller,
+                             metrics=metrics)
+        if metrics is not None:
+            api.fetch = metrics.async_fetch(api.fetch)
+        if cache is not None:
+            api.fetch = cache.async_fetch(api.fetch)
+        yield from iter_async(async_names_to_gender(names, api=api,
+                                                    concurrency=concurrency,
+                                                    failed=failed,
+                                                    evidence=evidence,
+                                                    stopping=stopping,
+                                                    max_requests=max_requests,
+                                                    max_pages=max_pages,
+                                                    cues=cues))
+    else:
+        raise ValueError("engine must be 'pool' or 'async'")
+
+
+def build_dataset(reboot=False,
+                  engine='pool',
+                  concurrency=200,
+                  cache_path=None,
+                  cache_ttl=None,
+                  cache_size=None,
+                  batch_size=1,
+                  n_pool=25,
+                  journal_path=None,
+                  incremental=False,
+                  checkpoint=100,
+                  share_pages=False,
+                  early_stop=False,
+                  stop_confidence=None,
+                  max_requests=None,
+                  max_pages=None,
+                  weight_path=None,
+                  stop_coverage=None,
+                  shard=None,
+                  n_shards=1,
+                  output_dir=None,
+                  metrics_path=None,
+                  metrics_interval=10.,
+                  names_path=None,
+                  cues=None):
+    """Builds the database of gender based on Wikipedia search.
+
+    This code takes a list of first names separated by a line break \n
+    in file Names.txt and constructs a database in NamesOut.txt by assigning
+    them a gender.
+
+    NamesOut.txt will contain the same names, but followed by the
+    assigned gender (both of them being seprated by a tab \t).
+
+    The gender attribution (M, F, UNI, INI or UNK) is done according to the
+    occurrence of first names on Wikipedia pages concerning them.
+    M: male
+    F: female
+    UNI: unisex
+    INI: initials
+    UNK: unknown
+
+    If NamesOut.txt already exists, it will be ignored and overwritten.
+    Information on gender assignment is present in the log file (NamesLog.txt).
+    The log file is automatically detected to launch the code back where it was
+    in the case it got interrupted.
+
+    Set reboot=True if you want to disregard log files and start from scratch
+
+    Set engine='async' to query Wikipedia with concurrency simultaneous
+    requests over keep-alive connections from a single process, instead of
+    a pool of 25 processes (see async_names_to_gender()).
+
+    Set cache_path to the path of a SQLite database to keep the Wikipedia
+    responses between builds (see response_cache()), so a rebuild mostly
+    replays them from disk. cache_ttl is the time to live of the responses
+    in seconds, and cache_size the maximum number of responses kept.
+
+    With engine='async', set batch_size=20 to fetch the summaries of up to
+    20 pages (of different names) in a single request.
+
+    The number of simultaneous requests adapts up to concurrency with
+    engine='async', and up to the n_pool processes with the default engine
+    (see concurrency_controller()): it grows while the latency is stable
+    and is halved when Wikipedia throttles the requests, which are
+    retried. The current concurrency, error rate and requests per second
+    are shown in the progress bar.
+    Names whose requests are still throttled after all retries are not
+    written in the log, so running build_dataset() again retries them.
+
+    Set journal_path to the path of a SQLite journal (see build_journal())
+    to record the results there instead of NamesLog.txt. The names already
+    in the journal are skipped without reading the log texts, and results
+    are committed every checkpoint names. If the journal doesn't exist yet
+    and NamesLog.txt does, the log is imported into it once.
+
+    Set incremental=True to resume a build without rewriting NamesLog.txt:
+    the log is only scanned for the names and genders it already has (an
+    incomplete record at its end is removed), the records of new names are
+    appended to it and NamesOut.txt is updated by merging its lines with
+    the new results. The log is flushed to disk (fsync) every checkpoint
+    names, which is also the commit interval of the journal, so an
+    interruption loses at most checkpoint names.
+
+    With share_pages=True, the evidence of each page (pronoun counts or
+    disambiguation options) is kept for the whole build and shared by the
+    names and processes (see evidence_store()), so a page reached by many
+    names is only fetched once. The store is not bounded, and grows with
+    the number of pages of the build.
+
+    The pronoun counts of the pages of each name are also appended to
+    NamesCounts.jsonl (see counts_record()), which is created from the
+    existing log the first time, so NamesOut.txt can be rebuilt with other
+    thresholds by reclassify() without querying Wikipedia.
+
+    Set early_stop=True to stop visiting the pages of a name once the
+    remaining pages can no longer change its gender (see stopping_rule()),
+    which gives the same NamesOut.txt with fewer requests. Set
+    stop_confidence (e.g. 0.9) to also stop once the gender is that
+    probable, which saves more requests but can change some genders. The
+    number of names stopped early and of the pages left in their frontier,
+    an estimate of the requests saved, is printed at the end.
+
+    max_requests and max_pages limit the requests and the pages visited
+    for each name (see page_frontier()). The number of requests of each
+    name is written in its log, and the average and the name with the most
+    requests are printed at the end.
+
+    Set weight_path to a file of first name weights (see import_weights()),
+    such as the ppm of authorship of the Web of Science, to process the
+    names by descending weight instead of alphabetical order. The weight
+    covered by the names done so far is shown in the progress bar, and the
+    build stops once it reaches stop_coverage (e.g. 0.99 for 99 % of the
+    weight of Names.txt). The names left are UNK in NamesOut.txt, and
+    running build_dataset() again continues with them.
+
+    Set output_dir to write NamesLog.txt, NamesOut.txt and
+    NamesCounts.jsonl in that directory instead of the directory of this
+    module, and names_path to read the names from another file than
+    Names.txt in the directory of this module.
+
+    Set cues to a cue_counter with other cue words for the two methods of
+    name_to_gender_steps(), such as
+    cue_counter(methods=[(['he', 'him'], ['she', 'her']),
+                         (['men', 'male'], ['women', 'female'])]).
+    The log and NamesCounts.jsonl then have the counts of these words, and
+    reclassify() must be given the same cues.
+
+    To split a build between machines, set n_shards and shard (from 0 to
+    n_shards-1): only the names of Names.txt in that shard (see
+    name_shard()) are built, in output_dir, with a journal in
+    output_dir/NamesJournal.sqlite if journal_path is None. Each machine
+    can build any shard, and merge_shards() then combines the shard
+    directories into a single NamesLog.txt and NamesOut.txt. Each shard
+    needs its own output_dir, other than the directory of this module,
+    which records its shard in NamesShard.json.
+
+    Set metrics_path to export the metrics of the build (see
+    build_metrics()) every metrics_interval seconds and at the end: the
+    latency of the requests, the exceptions they raised, the pages and
+    requests per name, the time to write the records and spent in each
+    stage, and the names done, pending and per second. The file is in the
+    Prometheus text format if its name ends with .prom, and JSON
+    otherwise.
+    """
+    if stop_coverage is not None and weight_path is None:
+        raise ValueError('stop_coverage needs a weight_path')
+    if shard is not None and not 0 <= shard < n_shards:
+        raise ValueError('shard must be between 0 and n_shards-1')
+    if n_shards > 1 and shard is None:
+        raise ValueError('a build split in n_shards needs a shard')
+
+    metrics = None
+    if metrics_path is not None:
+        metrics = build_metrics()
+    stage_start = time.perf_counter()
+    cwd = Path(__file__).parent.absolute()
+    inputnames = cwd / 'Names.txt' if names_path is None else names_path
+    out_dir = cwd
+    if output_dir is not None:
+        out_dir = Path(output_dir).absolute()
+    if shard is not None and n_shards > 1:
+        if out_dir == cwd:
+            raise ValueError('each shard needs its own output_dir')
+        check_shard_dir(out_dir, shard, n_shards)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # namestot: List of str names to attribute a gender to
+    namestot_raw = ['']
+    with open(inputnames, 'r') as namefile:
+        namestot_raw = namefile.read().split('\n')
+    if shard is not None:
+        namestot_raw = [name for name in namestot_raw
+                        if name_shard(name, n_shards) == shard]
+        if journal_path is None:
+            journal_path = out_dir / 'NamesJournal.sqlite'
+        print('Shard %i of %i: %i names' % (shard, n_shards,
+                                            len(namestot_raw)))
+
+    print('Names sorting')
+    namestot = sorted(list(set(namestot_raw)))
+    log_path = out_dir / 'NamesLog.txt'
+    counts_path = out_dir / 'NamesCounts.jsonl'
+    write_old_counts = not isfile(counts_path)
+    journal = None
+    log_genders = None
+    new_genders = {}
+    empty_log = '\nname is empty\n' + str(datetime.now()) + '\n = UNK'
+    if journal_path is not None:
+        journal_path = Path(journal_path)
+        if (not reboot and not isfile(journal_path) and
+                isfile(log_path)):
+            journal = import_log(log_path, journal_path)
+        else:
+            journal = build_journal(journal_path)
+        if write_old_counts and len(journal):
+            write_counts(journal.records(), counts_path, cues)
+        print('Journal reading')
+        datanames = [] if reboot else sorted(journal.names())
+        if index(datanames, '') == -1:
+            datanames = sorted(datanames + [''])
+            journal.append('', 'UNK', empty_log)
+            journal.commit()
+    elif incremental:
+        print('Log scanning')
+        log_genders = scan_log(log_path)
+        if write_old_counts and isfile(log_path):
+            write_counts(log_records(log_path), counts_path, cues)
+        datanames = [] if reboot else sorted(log_genders)
+        filelog = open(log_path, 'a', encoding='utf-8')
+        separator = '\n\n' if filelog.tell() > 0 else ''
+        if index(datanames, '') == -1:
+            datanames = sorted(datanames + [''])
+            filelog.write(separator + empty_log)
+            separator = '\n\n'
+    else:
+        print('Log reading')
+        datalog, datanames = lectdatalog(out_dir)
+        if write_old_counts and datalog:
+            write_counts([(d[0], d[1], d[3]) for d in datalog], counts_path,
+                         cues)
+        if index(datanames, '') == -1 or not datanames or reboot:
+            datanames += ['']
+            datalog += [['', 'UNK', datetime.now(), empty_log]]
+        filelog = open(log_path, 'w', encoding='utf-8')
+        filelog.write('\n\n'.join([d[3] for d in datalog]))
+        separator = '\n\n'
+
+    filecounts = open(counts_path, 'a', encoding='utf-8')
+
+    print('Names treatment')
+    # Keeping only names that are not in log file in namesfil
+    namesfil = []
+    for name in namestot:
+        if index(datanames, name) == -1:
+            namesfil.append(name)
+
+    weights = None
+    if weight_path is not None:
+        print('Names weighting')
+        weights = import_weights(weight_path)
+        # Most frequent names first, the others in alphabetical order
+        namesfil.sort(key=lambda name: -weights.get(name, 0.))
+        total_weight = sum(weights.get(name, 0.) for name in namestot)
+        covered_weight = total_weight - sum(weights.get(name, 0.)
+                                            for name in namesfil)
+        if total_weight == 0:
+            print('No name of Names.txt has a weight')
+            total_weight = 1.
+    if metrics is not None:
+        metrics.stage_time('names_reading',
+                           time.perf_counter() - stage_start)
+        metrics.gauges['names_pending'] = len(namesfil)
+
+    print('Fetching names data from Wikipedia')
+    # tn = cpu_count()
+    # Since the bottleneck is waiting for the wikipedia server to ping back,
+    # n_pool should be as high as possible
+    controllers = None
+    if engine == 'pool':
+        # The processes share the controller through a manager process
+        controllers = controller_manager()
+        controllers.start()
+        controller = controllers.concurrency_controller(max_limit=n_pool)
+    else:
+        controller = concurrency_controller(max_limit=concurrency)
+    failed = []
+    stopping = None
+    if early_stop or stop_confidence is not None:
+        stopping = stopping_rule(stop_confidence)
+    n_stopped = 0
+    n_saved = 0
+    n_requests = 0
+    most_requests = (0, '')
+    postfix = {}
+    covered = False
+    last_export = time.time()
+    stage_start = time.perf_counter()
+    try:
+        cache = None
+        if cache_path is not None:
+            cache = response_cache(cache_path, cache_ttl, cache_size)
+        evidence = evidence_store() if share_pages else None
+        with tqdm(total=len(namesfil)) as pbar:
+            for gender, log_data in names_to_gender(namesfil, engine,
+                                                    n_pool, concurrency,
+                                                    cache, batch_size,
+                                                    controller, failed,
+                                                    evidence, stopping,
+                                                    max_requests,
+                                                    max_pages, metrics,
+                                                    cues):
+                pbar.update()
+                name = log_data.split('\n', 1)[0]
+                name_requests = sum(int(r) for r, _ in
+                                    REQUESTS_LOG.findall(log_data))
+                n_requests += name_requests
+                most_requests = max(most_requests, (name_requests, name))
+                if stopping is not None:
+                    stopped = STOP_LOG.search(log_data)
+                    if stopped is not None:
+                        n_stopped += 1
+                        n_saved += int(stopped.group(1))
+                write_start = time.perf_counter()
+                if journal is None:
+                    filelog.write(separator + log_data)
+                    separator = '\n\n'
+                else:
+                    journal.append(name, gender, log_data)
+                filecounts.write(counts_record(name, gender, log_data, cues))
+                if incremental:
+                    new_genders[name] = gender
+                if pbar.n % checkpoint == 0:
+                    if journal is not None:
+                        journal.commit()
+                    elif incremental:
+                        filelog.flush()
+                        fsync(filelog.fileno())
+                    if journal is not None or incremental:
+                        filecounts.flush()
+                        fsync(filecounts.fileno())
+                if metrics is not None:
+                    metrics.observe('log_write_seconds',
+                                    time.perf_counter() - write_start)
+                    metrics.name_done(log_data)
+                    metrics.gauges['names_pending'] = len(namesfil) - pbar.n
+                if pbar.n % 100 == 1:
+                    stats = controller.stats()
+                    if metrics is not None:
+                        metrics.gauges.update(
+                            requests_in_flight=stats['in_flight'],
+                            concurrency_limit=stats['concurrency'])
+                    postfix.update(concurrency=stats['concurrency'],
+                                   errors='%.1f%%' %
+                                   (100*stats['error_rate']),
+                                   req_s='%.1f' %
+                                   stats['requests_per_sec'])
+                if (metrics is not None and
+                        time.time() - last_export >= metrics_interval):
+                    metrics.write(metrics_path)
+                    last_export = time.time()
+                if weights is not None:
+                    covered_weight += weights.get(name, 0.)
+                    postfix['covered'] = ('%.2f%%' %
+                                          (100*covered_weight/total_weight))
+                if postfix:
+                    pbar.set_postfix(postfix, refresh=False)
+                if (stop_coverage is not None and
+                        covered_weight >= stop_coverage*total_weight):
+                    covered = True
+                    break
+        if metrics is not None:
+            metrics.stage_time('fetching', time.perf_counter() - stage_start)
+        if cache is not None:
+            stats = cache.stats()
+            print('Response cache: %.1f %% hits (%i hits, %i misses), '
+                  '%i responses stored' % (100*stats['hit_rate'],
+                                           stats['hits'], stats['misses'],
+                                           stats['entries']))
+            cache.close()
+        if evidence is not None:
+            stats = evidence.stats()
+            print('Page evidence: %i pages fetched, %i reused for other '
+                  'names' % (stats['pages'], stats['hits']))
+        if stopping is not None:
+            print('Early stopping: %i names stopped early, %i pages left in '
+                  'frontier (estimate of the requests saved)' %
+                  (n_stopped, n_saved))
+        if weights is not None:
+            print('Covered weight: %.2f %% of the weight of Names.txt' %
+                  (100*covered_weight/total_weight))
+            if covered:
+                print('Stopped at stop_coverage with %i names left; run '
+                      'build_dataset() again to continue with them.' %
+                      (len(namesfil) - pbar.n))
+        n_done = pbar.n
+        if n_done > 0:
+            print('Requests per name: %.1f on average, at most %i (%s)' %
+                  (n_requests/n_done, most_requests[0], most_requests[1]))
+        if metrics is not None and metrics.exceptions:
+            print('Request errors: ' +
+                  ', '.join('%s %i' % (kind, n) for kind, n in
+                            sorted(metrics.exceptions.items())))
+    finally:
+        filecounts.close()
+        if journal is None:
+            filelog.close()
+        else:
+            journal.commit()
+        if controllers is not None:
+            controllers.shutdown()
+    if failed:
+        print('%i names could not be fetched because Wikipedia throttled '
+              'the requests. They are UNK in NamesOut.txt; run '
+              'build_dataset() again to retry them.' % len(failed))
+
+    print('Saving out file in NamesOut.txt')
+    stage_start = time.perf_counter()
+    if journal is None and incremental:
+        merge_names_out(out_dir / 'NamesOut.txt', namestot_raw, new_genders,
+                        log_genders)
+    else:
+        if journal is None:
+            datalog, datanames = lectdatalog(out_dir, backup=False)
+            gender_data = {k[0]: k[1] for k in datalog}
+        else:
+            gender_data = journal.genders()
+            journal.close()
+        with open(out_dir / 'NamesOut.txt', 'w',
+                  encoding='utf-8') as fileout:
+            fileout.write('\n'.join([name + '\t' +
+                                     gender_data.get(name, 'UNK')
+                                     for name in namestot_raw]))
+    if metrics is not None:
+        metrics.stage_time('names_out', time.perf_counter() - stage_start)
+        metrics.write(metrics_path)
+        print('Build metrics saved in ' + Path(metrics_path).name)
+    print('Done')
+
+
+def name_shard(name, n_shards):
+    """Shard of a name in a build split in n_shards. It only depends on the
+    name, so all the machines of a build agree on it."""
+    return zlib.crc32(name.encode('utf-8')) % n_shards
+
+
+def check_shard_dir(shard_dir, shard, n_shards):
+    """Records the shard of a build in shard_dir/NamesShard.json, and raises
+    a ValueError if the directory already has another shard"""
+    shard_dir = Path(shard_dir)
+    shard_path = shard_dir / 'NamesShard.json'
+    if isfile(shard_path):
+        with open(shard_path, encoding='utf-8') as f:
+            stored = json.load(f)
+        if (stored['shard'], stored['n_shards']) != (shard, n_shards):
+            raise ValueError('%s has shard %i of %i, not %i of %i' %
+                             (shard_dir, stored['shard'],
+                              stored['n_shards'], shard, n_shards))
+        return
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    with open(shard_path, 'w', encoding='utf-8') as f:
+        json.dump({'shard': shard, 'n_shards': n_shards}, f)
+
+
+def merge_shards(shard_dirs, output_dir=None, journal_path=None, cues=None,
+                 names_path=None):
+    """Merges the builds of the shards of Names.txt into a single dataset.
+
+    The records of the journals (NamesJournal.sqlite) and logs
+    (NamesLog.txt) of the shard directories are gathered in a journal,
+    which keeps the latest record of each name, as lectdatalog() does when
+    a name is in the log several times. NamesLog.txt, NamesOut.txt (in
+    the order of names_path, or sorted if there is no such file) and
+    NamesCounts.jsonl are then written in output_dir.
+
+    Parameters
+    ----------
+    shard_dirs: list of str or Path
+        Output directories of build_dataset(shard=...).
+
+    output_dir: str or Path, optional
+        Directory of the merged files. If None, the directory of this
+        module. Default is None.
+
+    journal_path: str or Path, optional
+        Path of the merged journal. If None, a temporary journal is used.
+        Default is None.
+
+    cues: cue_counter, optional
+        Cue words of the build, for NamesCounts.jsonl. Default is None
+        (cue_counter()).
+
+    names_path: str or Path, optional
+        File of the names giving the order of NamesOut.txt. If None,
+        Names.txt in the directory of this module. Default is None.
+    """
+    cwd = Path(__file__).parent.absolute()
+    if names_path is None:
+        names_path = cwd / 'Names.txt'
+    out_dir = cwd if output_dir is None else Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory() as temp_dir:
+        if journal_path is None:
+            journal_path = Path(temp_dir) / 'NamesJournal.sqlite'
+        journal = build_journal(journal_path)
+        for shard_dir in shard_dirs:
+            shard_dir = Path(shard_dir)
+            print('Merging ' + shard_dir.name)
+            if isfile(shard_dir / 'NamesJournal.sqlite'):
+                shard_journal = build_journal(shard_dir /
+                                              'NamesJournal.sqlite')
+                for name, gender, log_data in shard_journal.records():
+                    journal.append(name, gender, log_data)
+                shard_journal.close()
+            if isfile(shard_dir / 'NamesLog.txt'):
+                for name, gender, log_data in log_records(shard_dir /
+                                                          'NamesLog.txt'):
+                    journal.append(name, gender, log_data)
+            journal.commit()
+        print('Saving the merged log in NamesLog.txt')
+        journal.export_log(out_dir / 'NamesLog.txt')
+        write_counts(journal.records(), out_dir / 'NamesCounts.jsonl', cues)
+        gender_data = journal.genders()
+        journal.close()
+    if isfile(names_path):
+        with open(names_path, 'r') as namefile:
+            names_raw = namefile.read().split('\n')
+    else:
+        names_raw = sorted(gender_data)
+    print('Saving out file in NamesOut.txt')
+    with open(out_dir / 'NamesOut.txt', 'w', encoding='utf-8') as fileout:
+        fileout.write('\n'.join([name + '\t' + gender_data.get(name, 'UNK')
+                                 for name in names_raw]))
+    print('%i names merged' % len(gender_data))
+
+
+DUMP_PAGE = re.compile(r'<page>(.*?)</page>|<doc>(.*?)</doc>', re.DOTALL)
+DUMP_TITLE = re.compile(r'<title>(.*?)</title>', re.DOTALL)
+DUMP_NS = re.compile(r'<ns>(.*?)</ns>')
+DUMP_REDIRECT = re.compile(r'<redirect title="(.*?)"')
+DUMP_TEXT = re.compile(r'<text[^>]*?(?:/>|>(.*?)</text>)', re.DOTALL)
+DUMP_ABSTRACT = re.compile(r'<abstract>(.*?)</abstract>', re.DOTALL)
+WIKI_DISAMBIGUATION = re.compile(r'\{\{\s*(?:disambiguation|disambig|dab|'
+                                 r'disamb|hndis|geodis|[^{}|]*disambiguation)'
+                                 r'\s*[|}]', re.IGNORECASE)
+WIKI_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+WIKI_REF = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>',
+                      re.DOTALL | re.IGNORECASE)
+WIKI_HEADING = re.compile(r'^=.*=[ \t]*$', re.MULTILINE)
+WIKI_FILE_LINK = re.compile(r'\[\[(File:|Image:|Category:)?|\]\]',
+                            re.IGNORECASE)
+WIKI_LINK = re.compile(r'\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]')
+WIKI_EXTERNAL_LINK = re.compile(r'\[(?:https?:)?//[^\s\]]*\s?([^\]]*)\]')
+WIKI_OPTION = re.compile(r'^\*+[^\n\[]*\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]',
+                         re.MULTILINE)
+
+
+def strip_nested(text, opening, closing):
+    "Removes the (possibly nested) spans from opening to closing of a text"
+    parts = []
+    depth = 0
+    pos = 0
+    for m in re.finditer(re.escape(opening) + '|' + re.escape(closing),
+                         text):
+        if m.group() == opening:
+            if depth == 0:
+                parts.append(text[pos:m.start()])
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                pos = m.end()
+    if depth == 0:
+        parts.append(text[pos:])
+    return ''.join(parts)
+
+
+def wikitext_to_text(wikitext):
+    """Approximates the plain text of the introduction of a page from its
+    wikitext, as returned by summary()"""
+    text = WIKI_COMMENT.sub('', wikitext)
+    text = WIKI_REF.sub('', text)
+    text = strip_nested(text, '{{', '}}')
+    text = strip_nested(text, '{|', '|}')
+    heading = WIKI_HEADING.search(text)
+    if heading is not None:
+        text = text[:heading.start()]
+    # Files and categories, whose captions can contain links
+    parts = []
+    depth = 0
+    pos = 0
+    for m in WIKI_FILE_LINK.finditer(text):
+        if m.group() == ']]':
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    pos = m.end()
+        elif depth > 0:
+            depth += 1
+        elif m.group(1):
+            parts.append(text[pos:m.start()])
+            depth = 1
+    if depth == 0:
+        parts.append(text[pos:])
+    text = ''.join(parts)
+    text = WIKI_LINK.sub(r'\1', text)
+    text = WIKI_EXTERNAL_LINK.sub(r'\1', text)
+    text = re.sub(r"'{2,}", '', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = unescape(text)
+    return '\n'.join(line.strip() for line in text.split('\n')
+                     if line.strip())
+
+
+def title_names(title, names):
+    """Returns the names of which a page title could be a search result in
+    name_to_gender() (FIRST_NAME Last_name), and whether the title could be
+    a disambiguation option of a name (Last_name FIRST_NAME)"""
+    prefixes = []
+    option = False
+    j = title.find(' (')
+    for i, c in enumerate(title):
+        if c != ' ':
+            continue
+        if (title[:i] in names and i+1 < len(title) and
+                title[i+1].isupper()):
+            prefixes.append(title[:i])
+        if title[i+1:] in names or (i < j and title[i+1:j] in names):
+            option = True
+    return prefixes, option
+
+
+dump_names = None
+dump_cues = None
+
+
+def init_dump_worker(names, cues=None):
+    """Initializes the names and the cue_counter in a parse_dump_chunk()
+    worker process"""
+    global dump_names, dump_cues
+    dump_names = names
+    dump_cues = cue_counter() if cues is None else cues
+
+
+def parse_dump_chunk(data):
+    """Parses a piece of a Wikipedia XML dump made of whole pages.
+
+    Returns
+    -------
+    list of tuple
+        (title, kind, value, prefixes) of the pages that may be needed to
+        assign a gender to dump_names. kind is 'page' (value is the list of
+        counts of dump_cues in the summary, or None if it is empty),
+        'disambiguation' (value is the list of options) or 'redirect'
+        (value is the title of the target). prefixes are the names for
+        which the page is a search result (see title_names()).
+    """
+    pages = []
+    summaries = []
+    for m in DUMP_PAGE.finditer(data.decode('utf-8', 'replace')):
+        page = m.group(1)
+        if page is None:
+            # Abstracts dump
+            page = m.group(2)
+            title = DUMP_TITLE.search(page)
+            if title is None:
+                continue
+            title = unescape(title.group(1))
+            if title.startswith('Wikipedia: '):
+                title = title[len('Wikipedia: '):]
+        else:
+            title = DUMP_TITLE.search(page)
+            ns = DUMP_NS.search(page)
+            if title is None or (ns is not None and ns.group(1) != '0'):
+                continue
+            title = unescape(title.group(1))
+        prefixes, option = title_names(title, dump_names)
+        if not prefixes and not option:
+            continue
+        if m.group(1) is None:
+            abstract = DUMP_ABSTRACT.search(page)
+            text = '' if abstract is None else unescape(abstract.group(1))
+            if text.rstrip().endswith('may refer to:'):
+                pages.append((title, 'disambiguation', [], prefixes))
+            else:
+                pages.append((title, 'page', len(summaries), prefixes))
+                summaries.append(text)
+            continue
+        redirect = DUMP_REDIRECT.search(page)
+        if redirect is not None:
+            target = unescape(redirect.group(1)).split('#')[0]
+            pages.append((title, 'redirect', target, []))
+            continue
+        text = DUMP_TEXT.search(page)
+        text = '' if text is None else unescape(text.group(1) or '')
+        if WIKI_DISAMBIGUATION.search(text):
+            options = [wikitext_to_text(o) for o in WIKI_OPTION.findall(text)]
+            pages.append((title, 'disambiguation', options, prefixes))
+        else:
+            pages.append((title, 'page', len(summaries), prefixes))
+            summaries.append(wikitext_to_text(text))
+    # The summaries of the piece are scored in a single batch
+    counts = dump_cues.count_many(summaries)
+    for i, (title, kind, value, prefixes) in enumerate(pages):
+        if kind == 'page':
+            if len(summaries[value]) == 0:
+                pages[i] = (title, kind, None, prefixes)
+            else:
+                pages[i] = (title, kind, counts[value], prefixes)
+    return pages
+
+
+def read_dump(dump_path, chunk_size=2**22):
+    """Decompresses a Wikipedia XML dump (.gz, .bz2 or uncompressed) and
+    yields pieces of it made of whole pages"""
+    dump_path = Path(dump_path)
+    if dump_path.suffix == '.gz':
+        f = gzip.open(dump_path, 'rb')
+    elif dump_path.suffix == '.bz2':
+        f = bz2.open(dump_path, 'rb')
+    else:
+        f = open(dump_path, 'rb')
+    with f:
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                if rest:
+                    yield rest
+                return
+            data = rest + data
+            cut = max(data.rfind(b'</page>') + len(b'</page>'),
+                      data.rfind(b'</doc>') + len(b'</doc>'))
+            if cut < len(b'</doc>'):
+                rest = data
+                continue
+            yield data[:cut]
+            rest = data[cut:]
+
+
+def parse_dump(dump_path, names, workers=None, chunk_size=2**22, cues=None):
+    """Reads a Wikipedia dump with parse_dump_chunk() in worker processes,
+    while the main process decompresses it, and yields the pages of each
+    piece of the dump in order (see parse_dump_chunk())"""
+    chunks = read_dump(dump_path, chunk_size)
+    if workers == 1:
+        init_dump_worker(names, cues)
+        yield from map(parse_dump_chunk, chunks)
+        return
+    if workers is None:
+        workers = cpu_count()
+    with Pool(workers, init_dump_worker, (names, cues)) as pool:
+        # Only a few pieces wait for a process, to bound the memory
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(parse_dump_chunk, (chunk,)))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class dump_wiki():
+    """Pages of a Wikipedia dump read with parse_dump(), answering the
+    requests of name_to_gender_steps() with their evidence store.
+
+    Parameters
+    ----------
+    max_results: int, optional
+        Maximum number of search results. Default is 1000, as wiki_fetch().
+
+    Search results are the pages whose title starts with the query, in the
+    order of the dump. The evidence of the pages is in evidence (see
+    evidence_store()), and the summary of a page that is not there raises
+    a PageError. A disambiguation option is found only if it is itself a
+    title FIRST_NAME Last_name or Last_name FIRST_NAME of a name being
+    assigned.
+    """
+
+    def __init__(self, max_results=1000):
+        self.max_results = max_results
+        self.evidence = evidence_store()
+        self.redirects = {}
+        self.search_index = {}
+
+    def add(self, title, kind, value, prefixes):
+        "Adds a page parsed by parse_dump_chunk()"
+        if title not in self.evidence.pages:
+            for name in prefixes:
+                self.search_index.setdefault(name, []).append(title)
+        if kind == 'redirect':
+            self.redirects[title] = value
+        else:
+            self.evidence.put(title, kind, value)
+
+    def resolve_redirects(self):
+        """Gives the redirects the evidence of their target, once all the
+        pages are added"""
+        for title, target in self.redirects.items():
+            for _ in range(5):
+                if target not in self.redirects:
+                    break
+                target = self.redirects[target]
+            self.evidence.put(title,
+                              *self.evidence.pages.get(target, ('missing',)))
+
+    def __len__(self):
+        return len(self.evidence.pages)
+
+    def search(self, query):
+        "Returns the titles of the pages starting with query"
+        return self.search_index.get(query, [])[:self.max_results]
+
+    def fetch(self, endpoint, query):
+        "Answers a name_to_gender_steps() request, see run_steps()"
+        if endpoint == 'search':
+            return self.search(query)
+        raise wikipedia.exceptions.PageError(query)
+
+
+def build_dataset_from_dump(dump_path,
+                            workers=None,
+                            chunk_size=2**22,
+                            max_results=1000,
+                            names_path=None,
+                            output_dir=None,
+                            cues=None):
+    """Builds the database of gender from a local Wikipedia dump instead of
+    Wikipedia search.
+
+    The dump (pages-articles.xml.bz2, or abstract.xml.gz whose
+    disambiguation pages don't list their options) is read once. The pages
+    with a title FIRST_NAME Last_name for the names of Names.txt are
+    indexed and scored by the processes, and each name goes through the
+    same decision logic as name_to_gender() (see name_to_gender_steps()
+    and dump_wiki()), where the summary of a page is the plain text of its
+    introduction.
+
+    NamesOut.txt, NamesLog.txt and NamesCounts.jsonl are written in the
+    same format as build_dataset(), for all the names. An existing
+    NamesLog.txt is copied into NamesLog_bu1.txt first.
+
+    Parameters
+    ----------
+    dump_path: str or Path
+        Path to the dump. It is decompressed according to its suffix
+        (.gz or .bz2).
+
+    workers: int, optional
+        Number of processes parsing the dump, while it is decompressed by
+        the main process. If None, the number of CPUs. Default is None.
+
+    chunk_size: int, optional
+        Size in bytes of the pieces of dump sent to the processes.
+        Default is 2**22.
+
+    max_results: int, optional
+        Maximum number of pages per name, as wiki_fetch() search results.
+        Default is 1000.
+
+    names_path: str or Path, optional
+        File of the names. If None, Names.txt in the directory of this
+        module. Default is None.
+
+    output_dir: str or Path, optional
+        Directory of NamesOut.txt, NamesLog.txt and NamesCounts.jsonl. If
+        None, the directory of this module. Default is None.
+
+    cues: cue_counter, optional
+        Cue words scoring the pages. Default is None (cue_counter()).
+    """
+
+    cwd = Path(__file__).parent.absolute()
+    if names_path is None:
+        names_path = cwd / 'Names.txt'
+    out_dir = cwd if output_dir is None else Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(names_path, 'r') as namefile:
+        namestot_raw = namefile.read().split('\n')
+    namestot = sorted(set(namestot_raw))
+    names = set(namestot) - {''}
+
+    print('Reading ' + Path(dump_path).name)
+    wiki = dump_wiki(max_results)
+    with tqdm(unit='chunk') as pbar:
+        for pages in parse_dump(dump_path, names, workers, chunk_size,
+                                cues):
+            for page in pages:
+                wiki.add(*page)
+            pbar.update()
+    wiki.resolve_redirects()
+    print('%i pages indexed' % len(wiki))
+
+    print('Assigning genders')
+    log_path = out_dir / 'NamesLog.txt'
+    if isfile(log_path):
+        bu_path = backup_path(log_path)
+        print('Copying ' + log_path.name + ' into ' + bu_path.name)
+        copyfile(log_path, bu_path)
+    gender_data = {'': 'UNK'}
+    with open(log_path, 'w', encoding='utf-8') as filelog, \
+            open(out_dir / 'NamesCounts.jsonl', 'w',
+                 encoding='utf-8') as filecounts:
+        filelog.write('\nname is empty\n' + str(datetime.now()) + '\n = UNK')
+        for name in tqdm(namestot):
+            if name == '':
+                continue
+            gender, log_data = run_steps(
+                name_to_gender_steps(name, wiki.evidence, cues=cues),
+                wiki.fetch)
+            gender_data[name] = gender
+            filelog.write('\n\n' + log_data)
+            filecounts.write(counts_record(name, gender, log_data, cues))
+
+    print('Saving out file in NamesOut.txt')
+    with open(out_dir / 'NamesOut.txt', 'w', encoding='utf-8') as fileout:
+        fileout.write('\n'.join([name + '\t' + gender_data[name]
+                                 for name in namestot_raw]))
+    print('Done')
+
+
+COUNTS_MAGIC = b'WGCOUNT2'
+
+
+def compile_counts(counts_path, output_path=None, cues=None):
+    """Compiles the page counts of NamesCounts.jsonl in a binary file that
+    reclassify() loads in one read.
+
+    The file starts with COUNTS_MAGIC, the number of names and the number
+    of pages (uint32), followed by the number of pages of each name
+    (uint32), the male (he+his) and female (she+her) counts of each page
+    (pairs of uint32), the method of name_to_gender_steps() that scored
+    each page (one byte, 1 or 2), the gender of each name in the build
+    (one byte, index in GENDER_CODES) and the names in UTF-8 separated by
+    line breaks. Integers are little-endian. If a name has more than one
+    line in counts_path, the last one is used.
+
+    Parameters
+    ----------
+    counts_path: str or Path
+        Page counts (see counts_record()).
+
+    output_path: str or Path, optional
+        Compiled file. Default is counts_path with a .bin suffix.
+
+    cues: cue_counter, optional
+        Cue words of the build, whose methods tell the male and female
+        words of the counts. Default is None (cue_counter()).
+
+    Returns
+    -------
+    Path
+        Path of the compiled file.
+    """
+    counts_path = Path(counts_path)
+    if output_path is None:
+        output_path = counts_path.with_suffix('.bin')
+    print('Compiling ' + counts_path.name)
+    records = {}
+    with open(counts_path, encoding='utf-8') as filecounts:
+        for line in filecounts:
+            record = json.loads(line)
+            records[record['name']] = (record['gender'], record['pages'])
+    if cues is None:
+        cues = cue_counter()
+    n_male = [len(male) for male, _ in cues.methods]
+    gender_code = {g: i for i, g in enumerate(GENDER_CODES)}
+    lengths = array('I')
+    counts = array('I')
+    methods = bytearray()
+    codes = bytearray()
+    for gender, pages in records.values():
+        lengths.append(len(pages))
+        for page in pages:
+            split = 1 + n_male[page[0] - 1]
+            counts.append(sum(page[1:split]))
+            counts.append(sum(page[split:]))
+            methods.append(page[0])
+        codes.append(gender_code.get(gender, gender_code['UNK']))
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+        counts.byteswap()
+    with open(output_path, 'wb') as fileout:
+        fileout.write(COUNTS_MAGIC)
+        fileout.write(struct.pack('<II', len(lengths), len(counts)//2))
+        fileout.write(lengths.tobytes())
+        fileout.write(counts.tobytes())
+        fileout.write(methods)
+        fileout.write(codes)
+        fileout.write('\n'.join(records).encode('utf-8'))
+    return Path(output_path)
+
+
+def read_counts(compiled_path):
+    """Reads a file written by compile_counts()
+
+    Returns
+    -------
+    tuple
+        The list of names, the array of the number of pages of each name,
+        the array of the he+his and she+her counts of the pages (as pairs),
+        the array of the method of each page, and the bytes of the gender
+        codes of the names. Arrays are numpy arrays if numpy is installed.
+    """
+    with open(compiled_path, 'rb') as f:
+        data = f.read()
+    if data[:len(COUNTS_MAGIC)] != COUNTS_MAGIC:
+        raise ValueError(str(compiled_path) + ' is not a compiled counts '
+                         'file')
+    pos = len(COUNTS_MAGIC)
+    n_names, n_pages = struct.unpack_from('<II', data, pos)
+    pos += 8
+    if np is not None:
+        lengths = np.frombuffer(data, '<u4', n_names, pos)
+        counts = np.frombuffer(data, '<u4', 2*n_pages, pos + 4*n_names)
+    else:
+        lengths = array('I', data[pos:pos + 4*n_names])
+        counts = array('I', data[pos + 4*n_names:
+                                 pos + 4*n_names + 8*n_pages])
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+            counts.byteswap()
+    pos += 4*n_names + 8*n_pages
+    if np is not None:
+        methods = np.frombuffer(data, 'u1', n_pages, pos)
+    else:
+        methods = data[pos:pos + n_pages]
+    pos += n_pages
+    codes = data[pos:pos + n_names]
+    names = []
+    if n_names:
+        names = data[pos + n_names:].decode('utf-8').split('\n')
+    return names, lengths, counts, methods, codes
+
+
+def reclassify(page_ratio=3,
+               name_ratio=3,
+               max_pages=20,
+               counts_path=None,
+               output_path=None,
+               cues=None,
+               names_path=None,
+               output_dir=None):
+    """Rebuilds NamesOut.txt from the page counts recorded in
+    NamesCounts.jsonl with other thresholds, without querying Wikipedia.
+
+    A page is a vote for male if he+his >= page_ratio*(she+her) and
+    he+his > 0, otherwise for female if she+her >= page_ratio*(he+his) and
+    she+her > 0. A name is M if its male votes are at least name_ratio
+    times its female votes (and more than 0), F in the opposite case, UNI
+    if it has votes otherwise and UNK without votes, as in name_to_gender().
+    As in name_to_gender_steps(), the pages scored by method 2 (men, male,
+    women, female) only count for a name whose pages of method 1 give no
+    vote. Only the pages recorded in the build are used: the pages of a
+    method stop when it has max_pages votes, but the pages that a build
+    with the original thresholds did not fetch are not available. Names
+    assigned INI keep it.
+
+    The counts are compiled the first time (see compile_counts()), and the
+    thresholds are applied to all the pages at once with numpy if it is
+    installed.
+
+    Parameters
+    ----------
+    page_ratio: float, optional
+        Ratio of pronouns for a page vote. Default is 3.
+
+    name_ratio: float, optional
+        Ratio of page votes for M or F. Default is 3.
+
+    max_pages: int, optional
+        Number of votes after which the pages of a name are ignored.
+        Default is 20.
+
+    counts_path: str or Path, optional
+        Page counts of the names (see counts_record()). It is compiled
+        again if it is more recent than its .bin file.
+        Default is NamesCounts.jsonl in output_dir.
+
+    output_path: str or Path, optional
+        Output file, with the names of names_path (or of counts_path if
+        names_path doesn't exist) in the NamesOut.txt format.
+        Default is NamesOut.txt in output_dir.
+
+    cues: cue_counter, optional
+        Cue words of the build, if it was given other cues. The male and
+        female counts of the pages are the sums of the counts of its male
+        and female words. Default is None (cue_counter()).
+
+    names_path: str or Path, optional
+        File of the names, as in build_dataset(). Default is Names.txt in
+        the directory of this module.
+
+    output_dir: str or Path, optional
+        Directory of the build, as in build_dataset(). Default is the
+        directory of this module.
+
+    Returns
+    -------
+    dict
+        Keys are the names of counts_path and values their new gender.
+    """
+    cwd = Path(__file__).parent.absolute()
+    if names_path is None:
+        names_path = cwd / 'Names.txt'
+    out_dir = cwd if output_dir is None else Path(output_dir)
+    if counts_path is None:
+        counts_path = out_dir / 'NamesCounts.jsonl'
+    if output_path is None:
+        output_path = out_dir / 'NamesOut.txt'
+    counts_path = Path(counts_path)
+    compiled_path = counts_path.with_suffix('.bin')
+    if (not isfile(compiled_path) or
+            compiled_path.stat().st_mtime < counts_path.stat().st_mtime):
+        compile_counts(counts_path, compiled_path, cues)
+    try:
+        names, lengths, counts, methods, codes = read_counts(compiled_path)
+    except ValueError:
+        # Compiled by an older version
+        compile_counts(counts_path, compiled_path, cues)
+        names, lengths, counts, methods, codes = read_counts(compiled_path)
+
+    if np is not None:
+        male = counts[0::2].astype(np.int64)
+        female = counts[1::2].astype(np.int64)
+        owner = np.repeat(np.arange(len(names)), lengths)
+        second = methods == 2
+        vote_m = (male >= page_ratio*female) & (male > 0)
+        vote_f = (~vote_m & (female >= page_ratio*male) & (female > 0))
+        # Votes of the previous pages of the same name and method, whose
+        # pages are consecutive
+        group = 2*owner + second
+        first = np.ones(len(group), dtype=bool)
+        first[1:] = group[1:] != group[:-1]
+        starts = np.maximum.accumulate(np.where(first,
+                                                np.arange(len(group)), 0))
+        cum = np.concatenate([[0], np.cumsum(vote_m | vote_f)])
+        before = cum[:-1] - cum[starts]
+        counted = before < max_pages
+        votes = []
+        for vote, in_method in ((vote_m, ~second), (vote_f, ~second),
+                                (vote_m, second), (vote_f, second)):
+            votes.append(np.bincount(owner[vote & counted & in_method],
+                                     minlength=len(names)))
+        genh, genf, genh2, genf2 = votes
+        # Method 2 only for the names without votes from method 1
+        use_second = genh + genf == 0
+        genh = np.where(use_second, genh2, genh)
+        genf = np.where(use_second, genf2, genf)
+        genders = np.full(len(names), 'UNK', dtype=object)
+        genders[(genh >= name_ratio*genf) & (genh > 0)] = 'M'
+        genders[(genf >= name_ratio*genh) & (genf > 0)] = 'F'
+        genders[(genders == 'UNK') & (genh + genf > 0)] = 'UNI'
+        genders = genders.tolist()
+    else:
+        genders = []
+        i = 0
+        for length in lengths:
+            # votes[method] = [genh, genf]
+            votes = {1: [0, 0], 2: [0, 0]}
+            for male, female, method in zip(counts[2*i:2*(i+length):2],
+                                            counts[2*i+1:2*(i+length):2],
+                                            methods[i:i+length]):
+                method_votes = votes[method]
+                if sum(method_votes) >= max_pages:
+                    continue
+                if male >= page_ratio*female and male > 0:
+                    method_votes[0] += 1
+                elif female >= page_ratio*male and female > 0:
+                    method_votes[1] += 1
+            i += length
+            genh, genf = votes[1] if sum(votes[1]) > 0 else votes[2]
+            genders.append(name_gender(genh, genf, name_ratio))
+    ini = GENDER_CODES.index('INI')
+    gender_data = {name: 'INI' if code == ini else gender
+                   for name, gender, code in zip(names, genders, codes)}
+
+    if isfile(names_path):
+        with open(names_path, 'r') as namefile:
+            namestot_raw = namefile.read().split('\n')
+    else:
+        namestot_raw = sorted(gender_data)
+    print('Saving out file in ' + Path(output_path).name)
+    with open(output_path, 'w', encoding='utf-8') as fileout:
+        fileout.write('\n'.join([name + '\t' + gender_data.get(name, 'UNK')
+                                 for name in namestot_raw]))
+    return gender_data
+
+
+class delimiter_table(dict):
+    """Translation table for str.translate() that replaces any character
+    that is not alphabetical (see countalpha()), a period or a hyphen by a
+    space. Characters are classified the first time they are seen."""
+
+    def __missing__(self, code):
+        c = chr(code)
+        if isalpha_char(c) or c in {'.', '-'}:
+            self[code] = c
+        else:
+            self[code] = ' '
+        return self[code]
+
+
+delimiters = delimiter_table()
+VOWEL_SET = frozenset(VOWEL_CHARS)
+
+
+def move_quotes(name):
+    "Puts words in quotations and parenthesis at the end of the string"
+    while True:
+        left_i = -1
+        right_i = -1
+        if ('"' in name and name.find('"') != name.rfind('"')):
+            left_i = name.find('"')
+            right_i = left_i + 1 + name[left_i+1:].find('"')
+        if ('(' in name and ')' in name and
+                name.find('(') < name.rfind(')')):
+            left_i = name.find('(')
+            right_i = name.rfind(')')
+        if left_i != -1 and right_i != -1:
+            name = (name[:left_i] + ' ' +
+                    name[right_i+1:] + ' ' +
+                    name[left_i+1:right_i])
+        else:
+            return name
+
+
+def nameclean(first_name):
+    """Cleans a first name string and separates it into a list of strings,
+    ordered by priority, to analyze for Wiki-Gendersort.
+    """
+
+    name = first_name
+    if '"' in name or '(' in name:
+        name = move_quotes(name)
+
+    # Separates the string in sequences with anything not a letter or a
+    # period acting as delimiter
+    namf = [n for n in name.translate(delimiters).split() if n.strip('.-')]
+
+    # Each sequence goes through the following rules, in a single pass:
+    # 1. Separates fused strings and gets rid of periods at the end of
+    #    strings, separating them if capitalization suggests it
+    #    (AliM. -> Ali M), and puts the strings that ended with a period
+    #    at the end of the sequence (where they go through rule 1 again)
+    # 2. Resplits any period that remains (A.Carl -> A Carl)
+    # 3. Hyphens duplicate the sequence and its components:
+    #    "John-Paul" -> ["John-Paul", "John", "Paul"]
+    # 4. Takes the strings that are not initials (if 1 letter or no vowels)
+    #    and duplicates any string not corresponding to unidecode characters
+    # All remaining characters are alphabetical after rule 2.
+    namf2 = []
+    j = 0
+    while j < len(namf):
+        nam = namf[j]
+        j += 1
+        if (len(nam) >= 4 and
+                nam[-1] == '.' and
+                nam[-2].isupper() and
+                nam[-3].islower()):
+            parts = [nam[:-2], nam[-2:]]
+        else:
+            parts = [nam]
+        for part in parts:
+            if part[-1] == '.' and 4 > len(part) > 1:
+                namf.append(part[:-1])
+                continue
+            for n in part.split('.'):
+                n = n.strip('-')
+                if '-' in n:
+                    subnames = [n] + n.split('-')
+                else:
+                    subnames = [n]
+                for n in subnames:
+                    if len(n) <= 1:
+                        continue
+                    if n.isascii():
+                        if VOWEL_SET.isdisjoint(n):
+                            continue
+                    elif countvowel(n) == 0:
+                        continue
+                    n = n[0].upper()+n[1:].lower()
+                    namf2.append(n)
+                    un = fold_ascii(n)
+                    if n != un:
+                        namf2.append(un)
+    return namf2
+
+
+def read_names_out(input_path):
+    """Imports a *Out.txt names database in a dict
+
+    Parameters
+    ----------
+    input_path: str or Path
+        path to the names database. Each line contains a name and its
+        gender, separated by a tab \t, encoded in utf-8.
+
+    Returns
+    -------
+    dict
+        Keys are the names, capitalized the same way as nameclean() tokens,
+        and values are the genders.
+    """
+    names_key = {}
+    with open(input_path, 'r', encoding='utf-8') as filewg:
+        for line in filewg:
+            ls = line.replace('\n', '').split('\t')
+            name = '\t'.join(ls[0:-1]).upper()
+            if name[0]:
+                name = name[0] + name[1:].lower()
+            gend = ls[-1]
+            names_key[name] = gend
+    return names_key
+
+
+# Compiled names database format:
+# COMPILED_MAGIC, number of entries (uint32), then one uint32 offset per
+# entry pointing into the records section, then the records sorted by their
+# utf-8 key: key length (uint16), key in utf-8, gender code (1 byte).
+# All integers are little-endian.
+COMPILED_MAGIC = b'WGSORT1\n'
+GENDER_CODES = ['M', 'F', 'UNI', 'UNK', 'INI']
+
+
+def pack_names(names_key):
+    """Packs a dict of names and genders into the compiled database format
+
+    Parameters
+    ----------
+    names_key: dict
+        Keys are the names and values are the genders, which must be
+        in GENDER_CODES.
+
+    Returns
+    -------
+    bytes
+        The compiled database
+    """
+    gender_code = {g: i for i, g in enumerate(GENDER_CODES)}
+    keys = sorted((k.encode('utf-8'), v) for k, v in names_key.items())
+    offsets = []
+    records = bytearray()
+    for key, gend in keys:
+        if gend not in gender_code:
+            raise ValueError('Unknown gender %r for name %r' %
+                             (gend, key.decode('utf-8')))
+        offsets.append(len(records))
+        records += struct.pack('<H', len(key))
+        records += key
+        records.append(gender_code[gend])
+    return (COMPILED_MAGIC +
+            struct.pack('<I', len(keys)) +
+            struct.pack('<%iI' % len(offsets), *offsets) +
+            bytes(records))
+
+
+def compile_names(input_path, output_path=None):
+    """Compiles a *Out.txt names database into a binary file that
+    wiki_gendersort() can open with mmap, without parsing it.
+
+    Parameters
+    ----------
+    input_path: str or Path
+        path to the names database (for example NamesOut.txt).
+
+    output_path: str or Path, optional
+        path to the compiled file. If None, the path will be input_path
+        with a .bin suffix. Default is None.
+
+    Returns
+    -------
+    Path
+        The path of the compiled file
+    """
+    input_path = Path(input_path)
+    if output_path is None:
+        output_path = input_path.with_suffix('.bin')
+    output_path = Path(output_path)
+    print('Compiling ' + input_path.name + ' into ' + output_path.name)
+    with open(output_path, 'wb') as fileout:
+        fileout.write(pack_names(read_names_out(input_path)))
+    return output_path
+
+
+def is_compiled(input_path):
+    "True if a file is a compiled names database"
+    with open(input_path, 'rb') as file:
+        return file.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+
+class packed_names():
+    """Read-only dict-like view of a compiled names database.
+
+    Lookups are done by binary search in the buffer, so nothing is parsed
+    when the database is opened.
+
+    Parameters
+    ----------
+    buffer: bytes, mmap or other buffer
+        The compiled database, as made by pack_names().
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        if bytes(buffer[:len(COMPILED_MAGIC)]) != COMPILED_MAGIC:
+            raise ValueError('Not a compiled names database')
+        self.n_names = struct.unpack_from('<I', buffer,
+                                          len(COMPILED_MAGIC))[0]
+        self.offsets_start = len(COMPILED_MAGIC) + 4
+        self.records_start = self.offsets_start + 4*self.n_names
+
+    @classmethod
+    def open(cls, input_path):
+        "Maps a compiled names database file in memory"
+        with open(input_path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def record(self, i):
+        "Returns the utf-8 key and gender code of the i-th record"
+        start = self.records_start + struct.unpack_from(
+            '<I', self.buffer, self.offsets_start + 4*i)[0]
+        key_len = struct.unpack_from('<H', self.buffer, start)[0]
+        key = self.buffer[start+2:start+2+key_len]
+        return key, self.buffer[start+2+key_len]
+
+    def get(self, name, default=None):
+        "Returns the gender of a name, or default if it is not found"
+        key = name.encode('utf-8')
+        lo = 0
+        hi = self.n_names
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, code = self.record(mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return GENDER_CODES[code]
+        return default
+
+    def __getitem__(self, name):
+        gend = self.get(name)
+        if gend is None:
+            raise KeyError(name)
+        return gend
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return self.n_names
+
+    def items(self):
+        for i in range(self.n_names):
+            key, code = self.record(i)
+            yield bytes(key).decode('utf-8'), GENDER_CODES[code]
+
+    def keys(self):
+        for key, gend in self.items():
+            yield key
+
+    def values(self):
+        for key, gend in self.items():
+            yield gend
+
+    def __iter__(self):
+        return self.keys()
+
+
+class spill_set():
+    """Set of strings that can be iterated in sorted order once complete.
+
+    Strings are kept in a hash set. If the set grows over max_size strings,
+    it is sorted and written to a temporary file, and the sorted files are
+    merged at the end, so memory stays bounded.
+
+    Parameters
+    ----------
+    max_size: int, optional
+        Maximum number of strings kept in memory. Default is 1000000.
+    """
+
+    def __init__(self,
+                 max_size=1000000):
+        self.max_size = max_size
+        self.names = set()
+        self.runs = []
+
+    def update(self, names):
+        "Adds an iterable of strings (without line breaks) to the set"
+        self.names.update(names)
+        if len(self.names) > self.max_size:
+            self.spill()
+
+    def spill(self):
+        "Writes the strings in memory to a sorted temporary file"
+        run = TemporaryFile('w+', encoding='utf-8')
+        for name in sorted(self.names):
+            run.write(name + '\n')
+        run.seek(0)
+        self.runs.append(run)
+        self.names = set()
+
+    def add_run(self, run_path):
+        "Adds the strings of a sorted file, with one string per line"
+        self.runs.append(open(run_path, 'r', encoding='utf-8'))
+
+    def __iter__(self):
+        "Iterates the unique strings in sorted order"
+        runs = [(line[:-1] for line in run) for run in self.runs]
+        previous = None
+        for name in heapq.merge(sorted(self.names), *runs):
+            if name != previous:
+                yield name
+                previous = name
+
+    def close(self):
+        "Deletes the temporary files"
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.names = set()
+
+
+class lru_memo():
+    """Bounded memoization of a function of one hashable argument, with
+    least recently used eviction.
+
+    Parameters
+    ----------
+    func: callable
+        Function to memoize.
+
+    maxsize: int, optional
+        Maximum number of results kept in memory. Once reached, the least
+        recently used result is evicted. Default is 65536.
+
+    Hit, miss and eviction counters are available with stats().
+    Results that are lists are copied when returned, so callers can modify
+    them without corrupting the cache. The cache can be shared between
+    threads.
+
+    Example:
+        cached_nameclean = lru_memo(nameclean, maxsize=100000)
+        cached_nameclean('Jean-Paul')
+        cached_nameclean.stats()
+    """
+
+    def __init__(self,
+                 func,
+                 maxsize=65536):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.func = func
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, arg):
+        with self.lock:
+            result = self.cache.get(arg, self)
+            if result is not self:
+                self.hits += 1
+                self.cache.move_to_end(arg)
+        if result is self:
+            # Computed outside of the lock so other threads are not blocked
+            result = self.func(arg)
+            with self.lock:
+                self.misses += 1
+                self.cache[arg] = result
+                if len(self.cache) > self.maxsize:
+                    self.cache.popitem(last=False)
+                    self.evictions += 1
+        if isinstance(result, list):
+            return list(result)
+        return result
+
+    def stats(self):
+        "Returns a dict of the hits, misses, evictions and size of the cache"
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.cache),
+                    'maxsize': self.maxsize}
+
+    def clear(self):
+        "Empties the cache and resets the counters"
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+# Result of wiki_gendersort.assign_result()
+# gender: str, M, F, UNI, UNK or INI
+# matched_name: str or None, name token that determined the gender
+# unknown_names: tuple of str, name tokens not in the database
+# tokens: tuple of str, name tokens from nameclean()
+gender_assignment = namedtuple('gender_assignment',
+                               ['gender', 'matched_name',
+                                'unknown_names', 'tokens'])
 
 
 class wiki_gendersort():
+    """Assigns genders to first names with a Wiki-Gendersort names database.
+
+    assign() stores the matched name token and unknown name tokens of the
+    last call in the matched_name and unknown_set attributes, so it should
+    not be used by several threads at once. assign_result(), assign_many()
+    and file_assign() do not modify the object, so one instance can be
+    shared by many threads.
+    """
+
     def __init__(self,
                  input_path=None,
-                 verbose=False):
+                 verbose=False,
+                 cache_size=None,
+                 backend='dict'):
+        """Imports the names database.
+
+        Parameters
+        ----------
+        input_path: str, optional
+            path to the *Out.txt names database. If None, NamesOut.txt in
+            the module directory is used. Default is None.
+
+        verbose: bool, optional
+            Prints the name of the imported database. Default is False.
+
+        cache_size: int, optional
+            If not None, the results of assign() are memoized for the
+            cache_size most recently used raw names, so that repeated names
+            cost a single dictionary lookup. Statistics are available with
+            cache_stats(). Default is None (no cache).
+
+        backend: str, optional
+            How the names database is kept in memory.
+            'dict': a Python dict, which is the fastest for lookups but uses
+            about 100 bytes per name.
+            'compact': a single packed buffer of sorted keys with an
+            offsets array and one byte per gender (see pack_names()), which
+            uses 7 bytes per name plus the name in utf-8 (about 14 bytes per
+            name on data_compare/GenderCheckerOut.txt). Lookups are done by
+            binary search and are a few times slower than with the dict.
+            Default is 'dict'.
+        """
+        if backend not in ('dict', 'compact'):
+            raise ValueError("backend must be 'dict' or 'compact'")
         if input_path is None:
             cwd = Path(__file__).parent.absolute()
             self.input_path = cwd / 'NamesOut.txt'
@@ -462,46 +4107,119 @@ class wiki_gendersort():
 
         if verbose:
             print('Importing names database from ' + self.input_path.name)
-        self.names_key = {}
-        with open(self.input_path, 'r', encoding='utf-8') as filewg:
-            for line in filewg.readlines():
-                ls = line.replace('\n', '').split('\t')
-                name = '\t'.join(ls[0:-1]).upper()
-                if name[0]:
-                    name = name[0] + name[1:].lower()
-                gend = ls[-1]
-                self.names_key[name] = gend
+        if is_compiled(self.input_path):
+            self.names_key = packed_names.open(self.input_path)
+        elif backend == 'compact':
+            self.names_key = packed_names(
+                pack_names(read_names_out(self.input_path)))
+        else:
+            self.names_key = read_names_out(self.input_path)
+
+        self.assign_cache = None
+        if cache_size is not None:
+            self.assign_cache = lru_memo(self._assign, maxsize=cache_size)
+
+    def cache_stats(self):
+        """Returns a dict of the hits, misses, evictions and size of the
+        assign() cache, or None if the cache is disabled"""
+        if self.assign_cache is None:
+            return None
+        return self.assign_cache.stats()
 
     def assign(self,
                name):
-        "Assign a gender to a first name (string)"
-        self.unknown_set = []
-        self.matched_name = None
+        """Assign a gender to a first name (string)
+
+        The matched name token and unknown name tokens are saved in the
+        matched_name and unknown_set attributes.
+        """
+        result = self.assign_result(name)
+        self.matched_name = result.matched_name
+        self.unknown_set = list(result.unknown_names)
+        return result.gender
+
+    def assign_result(self,
+                      name):
+        """Assign a gender to a first name (string), without modifying the
+        object, so it can be called by many threads at once.
+
+        Returns
+        -------
+        gender_assignment
+            Named tuple of the gender, the name token that determined it
+            (or None), the tuple of name tokens that are not in the
+            database and the tuple of all name tokens.
+        """
+        if self.assign_cache is None:
+            return self._assign(name)
+        return self.assign_cache(name)
+
+    def _assign(self,
+                name):
+        "Computes the gender_assignment of a first name (string)"
+        unknown_set = []
+        matched_name = None
         namelist = nameclean(name)
         gend = 'UNK'
         for nam in namelist:
-            if nam in self.names_key:
-                new_gend = self.names_key[nam]
+            new_gend = self.names_key.get(nam)
+            if new_gend is not None:
                 if new_gend != 'UNK':
-                    if not self.matched_name:
-                        self.matched_name = nam
+                    if not matched_name:
+                        matched_name = nam
                     gend = new_gend
             else:
-                self.unknown_set.append(nam)
+                unknown_set.append(nam)
             if gend not in {'UNK', 'UNI'}:
-                self.matched_name = nam
+                matched_name = nam
                 break
         if not namelist and name:
             gend = 'INI'
         if name.upper() == 'NULL':
             gend = 'UNK'
 
-        return gend
+        return gender_assignment(gend, matched_name, tuple(unknown_set),
+                                 tuple(namelist))
+
+    def assign_many(self,
+                    names):
+        """Assigns a gender to many first names at once.
+
+        Duplicate names are cleaned and looked up only once, then the
+        genders are put back in the original order.
+
+        Parameters
+        ----------
+        names: iterable of str
+            First names (strings). Can be a list, a generator, a numpy
+            object array or a pandas Series.
+
+        Returns
+        -------
+        list of str
+            The gender of each name, in the same order as names. If names
+            is a pandas Series, a Series with the same index is returned.
+        """
+        names_list = list(names)
+        unique_gend = {}
+        for name in names_list:
+            if name not in unique_gend:
+                unique_gend[name] = None
+        for name in unique_gend:
+            unique_gend[name] = self.assign_result(name).gender
+        genders = [unique_gend[name] for name in names_list]
+        # pandas Series keep their index
+        if hasattr(names, 'index') and hasattr(names, 'to_numpy'):
+            return type(names)(genders, index=names.index, name=names.name)
+        return genders
 
     def file_assign(self,
                     input_path,
                     output_path=None,
-                    unknown_path=None):
+                    unknown_path=None,
+                    chunk_size=10000,
+                    max_unknown=1000000,
+                    workers=1):
         """Assigns a gender to a list of first names in a file.
 
         Parameters
@@ -530,6 +4248,23 @@ class wiki_gendersort():
 
             If None, the path will be input_path+'_unknown.txt'.
             Default is None.
+
+        chunk_size: int, optional
+            Number of output lines written at once. Default is 10000.
+
+        max_unknown: int, optional
+            Maximum number of unknown names kept in memory before they are
+            sorted into temporary files. Default is 1000000.
+
+        workers: int, optional
+            Number of processes. If more than 1, the input file is split in
+            byte ranges that are assigned in parallel, each process looking
+            up names in the same memory-mapped compiled database (see
+            compile_names()), and the outputs are merged in the original
+            order. Default is 1.
+
+        The input file is read line by line, so memory does not grow with
+        its size.
         """
         input_path = Path(input_path).absolute()
         print('Assigning gender to the names in file ' + input_path.name)
@@ -537,28 +4272,153 @@ class wiki_gendersort():
             output_path = input_path.parent / (input_path.stem+'_output.txt')
         if unknown_path is None:
             unknown_path = input_path.parent / (input_path.stem+'_unknown.txt')
-        infile = open(input_path, 'r', encoding='utf-8')
-        outfile = open(output_path, 'w', encoding='utf-8')
-        newnames = []
-        for line in infile.readlines():
-            name = line.replace('\n', '')
-            gend = self.assign(name)
-            for newname in self.unknown_set:
-                nind = bisect_left(newnames, newname)
-                if nind == len(newnames) or newnames[nind] != newname:
-                    newnames.insert(nind, newname)
-            outfile.write(line.replace('\n', '') + '\t' + gend + '\n')
-        infile.close()
-        outfile.close()
+        output_path = Path(output_path)
+        unknown_path = Path(unknown_path)
+        newnames = spill_set(max_unknown)
+        if workers > 1:
+            tempdir = TemporaryDirectory()
+            self._parallel_assign(input_path, output_path, newnames,
+                                  Path(tempdir.name), chunk_size,
+                                  max_unknown, workers)
+        else:
+            tempdir = None
+            with open(input_path, 'r', encoding='utf-8') as infile, \
+                    open(output_path, 'w', encoding='utf-8') as outfile:
+                self._assign_lines(infile, outfile, newnames, chunk_size)
         print('Genders assigned in file ' + output_path.name)
-        if len(newnames) != 0:
-            with open(unknown_path, 'w', encoding='utf-8') as newfile:
-                newfile.write('\n'.join(newnames))
-            print('%i unknown names identified in file ' % len(newnames) +
+        n_newnames = 0
+        newfile = None
+        for newname in newnames:
+            if newfile is None:
+                newfile = open(unknown_path, 'w', encoding='utf-8')
+                newfile.write(newname)
+            else:
+                newfile.write('\n' + newname)
+            n_newnames += 1
+        newnames.close()
+        if tempdir is not None:
+            tempdir.cleanup()
+        if newfile is not None:
+            newfile.close()
+            print('%i unknown names identified in file ' % n_newnames +
                   unknown_path.name)
             print('Consider adding those names to Names.txt and ' +
                   'running build_dataset()')
 
+    def _assign_lines(self,
+                      lines,
+                      outfile,
+                      newnames,
+                      chunk_size=10000):
+        """Writes each line of an iterable with its gender in outfile, and
+        adds the unknown name tokens to the spill_set newnames"""
+        chunk = []
+        for line in lines:
+            name = line.replace('\n', '')
+            result = self.assign_result(name)
+            newnames.update(result.unknown_names)
+            chunk.append(name + '\t' + result.gender + '\n')
+            if len(chunk) >= chunk_size:
+                outfile.write(''.join(chunk))
+                chunk = []
+        outfile.write(''.join(chunk))
+
+    def _parallel_assign(self,
+                         input_path,
+                         output_path,
+                         newnames,
+                         tempdir,
+                         chunk_size,
+                         max_unknown,
+                         workers):
+        """file_assign() over byte ranges of the input file in a pool of
+        processes, with temporary files in tempdir"""
+        if isinstance(self.names_key, packed_names):
+            if isinstance(self.names_key.buffer, mmap.mmap):
+                db_path = self.input_path
+            else:
+                db_path = tempdir / 'names.bin'
+                with open(db_path, 'wb') as dbfile:
+                    dbfile.write(self.names_key.buffer)
+        else:
+            db_path = tempdir / 'names.bin'
+            with open(db_path, 'wb') as dbfile:
+                dbfile.write(pack_names(self.names_key))
+        cache_size = None
+        if self.assign_cache is not None:
+            cache_size = self.assign_cache.maxsize
+
+        # Chunk boundaries are moved to the start of the next line
+        n_chunks = 4*workers
+        file_size = input_path.stat().st_size
+        bounds = [0]
+        with open(input_path, 'rb') as infile:
+            for i in range(1, n_chunks):
+                infile.seek(max(file_size*i//n_chunks, bounds[-1]))
+                if infile.tell() > 0:
+                    infile.seek(infile.tell()-1)
+                    infile.readline()
+                bounds.append(infile.tell())
+        bounds.append(file_size)
+        tasks = [(input_path, bounds[i], bounds[i+1],
+                  tempdir / ('chunk%i' % i), chunk_size, max_unknown)
+                 for i in range(n_chunks) if bounds[i] < bounds[i+1]]
+
+        with Pool(workers,
+                  initializer=init_assign_worker,
+                  initargs=(db_path, cache_size)) as pool:
+            chunk_paths = pool.map(assign_chunk, tasks)
+
+        with open(output_path, 'wb') as outfile:
+            for out_path, run_path in chunk_paths:
+                with open(out_path, 'rb') as chunkfile:
+                    copyfileobj(chunkfile, outfile)
+                newnames.add_run(run_path)
+
+
+# wiki_gendersort of the worker processes of file_assign(workers=N)
+worker_gendersort = None
+
+
+def init_assign_worker(db_path, cache_size):
+    "Opens the compiled names database in a file_assign() worker process"
+    global worker_gendersort
+    worker_gendersort = wiki_gendersort(input_path=db_path,
+                                        cache_size=cache_size)
+
+
+def assign_chunk(task):
+    """Assigns the genders of the lines in a byte range of a file.
+
+    Parameters
+    ----------
+    task: tuple
+        (input_path, start, end, chunk_path, chunk_size, max_unknown).
+        start and end are byte offsets at the start of lines.
+
+    Returns
+    -------
+    tuple of Path
+        Path to the output lines, and path to the sorted unknown names
+        (one per line).
+    """
+    input_path, start, end, chunk_path, chunk_size, max_unknown = task
+    with open(input_path, 'rb') as infile:
+        infile.seek(start)
+        text = infile.read(end-start).decode('utf-8')
+    out_path = chunk_path.with_suffix('.out')
+    run_path = chunk_path.with_suffix('.unk')
+    newnames = spill_set(max_unknown)
+    # Same newline translation as reading the file in text mode
+    lines = io.StringIO(text, newline=None)
+    with open(out_path, 'w', encoding='utf-8') as outfile:
+        worker_gendersort._assign_lines(lines, outfile, newnames, chunk_size)
+    with open(run_path, 'w', encoding='utf-8') as runfile:
+        for newname in newnames:
+            runfile.write(newname + '\n')
+    newnames.close()
+    return out_path, run_path
+
 
 if __name__ == '__main__':
     # build_dataset()
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the Wiki-Gendersort lookup path
+
+Measures the speed of nameclean(), wiki_gendersort.assign(),
+wiki_gendersort.assign_many() and wiki_gendersort.file_assign() on a
+reproducible synthetic corpus of first name strings, as well as the time
+to load the names database and the peak memory of each step.
+
+Results are saved in a JSON file so runs can be compared with
+compare_benchmarks().
+
+check_nameclean() checks that nameclean() gives the same tokens as its
+original implementation on a large fuzzed corpus, and check_cue_counter() does the same for the
+scoring of page summaries (cue_counter).
+    results = run_benchmarks('bench_new.json')
+    compare_benchmarks('bench_old.json', 'bench_new.json')
+"""
+
+import json
+import random
+import string
+import platform
+import tracemalloc
+from time import perf_counter
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unidecode import unidecode
+from Wiki_Gendersort import (wiki_gendersort, nameclean, compile_names,
+                             read_names_out, countalpha, countvowel,
+                             cue_counter, PRONOUNS, KEYWORDS)
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+ACCENTS = {'a': 'áàâäå', 'e': 'éèêë', 'i': 'íìîï', 'o': 'óòôöø',
+           'u': 'úùûü', 'c': 'ç', 'n': 'ñ', 's': 'š', 'z': 'ž'}
+
+
+def default_db_path():
+    "NamesOut.txt if it exists, otherwise a comparison dataset of the repo"
+    cwd = Path(__file__).parent.absolute()
+    if (cwd / 'NamesOut.txt').exists():
+        return cwd / 'NamesOut.txt'
+    return cwd / 'data_compare' / 'GenderCheckerOut.txt'
+
+
+def decorate(name, rnd):
+    "Returns a variant of a first name as found in author databases"
+    first = name[0]
+    rest = name[1:].lower()
+    variant = rnd.random()
+    if variant < 0.15:
+        # Diacritics
+        rest = ''.join(rnd.choice(ACCENTS[c])
+                       if c in ACCENTS and rnd.random() < 0.5 else c
+                       for c in rest)
+        return first + rest
+    elif variant < 0.25:
+        # Initial
+        return first + '.'
+    elif variant < 0.35:
+        # Name with a middle initial, sometimes fused (AliM.)
+        sep = rnd.choice([' ', ''])
+        return first + rest + sep + rnd.choice('ABCDEFGHJKLMNPRST') + '.'
+    elif variant < 0.40:
+        # Initials with a period and a hyphen (J.-P.)
+        return first + '.-' + rnd.choice('ABCDEFGHJKLMNPRST') + '.'
+    elif variant < 0.45:
+        # Initial stuck to a name (A.Carl)
+        return rnd.choice('ABCDEFGHJKLMNPRST') + '.' + first + rest
+    elif variant < 0.50:
+        # Quoted nickname
+        return first + rest + ' "' + first + rest[:2] + '"'
+    elif variant < 0.55:
+        # Parenthesized alias
+        return first + rest + ' (' + first + rest[::-1] + ')'
+    elif variant < 0.60:
+        # Upper case
+        return (first + rest).upper()
+    elif variant < 0.61:
+        return rnd.choice(['', 'NULL', '-', '..'])
+    return first + rest
+
+
+def make_corpus(n_names=200000,
+                n_distinct=20000,
+                db_path=None,
+                seed=0):
+    """Builds a reproducible list of first name strings.
+
+    Parameters
+    ----------
+    n_names: int, optional
+        Number of first name strings. Default is 200000.
+
+    n_distinct: int, optional
+        Number of distinct base strings, sampled from a Zipf-like
+        distribution so the corpus contains many duplicates like real
+        author databases. Default is 20000.
+
+    db_path: str or Path, optional
+        Names database from which base names are drawn.
+        Default is default_db_path().
+
+    seed: int, optional
+        Random seed. Default is 0.
+
+    Returns
+    -------
+    list of str
+    """
+    if db_path is None:
+        db_path = default_db_path()
+    rnd = random.Random(seed)
+    base = sorted(n for n in read_names_out(db_path) if len(n) > 1)
+    base = rnd.sample(base, min(n_distinct, len(base)))
+    distinct = []
+    for i in range(len(base)):
+        if rnd.random() < 0.1:
+            # Hyphenated names
+            distinct.append(base[i] + '-' + rnd.choice(base))
+        else:
+            distinct.append(decorate(base[i], rnd))
+    weights = [1/(i+1) for i in range(len(distinct))]
+    return rnd.choices(distinct, weights=weights, k=n_names)
+
+
+def nameclean_reference(first_name):
+    """Original multi-pass implementation of nameclean(), kept to check
+    that nameclean() returns exactly the same name tokens.
+    """
+
+    name = first_name
+    # Puts words in quotations and parenthesis at the end of the string
+    while True:
+        left_i = -1
+        right_i = -1
+        if ('"' in name and name.find('"') != name.rfind('"')):
+            left_i = name.find('"')
+            right_i = left_i + 1 + name[left_i+1:].find('"')
+        if ('(' in name and ')' in name and
+                name.find('(') < name.rfind(')')):
+            left_i = name.find('(')
+            right_i = name.rfind(')')
+        if left_i != -1 and right_i != -1:
+            name = (name[:left_i] + ' ' +
+                    name[right_i+1:] + ' ' +
+                    name[left_i+1:right_i])
+        else:
+            break
+
+    # Separates the string in sequences with anything not a letter or a
+    # period acting as delimiter
+    namf = ''
+    for i in name:
+        if countalpha(i) >= 1 or i in {'.', '-'}:
+            namf += i
+        else:
+            namf += ' '
+    namf = [n for n in namf.split() if countalpha(n) != 0]
+
+    # Separates fused strings and gets rid of periods at the end of strings,
+    # separating them if capitalization suggests it (AliM. -> Ali M),
+    # and puts the strings that ended with a period as the end of the sequence
+    j = 0
+    while j < len(namf):
+        if (len(namf[j]) >= 4 and
+                namf[j][-1] == '.' and
+                namf[j][-2].isupper() and
+                namf[j][-3].islower()):
+            namf.insert(j+1, namf[j][-2:])
+            namf[j] = namf[j][:-2]
+        if namf[j][-1] == '.' and 4 > len(namf[j]) > 1:
+            namf.append(namf[j][:-1])
+            del namf[j]
+            j -= 1
+        j += 1
+
+    # Resplit any period that remains (A.Carl -> A Carl)
+    j = 0
+    while j < len(namf):
+        if '.' in namf[j]:
+            namsplit = namf[j].split('.')[::-1]
+            for n in namsplit:
+                namf.insert(j + 1, n)
+            del namf[j]
+            j += len(namsplit)-1
+        j += 1
+
+    # Hyphens will duplicate the sequence and its components:
+    # "John-Paul" -> ["John-Paul", "John", "Paul"]
+    j = 0
+    while j < len(namf):
+        # namf[j] = '-'.join([n for n in namf[j].split('-') if n])
+        while namf[j] and namf[j][0] == '-':
+            namf[j] = namf[j][1:]
+        while namf[j] and namf[j][-1] == '-':
+            namf[j] = namf[j][:-1]
+        if '-' in namf[j]:
+            for n in namf[j].split('-')[::-1]:
+                namf.insert(j + 1, n)
+        j += 1
+
+    # Takes the strings that are not initials (if 1 letter or no vowels)
+    # and duplicates any string not corresponding to unidecode characters
+    namf2 = []
+    for nam in namf:
+        if countalpha(nam) > 1 and countvowel(nam) > 0:
+            if len(nam) <= 1:
+                n = nam.upper()
+            else:
+                n = nam[0].upper()+nam[1:].lower()
+            namf2.append(n)
+            un = unidecode(n)
+            if n != un:
+                namf2.append(un)
+    return namf2
+
+
+def fuzz_names(n_names=1000000,
+               seed=0):
+    """Builds random strings made of letters, accented and non-latin
+    characters, initials, periods, hyphens, quotes and parentheses, to
+    exercise all the rules of nameclean()"""
+    rnd = random.Random(seed)
+    pieces = (list(string.ascii_letters) +
+              list('..--  "()\',') +
+              [c for v in ACCENTS.values() for c in v] +
+              list('ÉÇØÆæßĳŁłÅ') +
+              [chr(rnd.randrange(0x80, 0x3000)) for _ in range(100)] +
+              ['\u200b', '\u0301', '\U0001f600', '\u4e2d', '\u044f'] +
+              ['Jean', 'Marie', 'Ali', 'Paul', 'Li', 'Yu', 'Nguyen'])
+    return [''.join(rnd.choice(pieces)
+                    for _ in range(rnd.randint(0, 12)))
+            for _ in range(n_names)]
+
+
+def check_nameclean(n_names=1000000,
+                    seed=0,
+                    db_path=None):
+    """Checks that nameclean() and nameclean_reference() return the same
+    name tokens on a fuzzed corpus and on the synthetic corpus.
+
+    Raises an AssertionError listing the names with a different result.
+    """
+    print('Checking nameclean against nameclean_reference')
+    names = (fuzz_names(n_names, seed) +
+             make_corpus(n_names//10, db_path=db_path, seed=seed))
+    errors = [name for name in names
+              if nameclean(name) != nameclean_reference(name)]
+    print('%i differences out of %i names' % (len(errors), len(names)))
+    assert not errors, 'Different results for %r' % errors[:20]
+
+
+def count_cues_reference(summary):
+    """Original scoring of a page summary in name_to_gender(), returning
+    the counts of PRONOUNS + KEYWORDS"""
+    tpag = summary.lower()
+    tpag = tpag.replace('\n', ' ')
+    tpag = tpag.replace('(', ' ')
+    tpag = tpag.replace(')', ' ')
+    tpag = tpag.replace(",", ' ')
+    tpag = tpag.replace(".", ' ')
+    tpag = tpag.replace("'", ' ')
+    return [tpag.count(' ' + word + ' ') for word in PRONOUNS + KEYWORDS]
+
+
+def make_summaries(n_pages=100000,
+                   seed=0):
+    """Builds random page summaries made of cue words in any case, other
+    words, delimiters, whitespace and non-latin characters"""
+    rnd = random.Random(seed)
+    pieces = ([w for w in PRONOUNS + KEYWORDS] +
+              [w.upper() for w in PRONOUNS + KEYWORDS] +
+              ['He', 'She', 'HIS', 'the', 'hero', 'shes', 'mens', 'man'] +
+              list(" \n\t(),.'-;") + [' ', ' ', ' '] +
+              ['\u0130', '\u212a', '\xe9', '\u4e2d', '\U0001f600', '\0'])
+    return [''.join(rnd.choice(pieces)
+                    for _ in range(rnd.randint(0, 200)))
+            for _ in range(n_pages)]
+
+
+def check_cue_counter(n_pages=100000,
+                      seed=0):
+    """Checks that cue_counter.count() and count_many() give the counts of
+    count_cues_reference() on random summaries.
+
+    Raises an AssertionError listing the summaries with different counts.
+    """
+    print('Checking cue_counter against count_cues_reference')
+    summaries = make_summaries(n_pages, seed)
+    counter = cue_counter()
+    reference = [count_cues_reference(text) for text in summaries]
+    batch = counter.count_many(summaries)
+    errors = [text for text, ref, counts in zip(summaries, reference, batch)
+              if counter.count(text) != ref or counts != ref]
+    print('%i differences out of %i summaries' % (len(errors),
+                                                  len(summaries)))
+    assert not errors, 'Different counts for %r' % errors[:20]
+
+
+def peak_rss():
+    "Peak resident memory of the process in MB, or None if not available"
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+def measure(func, n_items=None, repeat=3):
+    """Runs func repeat times and returns a dict of the best time in
+    seconds, the rate in items per second if n_items is given, the peak
+    Python memory allocated during one run and the peak RSS afterwards,
+    in MB."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {'seconds': min(times),
+              'peak_alloc_mb': peak_alloc / 2**20,
+              'peak_rss_mb': peak_rss()}
+    if n_items is not None:
+        result['per_second'] = n_items / min(times)
+    return result
+
+
+def run_benchmarks(output_path=None,
+                   db_path=None,
+                   n_names=200000,
+                   seed=0,
+                   repeat=3):
+    """Runs all benchmarks and saves the results.
+
+    Parameters
+    ----------
+    output_path: str or Path, optional
+        JSON file where the results are saved. If None, results are only
+        returned. Default is None.
+
+    db_path: str or Path, optional
+        Names database (*Out.txt) to use. Default is default_db_path().
+
+    n_names: int, optional
+        Size of the synthetic corpus. Default is 200000.
+
+    seed: int, optional
+        Random seed of the corpus. Default is 0.
+
+    repeat: int, optional
+        Number of runs of each benchmark, the best one is kept.
+        Default is 3.
+
+    Returns
+    -------
+    dict
+        Results of each benchmark, with the run parameters.
+    """
+    if db_path is None:
+        db_path = default_db_path()
+    db_path = Path(db_path)
+    corpus = make_corpus(n_names=n_names, db_path=db_path, seed=seed)
+    results = {'date': str(datetime.now()),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'db_path': db_path.name,
+               'n_names': n_names,
+               'n_distinct': len(set(corpus)),
+               'seed': seed,
+               'benchmarks': {}}
+    benchmarks = results['benchmarks']
+
+    with TemporaryDirectory() as tempdir:
+        tempdir = Path(tempdir)
+        bin_path = compile_names(db_path, tempdir / 'names.bin')
+
+        print('Benchmarking database load')
+        benchmarks['load_dict'] = measure(
+            lambda: wiki_gendersort(db_path), repeat=repeat)
+        benchmarks['load_compact'] = measure(
+            lambda: wiki_gendersort(db_path, backend='compact'),
+            repeat=repeat)
+        benchmarks['load_compiled'] = measure(
+            lambda: wiki_gendersort(bin_path), repeat=repeat)
+
+        print('Benchmarking nameclean')
+        benchmarks['nameclean'] = measure(
+            lambda: [nameclean(name) for name in corpus],
+            n_names, repeat=repeat)
+        benchmarks['nameclean_reference'] = measure(
+            lambda: [nameclean_reference(name) for name in corpus],
+            n_names, repeat=repeat)
+
+        print('Benchmarking page scoring')
+        summaries = make_summaries(n_names//10, seed)
+        counter = cue_counter()
+        benchmarks['page_scoring'] = measure(
+            lambda: [counter.count(text) for text in summaries],
+            len(summaries), repeat=repeat)
+        benchmarks['page_scoring_batch'] = measure(
+            lambda: counter.count_many(summaries), len(summaries),
+            repeat=repeat)
+        benchmarks['page_scoring_reference'] = measure(
+            lambda: [count_cues_reference(text) for text in summaries],
+            len(summaries), repeat=repeat)
+
+        WGs = {'dict': wiki_gendersort(db_path),
+               'compact': wiki_gendersort(db_path, backend='compact'),
+               'compiled': wiki_gendersort(bin_path)}
+        for backend, WG in WGs.items():
+            print('Benchmarking assign with the %s database' % backend)
+            benchmarks['assign_' + backend] = measure(
+                lambda: [WG.assign(name) for name in corpus],
+                n_names, repeat=repeat)
+            benchmarks['assign_many_' + backend] = measure(
+                lambda: WG.assign_many(corpus), n_names, repeat=repeat)
+
+        print('Benchmarking assign with a cache')
+        WG_cached = wiki_gendersort(db_path, cache_size=n_names)
+        benchmarks['assign_cached'] = measure(
+            lambda: [WG_cached.assign(name) for name in corpus],
+            n_names, repeat=1)
+
+        print('Benchmarking file_assign')
+        input_path = tempdir / 'names.txt'
+        with open(input_path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(corpus))
+        WG = WGs['dict']
+        benchmarks['file_assign'] = measure(
+            lambda: WG.file_assign(input_path), n_names, repeat=repeat)
+
+    if output_path is not None:
+        with open(output_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print('Results saved in ' + Path(output_path).name)
+    return results
+
+
+def compare_benchmarks(old_path, new_path):
+    """Prints the speed ratio of each benchmark between two result files.
+    Ratios above 1 mean the new run is faster."""
+    with open(old_path, encoding='utf-8') as file:
+        old = json.load(file)['benchmarks']
+    with open(new_path, encoding='utf-8') as file:
+        new = json.load(file)['benchmarks']
+    print('%-22s|%10s|%10s|%8s' % ('BENCHMARK', 'OLD (s)', 'NEW (s)',
+                                    'SPEEDUP'))
+    for name in new:
+        if name in old:
+            print('%-22s|%10.4f|%10.4f|%7.2fx' %
+                  (name, old[name]['seconds'], new[name]['seconds'],
+                   old[name]['seconds']/new[name]['seconds']))
+
+
+if __name__ == '__main__':
+    run_benchmarks(Path(__file__).parent.absolute() / 'bench_output.json')
@@ -290,13 +290,15 @@ def table_compare(sort_path):
     for name, ppm in tqdm(names_ppm.items()):
         current_tokens = nameclean(name)
         all_tokens += current_tokens
-        default_gender = WG.assign(name)
-        if default_gender in {'M', 'F', 'UNI'} and WG.matched_name:
+        default_result = WG.assign_result(name)
+        default_gender = default_result.gender
+        matched_name = default_result.matched_name
+        if default_gender in {'M', 'F', 'UNI'} and matched_name:
             default_gender = gender_dict[default_gender]
-            method = name_method[WG.matched_name]
-            default_names.append(WG.matched_name)
-            gender_tokens[default_gender].append(WG.matched_name)
-            method_tokens[method].append(WG.matched_name)
+            method = name_method[matched_name]
+            default_names.append(matched_name)
+            gender_tokens[default_gender].append(matched_name)
+            method_tokens[method].append(matched_name)
             method_ppm[method] += ppm
         elif default_gender == 'UNK':
             default_gender = gender_dict[default_gender]
@@ -308,9 +310,11 @@ def table_compare(sort_path):
             default_gender = gender_dict[default_gender]
         gender_ppm[default_gender] += ppm
         for i, GS in enumerate(compare_GSs):
-            compare_gender = GS.assign(name)
-            if compare_gender in {'M', 'F', 'UNI'} and GS.matched_name:
-                compare_names[i].append(GS.matched_name)
+            compare_result = GS.assign_result(name)
+            compare_gender = compare_result.gender
+            if (compare_gender in {'M', 'F', 'UNI'} and
+                    compare_result.matched_name):
+                compare_names[i].append(compare_result.matched_name)
             compare_gender = gender_dict[compare_gender]
             tables[i][compare_gender][default_gender] += ppm
 
@@ -444,7 +448,8 @@ def namsor_compare():
             all_tokens += nameclean(name)
             ppm = float(ls[2]) - cumul_ppm
             cumul_ppm = float(ls[2])
-            default_gender = WG.assign(name)
+            default_result = WG.assign_result(name)
+            default_gender = default_result.gender
             compare_gender = ls[-1]
             if compare_gender == 'male':
                 compare_gender = 'M'
@@ -454,9 +459,10 @@ def namsor_compare():
                 compare_gender = 'UNK'
             else:
                 print('genre introuvable: '+compare_gender)
-            if default_gender in {'M', 'F', 'UNI'} and WG.matched_name:
+            if (default_gender in {'M', 'F', 'UNI'} and
+                    default_result.matched_name):
                 default_gender = gender_dict[default_gender]
-                default_names.append(WG.matched_name)
+                default_names.append(default_result.matched_name)
             else:
                 default_gender = gender_dict[default_gender]
             compare_gender = gender_dict[compare_gender]
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Puts the modules of the repository on the path of the tests
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
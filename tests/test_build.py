@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental builds, the journal, the shards, reclassify() and
+the bounded containers of Wiki_Gendersort
+"""
+
+import json
+
+import pytest
+import wikipedia
+import Wiki_Gendersort as WG
+from wiki_standin import make_fixture, serve, use_standin
+
+NAMES = ['Jean', 'Marie', 'Alex', 'Camille', 'Dominique', 'Claude',
+         'Andrea', 'J', '']
+
+
+def record(name, gender, time, pages=''):
+    return '%s\n1\n%s%s = 0H 0F\n%s\n%s = %s' % (name, pages, name, time,
+                                                 name, gender)
+
+
+def read_out(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def write_names(path, names):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(names))
+
+
+@pytest.fixture(scope='module')
+def standin():
+    api_url = wikipedia.wikipedia.API_URL
+    server, url = serve(make_fixture(NAMES, seed=1))
+    use_standin(url)
+    yield url
+    server.shutdown()
+    use_standin(api_url)
+
+
+def test_scan_log_truncates_incomplete_record(tmp_path):
+    log_path = tmp_path / 'NamesLog.txt'
+    complete = '\n\n'.join([record('Jean', 'M', '2021-03-04 10:00:00.5'),
+                            record('Marie', 'F', '2021-03-04 10:00:01')])
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write(complete + '\n\nCamille\n1\nCamille Claudel\nhe=0 his=')
+    assert WG.scan_log(log_path, chunk_size=16) == {'Jean': 'M',
+                                                    'Marie': 'F'}
+    assert read_out(log_path) == complete
+    # A complete log is left as it is
+    assert WG.scan_log(log_path) == {'Jean': 'M', 'Marie': 'F'}
+    assert read_out(log_path) == complete
+
+
+def test_scan_log_keeps_latest_record(tmp_path):
+    log_path = tmp_path / 'NamesLog.txt'
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join([record('Jean', 'UNK', '2021-03-04 10:00:00'),
+                             record('Jean', 'M', '2021-03-05 10:00:00'),
+                             record('Jean', 'F', '2021-03-01 10:00:00')]))
+    assert WG.scan_log(log_path) == {'Jean': 'M'}
+
+
+def counts_line(name, gender, pages):
+    return json.dumps({'name': name, 'gender': gender,
+                       'pages': pages}) + '\n'
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_reclassify(tmp_path, monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(WG, 'np', None)
+    elif WG.np is None:
+        pytest.skip('numpy is not installed')
+    with open(tmp_path / 'NamesCounts.jsonl', 'w', encoding='utf-8') as f:
+        # Method 1 pages without votes: the method 2 votes are used
+        f.write(counts_line('Alex', 'M', [[1, 0, 0, 0, 0],
+                                          [2, 2, 0, 1, 0]]))
+        # Method 1 votes: the method 2 votes are ignored
+        f.write(counts_line('Camille', 'F', [[1, 0, 0, 1, 0],
+                                             [2, 5, 0, 0, 0]]))
+        f.write(counts_line('Jean', 'M', [[1, 3, 0, 1, 0],
+                                          [1, 4, 1, 0, 0],
+                                          [1, 6, 0, 0, 0],
+                                          [1, 0, 0, 1, 0]]))
+        f.write(counts_line('J', 'INI', []))
+    write_names(tmp_path / 'Names.txt', ['Jean', 'Alex', 'Camille', 'J',
+                                         'Marie'])
+    genders = WG.reclassify(output_dir=tmp_path,
+                            names_path=tmp_path / 'Names.txt')
+    assert genders == {'Alex': 'UNK', 'Camille': 'F', 'Jean': 'M',
+                       'J': 'INI'}
+    assert read_out(tmp_path / 'NamesOut.txt') == (
+        'Jean\tM\nAlex\tUNK\nCamille\tF\nJ\tINI\nMarie\tUNK')
+    # The first page of Jean is no longer a vote
+    genders = WG.reclassify(page_ratio=2, name_ratio=1,
+                            output_dir=tmp_path,
+                            names_path=tmp_path / 'Names.txt')
+    assert genders == {'Alex': 'M', 'Camille': 'F', 'Jean': 'M',
+                       'J': 'INI'}
+    genders = WG.reclassify(page_ratio=4, output_dir=tmp_path,
+                            names_path=tmp_path / 'Names.txt')
+    assert genders['Jean'] == 'UNI'
+
+
+def test_reclassify_gives_the_build(tmp_path, standin):
+    write_names(tmp_path / 'Names.txt', NAMES)
+    WG.build_dataset(engine='async', concurrency=4, output_dir=tmp_path,
+                     names_path=tmp_path / 'Names.txt')
+    WG.reclassify(output_dir=tmp_path, names_path=tmp_path / 'Names.txt',
+                  output_path=tmp_path / 'Reclassified.txt')
+    assert (read_out(tmp_path / 'Reclassified.txt') ==
+            read_out(tmp_path / 'NamesOut.txt'))
+
+
+def test_journal_resume(tmp_path, standin):
+    write_names(tmp_path / 'Names.txt', NAMES)
+    WG.build_dataset(engine='async', concurrency=4,
+                     output_dir=tmp_path / 'full',
+                     names_path=tmp_path / 'Names.txt')
+    # An interrupted build, with a record that must not be requested again
+    journal_path = tmp_path / 'resume' / 'NamesJournal.sqlite'
+    journal_path.parent.mkdir()
+    journal = WG.build_journal(journal_path)
+    journal.append('Marie', 'UNI', record('Marie', 'UNI',
+                                          '2021-03-04 10:00:00'))
+    journal.close()
+    WG.build_dataset(engine='async', concurrency=4,
+                     output_dir=tmp_path / 'resume',
+                     journal_path=journal_path,
+                     names_path=tmp_path / 'Names.txt')
+    full = read_out(tmp_path / 'full' / 'NamesOut.txt').split('\n')
+    resumed = read_out(tmp_path / 'resume' / 'NamesOut.txt').split('\n')
+    assert len(full) == len(resumed) == len(NAMES)
+    for line, resumed_line in zip(full, resumed):
+        if line.startswith('Marie\t'):
+            assert resumed_line == 'Marie\tUNI'
+        else:
+            assert resumed_line == line
+    journal = WG.build_journal(journal_path)
+    assert journal.names() == set(NAMES)
+    journal.close()
+
+
+def test_merge_shards(tmp_path):
+    for shard, records in enumerate([
+            [record('Jean', 'UNK', '2021-03-04 10:00:00'),
+             record('Marie', 'F', '2021-03-04 10:00:00')],
+            [record('Jean', 'M', '2021-03-05 10:00:00',
+                    'Jean Martin\nhe=3 his=1 she=0 her=0\n'),
+             record('Alex', 'UNI', '2021-03-04 10:00:00')]]):
+        (tmp_path / str(shard)).mkdir()
+        with open(tmp_path / str(shard) / 'NamesLog.txt', 'w',
+                  encoding='utf-8') as f:
+            f.write('\n\n'.join(records))
+    write_names(tmp_path / 'Names.txt', ['Marie', 'Jean', 'Alex', 'Claude'])
+    WG.merge_shards([tmp_path / '0', tmp_path / '1'],
+                    output_dir=tmp_path / 'merged',
+                    names_path=tmp_path / 'Names.txt')
+    assert read_out(tmp_path / 'merged' / 'NamesOut.txt') == (
+        'Marie\tF\nJean\tM\nAlex\tUNI\nClaude\tUNK')
+    datalog, datanames = WG.lectdatalog(tmp_path / 'merged', backup=False)
+    assert datanames == ['Alex', 'Jean', 'Marie']
+    with open(tmp_path / 'merged' / 'NamesCounts.jsonl',
+              encoding='utf-8') as f:
+        counts = {r['name']: r['pages'] for r in map(json.loads, f)}
+    assert counts == {'Alex': [], 'Jean': [[1, 3, 1, 0, 0]], 'Marie': []}
+
+
+def test_spill_set():
+    names = WG.spill_set(max_size=3)
+    names.update(['Marie', 'Jean', 'Alex'])
+    names.update(['Jean', 'Zoé', 'Camille'])
+    names.update(['Alex', 'Bob'])
+    # The first 5 names were spilled, Alex is both in a run and in memory
+    assert len(names.runs) == 1
+    assert names.names == {'Alex', 'Bob'}
+    assert list(names) == ['Alex', 'Bob', 'Camille', 'Jean', 'Marie', 'Zoé']
+    names.close()
+    assert list(names) == []
+
+
+def test_lru_memo():
+    calls = []
+
+    def tokens(name):
+        calls.append(name)
+        return name.split('-')
+
+    memo = WG.lru_memo(tokens, maxsize=2)
+    assert memo('Jean-Paul') == ['Jean', 'Paul']
+    memo('Jean-Paul').append('Marie')
+    assert memo('Jean-Paul') == ['Jean', 'Paul']
+    memo('Marie')
+    memo('Jean-Paul')
+    # Marie is the least recently used
+    memo('Alex')
+    memo('Jean-Paul')
+    memo('Marie')
+    assert calls == ['Jean-Paul', 'Marie', 'Alex', 'Marie']
+    assert memo.stats() == {'hits': 4, 'misses': 4, 'evictions': 2,
+                            'size': 2, 'maxsize': 2}
+    memo.clear()
+    assert memo.stats()['size'] == 0
+    with pytest.raises(ValueError):
+        WG.lru_memo(tokens, maxsize=0)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parsers of NamesLog.txt on the records written before and
+after the request counts were logged
+"""
+
+from datetime import datetime
+
+import pytest
+import wikipedia
+import Wiki_Gendersort as WG
+
+# Written before the request counts: the title of a missing last page is
+# followed by the 'name = H F' line
+OLD_RECORD = ('Jean\n1\n'
+              'Jean Martin\nhe=3 his=1 she=0 her=0\n'
+              'Jean Dupont - DISAMBIGUATION\n'
+              'Jean Dupont (painter)\nhe=3 his=0 she=0 her=1\n'
+              'Jean MissingJean = 2H 0F\n'
+              '2020-01-02 10:00:00.000001\n'
+              'Jean = M')
+NEW_RECORD = ('Jean\n1\n'
+              'Jean Martin\nhe=3 his=1 she=0 her=0\n'
+              'Jean Dupont - DISAMBIGUATION\n'
+              'Jean Dupont (painter)\nhe=3 his=0 she=0 her=1\n'
+              'Jean Missing\n'
+              '5 requests, 4 pages\n'
+              'Jean = 2H 0F\n'
+              '2021-03-04 10:00:00.000001\n'
+              'Jean = M')
+OLD_UNK = ('Camille\n1\nCamille = 0H 0F\n2020-01-02 10:00:00\n2\n'
+           'men=0 male=0 women=1 female=0\n'
+           'Camille = 0H 1F\n2020-01-02 10:00:01.5\nCamille = F')
+NEW_UNK = ('Camille\n1\n1 requests, 0 pages\nCamille = 0H 0F\n'
+           '2021-03-04 10:00:00.000001\n2\n'
+           'men=0 male=0 women=1 female=0\n'
+           '1 requests, 1 pages\nCamille = 0H 1F\n'
+           '2021-03-04 10:00:01.000001\nCamille = F')
+COUNTS = [[1, 3, 1, 0, 0], [1, 3, 0, 0, 1]]
+
+
+def fake_fetch(endpoint, query):
+    if endpoint == 'search':
+        return ['Jean Martin', 'Jean Dupont', 'Jean Missing']
+    if query == 'Jean Dupont':
+        raise wikipedia.exceptions.DisambiguationError(
+            query, ['Jean Dupont (painter)'])
+    if query == 'Jean Missing':
+        raise wikipedia.exceptions.PageError(query)
+    if query == 'Jean Martin':
+        return ('Jean Martin is a singer. He sang. He was born in Lyon. '
+                'He left. His album.')
+    return ('Jean Dupont is a painter. He painted her portrait. He left. '
+            'He came back.')
+
+
+def write_log(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(records))
+
+
+def test_new_record_format():
+    gender, log_data = WG.run_steps(WG.name_to_gender_steps('Jean'),
+                                    fake_fetch)
+    assert gender == 'M'
+    assert (WG.LOG_TIME.sub('', log_data) ==
+            WG.LOG_TIME.sub('', NEW_RECORD))
+
+
+@pytest.mark.parametrize('record, name, gender, time', [
+    (OLD_RECORD, 'Jean', 'M', datetime(2020, 1, 2, 10, 0, 0, 1)),
+    (NEW_RECORD, 'Jean', 'M', datetime(2021, 3, 4, 10, 0, 0, 1)),
+    (OLD_UNK, 'Camille', 'F', datetime(2020, 1, 2, 10, 0, 1, 500000)),
+    (NEW_UNK, 'Camille', 'F', datetime(2021, 3, 4, 10, 0, 1, 1))])
+def test_parse_log_record(record, name, gender, time):
+    assert WG.parse_log_record(record) == (name, gender, time)
+
+
+@pytest.mark.parametrize('record', [OLD_RECORD, NEW_RECORD])
+def test_log_counts(record):
+    assert WG.log_counts(record) == COUNTS
+
+
+def test_log_counts_method_2():
+    assert WG.log_counts(OLD_UNK) == WG.log_counts(NEW_UNK) == [
+        [2, 0, 0, 1, 0]]
+
+
+def test_lectdatalog_keeps_latest(tmp_path):
+    write_log(tmp_path / 'NamesLog.txt',
+              [NEW_RECORD, OLD_RECORD, OLD_UNK, NEW_UNK])
+    datalog, datanames = WG.lectdatalog(tmp_path, backup=False)
+    assert datanames == ['Camille', 'Jean']
+    assert [d[3] for d in datalog] == [NEW_UNK, NEW_RECORD]
+    assert [d[1] for d in datalog] == ['F', 'M']
+
+
+def test_scan_log_both_formats(tmp_path):
+    log_path = tmp_path / 'NamesLog.txt'
+    write_log(log_path, [OLD_RECORD, OLD_UNK, NEW_RECORD, NEW_UNK])
+    size = log_path.stat().st_size
+    assert WG.scan_log(log_path, chunk_size=64) == {'Jean': 'M',
+                                                    'Camille': 'F'}
+    # Both formats are complete records
+    assert log_path.stat().st_size == size
+
+
+def test_import_log_both_formats(tmp_path):
+    log_path = tmp_path / 'NamesLog.txt'
+    write_log(log_path, [NEW_RECORD, OLD_RECORD, OLD_UNK])
+    journal = WG.import_log(log_path, tmp_path / 'journal.sqlite',
+                            chunk_size=64)
+    assert journal.genders() == {'Jean': 'M', 'Camille': 'F'}
+    assert journal.log('Jean') == NEW_RECORD
+    assert journal.log('Camille') == OLD_UNK
+    journal.close()
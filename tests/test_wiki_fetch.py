@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the retries of wiki_fetch()
+"""
+
+import pytest
+import wikipedia
+import Wiki_Gendersort
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(Wiki_Gendersort, 'retry_delay', lambda attempt: 0)
+
+
+def test_rate_limit_is_retried(monkeypatch):
+    calls = []
+
+    def search(query, results=1000):
+        calls.append(query)
+        if len(calls) < 3:
+            raise wikipedia.exceptions.WikipediaException(
+                "You've exceeded your rate limit. Please wait some time and "
+                "try again.")
+        return ['Jean Martin']
+
+    monkeypatch.setattr(Wiki_Gendersort, 'search', search)
+    assert Wiki_Gendersort.wiki_fetch('search', 'Jean') == ['Jean Martin']
+    assert len(calls) == 3
+
+
+def test_maxlag_gives_throttled_error(monkeypatch):
+    def search(query, results=1000):
+        raise wikipedia.exceptions.WikipediaException(
+            'Waiting for 10.64.0.1: 5 seconds lagged.')
+
+    monkeypatch.setattr(Wiki_Gendersort, 'search', search)
+    with pytest.raises(Wiki_Gendersort.ThrottledError):
+        Wiki_Gendersort.wiki_fetch('search', 'Jean', max_retries=2)
+
+
+def test_disambiguation_options_are_not_throttling(monkeypatch):
+    calls = []
+
+    def summary(title, auto_suggest=True):
+        calls.append(title)
+        raise wikipedia.exceptions.DisambiguationError(
+            title, ['Flagged Jean', 'Jean (maxlag)', 'Jean ratelimited'])
+
+    monkeypatch.setattr(Wiki_Gendersort, 'summary', summary)
+    with pytest.raises(wikipedia.exceptions.DisambiguationError):
+        Wiki_Gendersort.wiki_fetch('summary', 'Jean')
+    assert len(calls) == 1
+
+
+def test_missing_page_is_not_throttling(monkeypatch):
+    def summary(title, auto_suggest=True):
+        raise wikipedia.exceptions.PageError('Lagged Jean')
+
+    monkeypatch.setattr(Wiki_Gendersort, 'summary', summary)
+    with pytest.raises(wikipedia.exceptions.PageError):
+        Wiki_Gendersort.wiki_fetch('summary', 'Lagged Jean')
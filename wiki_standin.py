@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Nicolas Berube, 2016-2020
+for Vincent Larivière, EBSI, University of Montreal
+
+Local stand-in for the Wikipedia API, to run and check the dataset build
+of Wiki_Gendersort without querying Wikipedia.
+
+The server answers the MediaWiki requests made by the wikipedia package
+and by the async engine of Wiki_Gendersort (search, page info, extracts and
+disambiguation page content) from a set of pages held in memory.
+    wiki = make_fixture(['Jean', 'Marie', 'Alex'])
+    server, url = serve(wiki)
+    use_standin(url)
+    name_to_gender('Jean')
+    server.shutdown()
+
+run_shards() builds the shards of a split build in separate processes,
+to check merge_shards().
+
+check_engines() builds a fixture with both engines of build_dataset()
+and raises an AssertionError if the results of some names differ. check_dump() does the same
+with build_dataset_from_dump() and a dump of the fixture, and
+check_shards() with merge_shards() and the shards of run_shards().
+"""
+
+import json
+import random
+import re
+import sys
+import gzip
+import bz2
+from threading import Thread, Lock
+from time import sleep
+from pathlib import Path
+from multiprocessing import Process
+from tempfile import TemporaryDirectory
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from html import escape
+import wikipedia
+from Wiki_Gendersort import (build_dataset, build_dataset_from_dump,
+                             merge_shards)
+
+
+SURNAMES = ['Martin', 'Tremblay', 'Smith', 'Garcia', 'Nguyen', 'Muller',
+            'Rossi', 'Kowalski', 'Silva', 'Dubois', 'Jensen', 'Tanaka',
+            'Okafor', 'Novak', 'Moreau', 'Lefebvre', 'Schmidt', 'Costa',
+            'Ivanov', 'Haddad', 'Kim', 'Lopez', 'Fischer', 'Bianchi']
+JOBS = ['chemist', 'footballer', 'poet', 'politician', 'painter',
+        'physicist', 'actor', 'novelist', 'composer', 'historian']
+
+
+class standin_wiki():
+    """Pages of the stand-in Wikipedia.
+
+    Parameters
+    ----------
+    pages: dict
+        Keys are page titles and values are the page summaries.
+
+    disambiguations: dict, optional
+        Keys are titles of disambiguation pages and values are the list of
+        page titles they refer to. Default is None.
+
+    max_concurrent: int, optional
+        If not None, requests above this number of simultaneous requests
+        are answered with HTTP 429, like a throttling server.
+        Default is None.
+
+    latency: float, optional
+        Time in seconds taken to answer each request. Default is 0.
+
+    suggestions: dict, optional
+        Keys are queries and values the title that the search suggests and
+        ranks first for them, like the spelling suggestions of Wikipedia,
+        so a client resolving titles with a search (the auto_suggest of
+        wikipedia.summary()) reaches another page. Default is None.
+
+    Search results are the titles containing all the words of the query,
+    with the suggested title and then the exact title first, in the order
+    of pages and then disambiguations.
+    """
+
+    def __init__(self,
+                 pages,
+                 disambiguations=None,
+                 max_concurrent=None,
+                 latency=0.,
+                 suggestions=None):
+        self.max_concurrent = max_concurrent
+        self.latency = latency
+        self.in_flight = 0
+        self.n_throttled = 0
+        self.lock = Lock()
+        self.pages = dict(pages)
+        self.disambiguations = dict(disambiguations or {})
+        self.suggestions = dict(suggestions or {})
+        self.titles = list(self.pages) + list(self.disambiguations)
+        self.pageids = {t: str(i+1) for i, t in enumerate(self.titles)}
+        self.n_requests = 0
+
+    def save(self, path):
+        "Saves the pages in a JSON file"
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'pages': self.pages,
+                       'disambiguations': self.disambiguations,
+                       'suggestions': self.suggestions},
+                      file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        "Imports pages saved with save()"
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data['pages'], data['disambiguations'],
+                   suggestions=data.get('suggestions'))
+
+    def search(self, query, limit):
+        "Returns the titles matching a search query"
+        words = query.lower().split()
+        results = [t for t in self.titles
+                   if t != query and
+                   all(w in t.lower().split() for w in words)]
+        if query in self.pageids:
+            results.insert(0, query)
+        if query in self.suggestions:
+            results.insert(0, self.suggestions[query])
+        return results[:limit]
+
+    def page(self, title, params):
+        "Returns the page entry of a query on a title"
+        if title not in self.pageids:
+            return '-1', {'ns': 0, 'title': title, 'missing': ''}
+        pageid = self.pageids[title]
+        page = {'pageid': int(pageid), 'ns': 0, 'title': title}
+        props = params.get('prop', '').split('|')
+        if 'info' in props:
+            page['fullurl'] = ('https://en.wikipedia.org/wiki/' +
+                               title.replace(' ', '_'))
+        if 'pageprops' in props and title in self.disambiguations:
+            page['pageprops'] = {'disambiguation': ''}
+        if 'extracts' in props:
+            if title in self.disambiguations:
+                page['extract'] = title + ' may refer to:'
+            else:
+                page['extract'] = self.pages[title]
+        if 'revisions' in props:
+            if title in self.disambiguations:
+                html = ('<p><b>' + escape(title) + '</b> may refer to:</p>'
+                        '<ul>' +
+                        ''.join('<li><a href="/wiki/%s" title="%s">%s</a>'
+                                ', %s</li>' % (escape(t), escape(t),
+                                               escape(t), 'someone')
+                                for t in self.disambiguations[title]) +
+                        '</ul>')
+            else:
+                html = '<p>' + escape(self.pages[title]) + '</p>'
+            page['revisions'] = [{'*': html}]
+        return pageid, page
+
+    def answer(self, params):
+        "Returns the JSON answer to API query parameters"
+        self.n_requests += 1
+        if params.get('list') == 'search':
+            limit = int(params.get('srlimit', 10))
+            titles = self.search(params['srsearch'], limit)
+            query = {'search': [{'ns': 0, 'title': t} for t in titles]}
+            if ('suggestion' in params.get('srinfo', '') and
+                    params['srsearch'] in self.suggestions):
+                query['searchinfo'] = {
+                    'suggestion': self.suggestions[params['srsearch']]}
+            return {'query': query}
+        pages = {}
+        titles = []
+        if 'titles' in params:
+            titles = params['titles'].split('|')
+        elif 'pageids' in params:
+            ids = {v: k for k, v in self.pageids.items()}
+            titles = [ids.get(i, '') for i in params['pageids'].split('|')]
+        for title in titles:
+            pageid, page = self.page(title, params)
+            pages[pageid] = page
+        return {'batchcomplete': '', 'query': {'pages': pages}}
+
+
+def make_handler(wiki):
+    "Builds the HTTP request handler class answering with wiki"
+
+    class standin_handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with wiki.lock:
+                wiki.in_flight += 1
+                throttled = (wiki.max_concurrent is not None and
+                             wiki.in_flight > wiki.max_concurrent)
+                if throttled:
+                    wiki.n_throttled += 1
+            try:
+                sleep(wiki.latency)
+                if throttled:
+                    body = b'Too many requests'
+                    self.send_response(429)
+                else:
+                    url = urlsplit(self.path)
+                    params = {k: v[0] for k, v in
+                              parse_qs(url.query,
+                                       keep_blank_values=True).items()}
+                    body = json.dumps(wiki.answer(params)).encode('utf-8')
+                    self.send_response(200)
+            finally:
+                with wiki.lock:
+                    wiki.in_flight -= 1
+            self.send_header('Content-Type',
+                             'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return standin_handler
+
+
+def serve(wiki, port=0):
+    """Starts the stand-in server in a background thread.
+
+    Parameters
+    ----------
+    wiki: standin_wiki
+        Pages to serve.
+
+    port: int, optional
+        Port of the server on localhost. Default is 0 (any free port).
+
+    Returns
+    -------
+    tuple
+        The server (stop it with server.shutdown()) and the URL of its
+        api.php endpoint.
+    """
+    class standin_server(ThreadingHTTPServer):
+        # Many clients connect at once
+        request_queue_size = 1024
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # Clients stopped early close their connections
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    server = standin_server(('127.0.0.1', port), make_handler(wiki))
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%i/w/api.php' % server.server_address[1]
+    return server, url
+
+
+def use_standin(url):
+    "Makes the wikipedia package query the stand-in server at url"
+    wikipedia.wikipedia.API_URL = url
+    wikipedia.wikipedia.search.clear_cache()
+    wikipedia.wikipedia.summary.clear_cache()
+
+
+TIME_LOG = r'(?m)^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(\.\d+)?\n'
+REQUESTS_LINE = r'(?m)^\d+ requests(, \d+ pages)?\n'
+
+
+def fixture_names(n_names=150):
+    """Returns the first n_names names of data_compare/USCensusOut.txt,
+    an empty name and initials, to build a fixture"""
+    path = (Path(__file__).parent.absolute() / 'data_compare'
+            / 'USCensusOut.txt')
+    with open(path, encoding='utf-8') as file:
+        names = [line.split('\t')[0].capitalize()
+                 for line in file.read().split('\n')[:n_names]]
+    return names + ['J', '']
+
+
+def log_texts(log_path):
+    """Returns the record of each name of a log file without its time
+    lines, to compare builds"""
+    records = {}
+    with open(log_path, encoding='utf-8') as file:
+        for d in file.read().split('\n\n'):
+            records[d.split('\n')[0]] = re.sub(TIME_LOG, '', d)
+    return records
+
+
+def compare_builds(dir_a, dir_b, ignore=None):
+    """Returns the names whose line of NamesOut.txt or record of NamesLog.txt
+    differ between the builds in two directories. The lines of the records
+    matching the regular expression ignore are not compared."""
+    outs = []
+    for out_dir in (dir_a, dir_b):
+        with open(Path(out_dir) / 'NamesOut.txt', encoding='utf-8') as file:
+            outs.append(file.read().split('\n'))
+    errors = {line.split('\t')[0] for line_a, line_b in zip(*outs)
+              for line in (line_a, line_b) if line_a != line_b}
+    if len(outs[0]) != len(outs[1]):
+        errors.add('NamesOut.txt')
+    logs = [log_texts(Path(out_dir) / 'NamesLog.txt')
+            for out_dir in (dir_a, dir_b)]
+    if ignore is not None:
+        logs = [{name: re.sub(ignore, '', d) for name, d in log.items()}
+                for log in logs]
+    errors |= {name for name in set(logs[0]) | set(logs[1])
+               if logs[0].get(name) != logs[1].get(name)}
+    return sorted(errors)
+
+
+def check_engines(n_names=150,
+                  seed=0,
+                  n_pool=4):
+    """Checks that the pool and async engines of build_dataset() give the
+    same NamesOut.txt and log records on a fixture served by the stand-in
+    server.
+
+    Raises an AssertionError listing the names with a different result.
+    """
+    print('Checking the pool engine against the async engine')
+    names = fixture_names(n_names)
+    server, url = serve(make_fixture(names, seed=seed))
+    try:
+        use_standin(url)
+        with TemporaryDirectory() as temp_dir:
+            names_path = Path(temp_dir) / 'Names.txt'
+            with open(names_path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(names))
+            for engine in ('pool', 'async'):
+                build_dataset(engine=engine, n_pool=n_pool,
+                              share_pages=False, names_path=names_path,
+                              output_dir=Path(temp_dir) / engine)
+            errors = compare_builds(Path(temp_dir) / 'pool',
+                                    Path(temp_dir) / 'async')
+    finally:
+        server.shutdown()
+    print('%i differences out of %i names' % (len(errors), len(names)))
+    assert not errors, 'Different results for %r' % errors[:20]
+
+
+def check_dump(n_names=150,
+               seed=0,
+               kind='articles'):
+    """Checks that build_dataset_from_dump() on a dump of a fixture (see
+    make_dump()) gives the same NamesOut.txt and log records as
+    build_dataset() querying the fixture through the stand-in server.
+    The request counts of the logs are not compared, since the dump build
+    takes the pages from its index.
+
+    Raises an AssertionError listing the names with a different result.
+    """
+    print('Checking the dump build against the API build')
+    names = fixture_names(n_names)
+    wiki = make_fixture(names, seed=seed)
+    server, url = serve(wiki)
+    try:
+        use_standin(url)
+        with TemporaryDirectory() as temp_dir:
+            names_path = Path(temp_dir) / 'Names.txt'
+            with open(names_path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(names))
+            build_dataset(n_pool=4, share_pages=False, names_path=names_path,
+                          output_dir=Path(temp_dir) / 'api')
+            suffix = '.xml.bz2' if kind == 'articles' else '.xml.gz'
+            dump_path = Path(temp_dir) / ('dump' + suffix)
+            make_dump(wiki, dump_path, kind)
+            build_dataset_from_dump(dump_path, workers=2,
+                                    names_path=names_path,
+                                    output_dir=Path(temp_dir) / 'dump')
+            errors = compare_builds(Path(temp_dir) / 'api',
+                                    Path(temp_dir) / 'dump',
+                                    ignore=REQUESTS_LINE)
+    finally:
+        server.shutdown()
+    print('%i differences out of %i names' % (len(errors), len(names)))
+    assert not errors, 'Different results for %r' % errors[:20]
+
+
+def build_shard(url, shard, n_shards, output_dir, kwargs):
+    "Builds a shard of Names.txt in a process, with the stand-in server"
+    use_standin(url)
+    build_dataset(shard=shard, n_shards=n_shards, output_dir=output_dir,
+                  **kwargs)
+
+
+def run_shards(url, n_shards, output_dir, **kwargs):
+    """Builds the shards of Names.txt at the same time in separate
+    processes, as separate machines would, with the stand-in server at url.
+
+    Parameters
+    ----------
+    url: str
+        URL of the stand-in server, as returned by serve().
+
+    n_shards: int
+        Number of shards (and processes).
+
+    output_dir: str or Path
+        Directory where the directories of the shards are created.
+
+    kwargs:
+        Other arguments of build_dataset().
+
+    Returns
+    -------
+    list of Path
+        Directories of the shards, to merge with merge_shards().
+    """
+    shard_dirs = [Path(output_dir) / ('shard_%i' % shard)
+                  for shard in range(n_shards)]
+    processes = [Process(target=build_shard,
+                         args=(url, shard, n_shards, shard_dirs[shard],
+                               kwargs))
+                 for shard in range(n_shards)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return shard_dirs
+
+
+def check_shards(n_names=150,
+                 seed=0,
+                 n_shards=3):
+    """Checks that merge_shards() on the shards built by run_shards() gives
+    the same NamesOut.txt and log records as a single build of a fixture.
+
+    Raises an AssertionError listing the names with a different result.
+    """
+    print('Checking the merged shards against a single build')
+    names = fixture_names(n_names)
+    server, url = serve(make_fixture(names, seed=seed))
+    try:
+        use_standin(url)
+        with TemporaryDirectory() as temp_dir:
+            names_path = Path(temp_dir) / 'Names.txt'
+            with open(names_path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(names))
+            build_dataset(n_pool=4, names_path=names_path,
+                          output_dir=Path(temp_dir) / 'single')
+            shard_dirs = run_shards(url, n_shards, Path(temp_dir) / 'shards',
+                                    n_pool=4, names_path=names_path)
+            merge_shards(shard_dirs, Path(temp_dir) / 'merged',
+                         names_path=names_path)
+            errors = compare_builds(Path(temp_dir) / 'single',
+                                    Path(temp_dir) / 'merged')
+    finally:
+        server.shutdown()
+    print('%i differences out of %i names' % (len(errors), len(names)))
+    assert not errors, 'Different results for %r' % errors[:20]
+
+
+def make_dump(wiki, path, kind='articles'):
+    """Writes the pages of a stand-in Wikipedia as a Wikipedia XML dump, to
+    check build_dataset_from_dump().
+
+    Parameters
+    ----------
+    wiki: standin_wiki
+        Pages to write.
+
+    path: str or Path
+        Path of the dump. It is compressed if it ends with .gz or .bz2.
+
+    kind: str, optional
+        'articles' for a pages-articles dump, where pages have wikitext
+        with templates and sections around their summary, or 'abstract'
+        for an abstracts dump. Default is 'articles'.
+    """
+    parts = []
+    if kind == 'abstract':
+        parts.append('<feed>\n')
+        for title in wiki.titles:
+            if title in wiki.disambiguations:
+                abstract = title + ' may refer to:'
+            else:
+                abstract = wiki.pages[title].replace('\n', ' ')
+            parts.append('<doc>\n<title>Wikipedia: %s</title>\n'
+                         '<url>https://en.wikipedia.org/wiki/%s</url>\n'
+                         '<abstract>%s</abstract>\n<links>\n</links>\n'
+                         '</doc>\n' % (escape(title),
+                                       escape(title.replace(' ', '_')),
+                                       escape(abstract)))
+        parts.append('</feed>\n')
+    else:
+        parts.append('<mediawiki>\n')
+        for title in wiki.titles:
+            if title in wiki.disambiguations:
+                text = ("'''%s''' may refer to:\n" % title +
+                        ''.join('* [[%s]], someone\n' % t
+                                for t in wiki.disambiguations[title]) +
+                        '\n{{disambiguation|human name}}')
+            else:
+                text = ('{{Short description|Someone}}\n'
+                        '{{Infobox person\n| name = %s\n| image = '
+                        '{{CSS image crop|Image=x.jpg}}\n}}\n' % title +
+                        wiki.pages[title] +
+                        '<ref>{{cite web|title=Biography}}</ref>\n\n'
+                        '== Career ==\nHe and she were.\n\n'
+                        '== References ==\n{{reflist}}\n'
+                        '[[Category:Living people]]')
+            parts.append('  <page>\n    <title>%s</title>\n    <ns>0</ns>\n'
+                         '    <id>%s</id>\n    <revision>\n'
+                         '      <text bytes="%i" xml:space="preserve">%s'
+                         '</text>\n    </revision>\n  </page>\n' %
+                         (escape(title), wiki.pageids[title],
+                          len(text.encode('utf-8')), escape(text)))
+        parts.append('</mediawiki>\n')
+    data = ''.join(parts).encode('utf-8')
+    path = str(path)
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wb') as file:
+            file.write(data)
+    elif path.endswith('.bz2'):
+        with bz2.open(path, 'wb') as file:
+            file.write(data)
+    else:
+        with open(path, 'wb') as file:
+            file.write(data)
+
+
+def make_fixture(names,
+                 seed=0,
+                 max_pages=25,
+                 p_suggest=0.1):
+    """Builds a stand-in Wikipedia with pages about people named after
+    first names.
+
+    Each name gets between 0 and max_pages pages 'Name Surname' whose
+    summaries use masculine or feminine pronouns, mostly consistently
+    depending on the name, and some disambiguation pages that refer to
+    existing and missing pages. For a share p_suggest of the pages, the
+    search suggests another page first (see standin_wiki()).
+
+    Parameters
+    ----------
+    names: list of str
+        First names.
+
+    seed: int, optional
+        Random seed. Default is 0.
+
+    max_pages: int, optional
+        Maximum number of pages per name. Default is 25.
+
+    p_suggest: float, optional
+        Share of the pages for which the search suggests another page.
+        Default is 0.1.
+
+    Returns
+    -------
+    standin_wiki
+    """
+    rnd = random.Random(seed)
+    pages = {}
+    disambiguations = {}
+    for name in names:
+        p_male = rnd.choice([0.02, 0.1, 0.5, 0.9, 0.98])
+        surnames = rnd.sample(SURNAMES, rnd.randint(0, len(SURNAMES)))
+        for surname in surnames[:max_pages]:
+            title = name + ' ' + surname
+            if rnd.random() < 0.15:
+                options = [title + ' (%s)' % job
+                           for job in rnd.sample(JOBS, rnd.randint(1, 4))]
+                for option in options:
+                    if rnd.random() < 0.8:
+                        pages[option] = person_summary(option, rnd,
+                                                       p_male)
+                disambiguations[title] = options
+            else:
+                pages[title] = person_summary(title, rnd, p_male)
+    titles = list(pages)
+    suggestions = {}
+    for title in titles:
+        if rnd.random() < p_suggest:
+            suggestions[title] = rnd.choice(titles)
+    return standin_wiki(pages, disambiguations, suggestions=suggestions)
+
+
+def person_summary(title, rnd, p_male):
+    "Returns a random summary of a page about a person"
+    if rnd.random() < p_male:
+        he, his = 'He', 'his'
+    else:
+        he, his = 'She', 'her'
+    if rnd.random() < 0.1:
+        return title + ' (born %i) is a %s.' % (rnd.randint(1900, 2000),
+                                               rnd.choice(JOBS))
+    return (title + ' (born %i) is a %s.\n' % (rnd.randint(1900, 2000),
+                                              rnd.choice(JOBS)) +
+            '%s is known for %s work, and %s studied in Paris. ' %
+            (he, his, he.lower()) +
+            'In %i, %s (%s) received an award for %s research.' %
+            (rnd.randint(1950, 2020), he.lower(), title, his))